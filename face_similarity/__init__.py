@@ -65,6 +65,9 @@ def create_app():
     # Face distance controller
     from face_similarity.controller.face_distance_controller import face_distance
     app.register_blueprint(face_distance)
+    # Gallery controller
+    from face_similarity.controller.gallery_controller import gallery
+    app.register_blueprint(gallery)
     # Logger
     logging.getLogger('face_similarity.init').info('Application created, ready to up.')
     return app
@@ -0,0 +1,278 @@
+"""
+ASGI entry point. The face-distance and gallery endpoints run as coroutines
+on the event loop of the server, so one worker serves many concurrent
+comparisons while they wait on the upstream APIs, sharing the pooled
+connections and caches of the worker. Any other route (/, /docs, /metrics)
+is served by the Flask application in a thread.
+
+    gunicorn -k uvicorn.workers.UvicornWorker face_similarity.asgi:app
+"""
+import asyncio
+import io
+import logging
+import sys
+import time
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.wrappers import Request
+
+from face_similarity import create_app
+from face_similarity.service.face_similarity_service import \
+    FaceSimilarityService
+from face_similarity.service.gallery_service import GalleryService
+from face_similarity.utils.http_client import HttpClient
+from face_similarity.utils.middleware_controller import (
+    http_concurrent_request_count, observe_request, observe_request_size)
+from face_similarity.utils.payload_builder import PayloadBuilder
+from face_similarity.utils.process_pool import ProcessPool
+from face_similarity.utils.response_error import error_status, response
+
+
+class AsgiApplication:
+    """
+    Minimal ASGI application (HTTP and lifespan scopes) of the API.
+    """
+
+    def __init__(self, wsgi_app):
+        """
+        Class Constructor.
+        Args:
+            wsgi_app: (Flask) Application serving the other routes.
+        """
+        self.wsgi_app = wsgi_app
+        self.routes = {
+            ('POST', '/image/face-distance'): self.face_distance,
+            ('POST', '/image/face-distance/batch'): self.face_distance_batch,
+            ('POST', '/gallery/enroll'): self.gallery_enroll,
+            ('POST', '/gallery/search'): self.gallery_search,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        start_time = time.time()
+        body = await self.read_body(receive)
+        if body is None:
+            return
+        method, path = scope['method'], scope['path']
+        metric = 'metric' not in path
+        if metric:
+            http_concurrent_request_count.inc()
+            observe_request_size(method, path, len(body))
+        try:
+            environ = self.environ(scope, body)
+            handler = self.routes.get((method, path))
+            if handler is None:
+                status, headers, body = await asyncio.get_event_loop(
+                    ).run_in_executor(None, self.call_wsgi, environ)
+            else:
+                status, headers, body = await self.call_handler(
+                    handler, Request(environ))
+        finally:
+            if metric:
+                http_concurrent_request_count.dec()
+        if metric:
+            observe_request(
+                method, path, status, time.time() - start_time, len(body))
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(name.lower().encode('latin-1'),
+                                 value.encode('latin-1'))
+                                for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    @staticmethod
+    async def lifespan(receive, send) -> None:
+        """
+        Answer the startup and shutdown events of the server, closing the
+        pooled upstream connections and stopping the image process pool on
+        shutdown.
+        Args:
+            receive: (callable) ASGI receive channel.
+            send: (callable) ASGI send channel.
+        """
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await HttpClient.close()
+                ProcessPool.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def read_body(receive) -> bytes:
+        """
+        Read the request body sent in chunks.
+        Args:
+            receive: (callable) ASGI receive channel.
+        Returns:
+            (bytes) Request body, None when the client disconnected.
+        """
+        chunks, more_body = list(), True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+    @staticmethod
+    def environ(scope, body) -> dict:
+        """
+        Build the WSGI environment of a request, used to parse it with the
+        same werkzeug request of the Flask controllers.
+        Args:
+            scope: (dict) ASGI connection scope.
+            body: (bytes) Request body.
+        Returns:
+            (dict) WSGI environment.
+        """
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = 'HTTP_' + name
+                environ[key] = environ[key] + ',' + value \
+                    if key in environ else value
+        return environ
+
+    def call_wsgi(self, environ) -> tuple:
+        """
+        Serve a request with the Flask application.
+        Args:
+            environ: (dict) WSGI environment.
+        Returns:
+            (tuple) Status code, headers and body.
+        """
+        started = list()
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [int(status.split(' ', 1)[0]), headers]
+
+        chunks = self.wsgi_app(environ, start_response)
+        try:
+            body = b''.join(chunks)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        return started[0], started[1], body
+
+    @staticmethod
+    async def call_handler(handler, request) -> tuple:
+        """
+        Run a native handler, mapping the errors of the API to the same
+        responses of the Flask error handlers (response_error).
+        Args:
+            handler: (coroutine function) Handler of the route.
+            request: (Request) Parsed request.
+        Returns:
+            (tuple) Status code, headers and body.
+        """
+        try:
+            body, status = await handler(request), 200
+        except asyncio.CancelledError:
+            raise
+        except HTTPException as exception:
+            body = response(exception.code) or {
+                'detail': exception.description}
+            status = error_status.get(exception.code, exception.code)
+        except Exception:
+            logging.getLogger('face_similarity.api').exception(
+                'ASGI > unhandled error')
+            body, status = {'detail': 'Internal Server Error'}, 500
+        return status, [('Content-Type', 'application/json')], \
+            PayloadBuilder.dumps(body)
+
+    @staticmethod
+    async def parse(validate, *args):
+        """
+        Parse the JSON body and decode the base64 images of a request in the
+        executor of the loop, as the Flask routes do in their thread, so a
+        large upload does not block the other requests of the loop.
+        Args:
+            validate: (callable) Validation of ApiUtil (is_valid_*).
+            args: (any) Request and other arguments of the validation.
+        Returns:
+            (any) Result of the validation.
+        """
+        return await asyncio.get_event_loop().run_in_executor(
+            None, lambda: validate(*args))
+
+    @staticmethod
+    async def face_distance(request) -> dict:
+        """Fase Similarity endpoint handler (/image/face-distance)."""
+        similarity_service = FaceSimilarityService()
+        image_1, image_2 = await AsgiApplication.parse(
+            similarity_service.utils.is_valid_request, request)
+        return {'similarity': await similarity_service.vector_comparison(
+            image_1, image_2)}
+
+    @staticmethod
+    async def face_distance_batch(request) -> dict:
+        """Fase Similarity batch endpoint handler
+        (/image/face-distance/batch)."""
+        similarity_service = FaceSimilarityService()
+        images, pairs = await AsgiApplication.parse(
+            similarity_service.utils.is_valid_batch_request, request,
+            similarity_service.utils.environ_default('BATCH_MAX_IMAGES', 64))
+        return {'results': await similarity_service.batch_comparison(
+            images, pairs)}
+
+    @staticmethod
+    async def gallery_enroll(request) -> dict:
+        """Gallery enrollment endpoint handler (/gallery/enroll)."""
+        similarity_service = FaceSimilarityService()
+        params = await AsgiApplication.parse(
+            similarity_service.utils.is_valid_gallery_request, request,
+            ['subject_id', 'image'])
+        vector = (await similarity_service.get_face_vector(
+            params['image']))[0]
+        # SQLite write and matrix update, outside the loop.
+        await asyncio.get_event_loop().run_in_executor(
+            None, GalleryService.instance().enroll, params['subject_id'],
+            vector)
+        return {'subject_id': params['subject_id']}
+
+    @staticmethod
+    async def gallery_search(request) -> dict:
+        """Gallery identification (1 x N) endpoint handler
+        (/gallery/search)."""
+        similarity_service = FaceSimilarityService()
+        params = await AsgiApplication.parse(
+            similarity_service.utils.is_valid_gallery_request, request,
+            ['image'])
+        vector = (await similarity_service.get_face_vector(
+            params['image']))[0]
+        # Scan of the gallery matrix, outside the loop.
+        results = await asyncio.get_event_loop().run_in_executor(
+            None, GalleryService.instance().search, vector,
+            params.get('top_k', 5))
+        return {'results': results}
+
+
+app = AsgiApplication(create_app())
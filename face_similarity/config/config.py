@@ -28,6 +28,15 @@ def get_threads():
     return thread
 
 
+def worker_exit(server, worker):
+    """
+    Gunicorn hook, close the pooled upstream connections and stop the event
+    loop of the worker.
+    """
+    from face_similarity.utils.event_loop import WorkerLoop
+    WorkerLoop.shutdown()
+
+
 bind = "0.0.0.0:9000"
 workers = get_workers()
 timeout = 3 * 60  # 3 minutes
@@ -1,6 +1,4 @@
 
-import asyncio
-
 from flask import Blueprint, jsonify, request
 
 from face_similarity.service.face_similarity_service import \
@@ -13,18 +11,37 @@ face_distance = Blueprint('face_distance', __name__)
 def face_distance_post():
     """Fase Similarity endpoint handler.
     Args:
-        img1 (str): Base64 encoded image.
-        img2 (str): Base64 encoded image.
+        img1 (str): Base64 encoded image (JSON) or image file (multipart).
+        img2 (str): Base64 encoded image (JSON) or image file (multipart).
     Returns:
         dict: The distance score.
     """
     similarity_service = FaceSimilarityService()
-    base64_1, base64_2 = similarity_service.utils.is_valid_request(request)
-    # Start loops.
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    # Start similarity service and get trust score.
+    image_1, image_2 = similarity_service.utils.is_valid_request(request)
+    # Start similarity service in the worker loop and get trust score.
     confidence_score = similarity_service.start_vector_comparison_task(
-        base64_1, base64_2, loop)
+        image_1, image_2)
     # Return response.
     return jsonify({'similarity': confidence_score}), 200
+
+
+@face_distance.route('/image/face-distance/batch', methods=['POST'])
+def face_distance_batch_post():
+    """Fase Similarity batch endpoint handler.
+    Args:
+        images (list): Base64 encoded images (JSON) or image files
+                       (multipart).
+        pairs (list): Pairs of image indexes to compare.
+        probe (int): Index of the image compared with all the others
+                     (instead of pairs).
+    Returns:
+        dict: The distance score of each pair.
+    """
+    similarity_service = FaceSimilarityService()
+    images, pairs = similarity_service.utils.is_valid_batch_request(
+        request, similarity_service.utils.environ_default(
+            'BATCH_MAX_IMAGES', 64))
+    # Start similarity service in the worker loop and get trust scores.
+    results = similarity_service.start_batch_comparison_task(images, pairs)
+    # Return response.
+    return jsonify({'results': results}), 200
@@ -0,0 +1,49 @@
+
+from flask import Blueprint, jsonify, request
+
+from face_similarity.service.face_similarity_service import \
+    FaceSimilarityService
+from face_similarity.service.gallery_service import GalleryService
+
+gallery = Blueprint('gallery', __name__)
+
+
+@gallery.route('/gallery/enroll', methods=['POST'])
+def gallery_enroll_post():
+    """Gallery enrollment endpoint handler.
+    Args:
+        subject_id (str): Subject identifier.
+        image (str): Base64 encoded image (JSON), image file (multipart) or
+                     the body (octet-stream).
+    Returns:
+        dict: The enrolled subject.
+    """
+    similarity_service = FaceSimilarityService()
+    params = similarity_service.utils.is_valid_gallery_request(
+        request, ['subject_id', 'image'])
+    # Start similarity service in the worker loop and get the vector.
+    vector = similarity_service.start_face_vector_task(params['image'])
+    GalleryService.instance().enroll(params['subject_id'], vector)
+    # Return response.
+    return jsonify({'subject_id': params['subject_id']}), 200
+
+
+@gallery.route('/gallery/search', methods=['POST'])
+def gallery_search_post():
+    """Gallery identification (1 x N) endpoint handler.
+    Args:
+        image (str): Base64 encoded image (JSON), image file (multipart) or
+                     the body (octet-stream).
+        top_k (int): Number of subjects returned (default 5).
+    Returns:
+        dict: The most similar subjects.
+    """
+    similarity_service = FaceSimilarityService()
+    params = similarity_service.utils.is_valid_gallery_request(
+        request, ['image'])
+    # Start similarity service in the worker loop and get the vector.
+    vector = similarity_service.start_face_vector_task(params['image'])
+    results = GalleryService.instance().search(
+        vector, params.get('top_k', 5))
+    # Return response.
+    return jsonify({'results': results}), 200
@@ -1,12 +1,15 @@
+import atexit
 import logging
 import os
 
 from face_similarity import create_app
+from face_similarity.utils.event_loop import WorkerLoop
 from face_similarity.utils.middleware_controller import \
     setup_metrics
 
 app = create_app()
 setup_metrics(app)
+atexit.register(WorkerLoop.shutdown)
 
 
 def start_server():
@@ -0,0 +1,294 @@
+import numpy as np
+
+
+class AnnIndexService:
+    """
+    Approximate nearest neighbour index for large galleries, built with
+    NumPy. The vectors are split in lists by a k-means coarse quantizer
+    (IVF) and a search only scans the lists closest to the probe. Inside
+    each list the vectors are stored as they are or, optionally, compressed
+    with product quantization (PQ) of the residuals.
+    """
+
+    def __init__(self, n_lists=1024, n_probe=16, pq_subspaces=0,
+                 iterations=20, seed=0):
+        """
+        Class Constructor.
+        Args:
+            n_lists: (int) Number of k-means lists (coarse centroids).
+            n_probe: (int) Number of lists scanned by a search.
+            pq_subspaces: (int) Number of PQ subspaces, 0 stores the vectors.
+            iterations: (int) Number of k-means iterations.
+            seed: (int) Seed of the k-means initialization.
+        """
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.pq_subspaces = pq_subspaces
+        self.iterations = iterations
+        self.random = np.random.RandomState(seed)
+        self.centroids = None
+        self.codebooks = None
+        self.lists = list()
+        self.positions = dict()
+        self.trained_size = 0
+
+    def untrained_copy(self):
+        """
+        Get an empty index with the same parameters, to be trained apart
+        while this one keeps serving searches.
+        Returns:
+            (AnnIndexService) Untrained index.
+        """
+        return AnnIndexService(
+            self.n_lists, self.n_probe, self.pq_subspaces, self.iterations,
+            self.random.randint(2 ** 31))
+
+    @property
+    def trained(self) -> bool:
+        """
+        Index is ready to receive vectors.
+        Returns:
+            (bool) True after training.
+        """
+        return self.centroids is not None
+
+    def train(self, vectors) -> None:
+        """
+        Train the coarse quantizer (and the PQ codebooks) with a sample of
+        the vectors. Vectors previously added are discarded.
+        Args:
+            vectors: (np.ndarray) Training vectors (N x 128).
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        sample = vectors[self.random.permutation(len(vectors))[
+            :256 * self.n_lists]]
+        n_lists = min(self.n_lists, len(sample))
+        self.centroids = self.kmeans(sample, n_lists)
+        if self.pq_subspaces:
+            residuals = sample - self.centroids[
+                self.assign(sample, self.centroids)]
+            self.codebooks = np.stack([
+                self.kmeans(subspace, min(256, len(sample)))
+                for subspace in self.split(residuals)])
+        self.lists = [IndexList(self.code_size()) for _ in range(n_lists)]
+        self.positions = dict()
+        self.trained_size = len(vectors)
+
+    def add(self, ids, vectors) -> None:
+        """
+        Insert vectors in the closest lists. An id already indexed is
+        replaced.
+        Args:
+            ids: (np.ndarray) Identifier of each vector.
+            vectors: (np.ndarray) Vectors (N x 128).
+        """
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, 128)
+        assignment = self.assign(vectors, self.centroids)
+        codes = self.encode(vectors, assignment)
+        for i in ids.tolist():
+            self.remove(i)
+        # Append the vectors of each list at once.
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.flatnonzero(np.diff(assignment[order])) + 1
+        for group in np.split(order, bounds):
+            if len(group) == 0:
+                continue
+            list_id = int(assignment[group[0]])
+            start = self.lists[list_id].extend(ids[group], codes[group])
+            for offset, i in enumerate(ids[group].tolist()):
+                self.positions[i] = (list_id, start + offset)
+
+    def remove(self, i) -> None:
+        """
+        Remove a vector from the index.
+        Args:
+            i: (int) Identifier of the vector.
+        """
+        position = self.positions.pop(i, None)
+        if position is not None:
+            self.lists[position[0]].ids[position[1]] = -1
+
+    def search(self, vector, k, n_probe=None) -> tuple:
+        """
+        Get the approximate k nearest vectors.
+        Args:
+            vector: (np.ndarray) Probe vector (128).
+            k: (int) Number of neighbours.
+            n_probe: (int) Number of lists scanned, default of the index.
+        Returns:
+            (tuple) Identifiers and distances, nearest first.
+        """
+        probe = np.asarray(vector, dtype=np.float32).reshape(128)
+        n_probe = min(n_probe or self.n_probe, len(self.lists))
+        coarse = self.squared_distances(probe[np.newaxis], self.centroids)[0]
+        ids, distances = list(), list()
+        for list_id in np.argpartition(coarse, n_probe - 1)[:n_probe]:
+            index_list = self.lists[list_id]
+            if index_list.size == 0:
+                continue
+            ids.append(index_list.ids[:index_list.size])
+            distances.append(self.list_distances(
+                probe, list_id, index_list.codes[:index_list.size]))
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, np.float32)
+        ids, distances = np.concatenate(ids), np.concatenate(distances)
+        distances[ids < 0] = np.inf
+        k = min(k, int(np.sum(ids >= 0)))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, np.float32)
+        best = np.argpartition(distances, k - 1)[:k]
+        best = best[np.argsort(distances[best])]
+        return ids[best], np.sqrt(np.maximum(distances[best], 0))
+
+    def list_distances(self, probe, list_id, codes) -> np.ndarray:
+        """
+        Squared distances between the probe and the vectors of a list,
+        asymmetric (probe is not quantized) when PQ is used.
+        Args:
+            probe: (np.ndarray) Probe vector (128).
+            list_id: (int) List identifier.
+            codes: (np.ndarray) Vectors or PQ codes of the list.
+        Returns:
+            (np.ndarray) Squared distances.
+        """
+        if not self.pq_subspaces:
+            return self.squared_distances(probe[np.newaxis], codes)[0]
+        residual = (probe - self.centroids[list_id])[np.newaxis]
+        table = np.stack([
+            self.squared_distances(subspace, codebook)[0]
+            for subspace, codebook in zip(
+                self.split(residual), self.codebooks)])
+        return table[np.arange(self.pq_subspaces), codes].sum(axis=1)
+
+    def encode(self, vectors, assignment) -> np.ndarray:
+        """
+        Code stored in the lists for each vector.
+        Args:
+            vectors: (np.ndarray) Vectors (N x 128).
+            assignment: (np.ndarray) List of each vector.
+        Returns:
+            (np.ndarray) Vectors, or PQ codes of their residuals.
+        """
+        if not self.pq_subspaces:
+            return vectors
+        residuals = vectors - self.centroids[assignment]
+        return np.stack([
+            self.assign(subspace, codebook) for subspace, codebook in zip(
+                self.split(residuals), self.codebooks)], axis=1).astype(
+            np.uint8)
+
+    def code_size(self) -> tuple:
+        """
+        Shape and type of the code of one vector.
+        Returns:
+            (tuple) Width and dtype.
+        """
+        if self.pq_subspaces:
+            return self.pq_subspaces, np.uint8
+        return 128, np.float32
+
+    def split(self, vectors) -> list:
+        """
+        Split vectors in the PQ subspaces.
+        Args:
+            vectors: (np.ndarray) Vectors (N x 128).
+        Returns:
+            (list) One array per subspace.
+        """
+        return np.split(vectors, self.pq_subspaces, axis=1)
+
+    def kmeans(self, vectors, k) -> np.ndarray:
+        """
+        Lloyd k-means, initialized with a random sample of the vectors.
+        Args:
+            vectors: (np.ndarray) Vectors (N x D).
+            k: (int) Number of centroids.
+        Returns:
+            (np.ndarray) Centroids (k x D).
+        """
+        centroids = vectors[self.random.choice(
+            len(vectors), k, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignment = self.assign(vectors, centroids)
+            counts = np.bincount(assignment, minlength=k)
+            filled = counts > 0
+            starts = np.cumsum(counts) - counts
+            sums = np.add.reduceat(
+                vectors[np.argsort(assignment, kind='stable')],
+                starts[filled], axis=0)
+            centroids[filled] = sums / counts[filled, np.newaxis]
+            # Empty clusters restart at random vectors.
+            empty = np.flatnonzero(~filled)
+            centroids[empty] = vectors[self.random.choice(
+                len(vectors), len(empty))]
+        return centroids
+
+    def assign(self, vectors, centroids, chunk=8192) -> np.ndarray:
+        """
+        Nearest centroid of each vector, computed by chunks.
+        Args:
+            vectors: (np.ndarray) Vectors (N x D).
+            centroids: (np.ndarray) Centroids (k x D).
+            chunk: (int) Vectors per chunk.
+        Returns:
+            (np.ndarray) Index of the nearest centroid.
+        """
+        return np.concatenate([
+            self.squared_distances(
+                vectors[i:i + chunk], centroids).argmin(axis=1)
+            for i in range(0, len(vectors), chunk)] or [
+            np.empty(0, dtype=np.int64)])
+
+    @staticmethod
+    def squared_distances(vectors_1, vectors_2) -> np.ndarray:
+        """
+        Squared euclidean distance between every pair of vectors.
+        Args:
+            vectors_1: (np.ndarray) Vectors (M x D).
+            vectors_2: (np.ndarray) Vectors (N x D).
+        Returns:
+            (np.ndarray) Distances (M x N).
+        """
+        return (np.einsum('ij,ij->i', vectors_1, vectors_1)[:, np.newaxis]
+                - 2.0 * vectors_1.dot(vectors_2.T)
+                + np.einsum('ij,ij->i', vectors_2, vectors_2)[np.newaxis])
+
+
+class IndexList:
+    """
+    Growable list of identifiers and codes of one IVF list. Removed entries
+    keep their slot with identifier -1.
+    """
+
+    def __init__(self, code_size):
+        """
+        Class Constructor.
+        Args:
+            code_size: (tuple) Width and dtype of the code of one vector.
+        """
+        self.size = 0
+        self.ids = np.empty(0, dtype=np.int64)
+        self.codes = np.empty((0, code_size[0]), dtype=code_size[1])
+
+    def extend(self, ids, codes) -> int:
+        """
+        Append codes, growing the arrays when full.
+        Args:
+            ids: (np.ndarray) Identifier of each vector.
+            codes: (np.ndarray) Vectors or PQ codes.
+        Returns:
+            (int) Position in the list of the first code.
+        """
+        start, end = self.size, self.size + len(ids)
+        if end > len(self.ids):
+            capacity = max(16, 2 * len(self.ids), end)
+            grown_ids = np.empty(capacity, dtype=np.int64)
+            grown_codes = np.empty((capacity, self.codes.shape[1]),
+                                   dtype=self.codes.dtype)
+            grown_ids[:start] = self.ids[:start]
+            grown_codes[:start] = self.codes[:start]
+            self.ids, self.codes = grown_ids, grown_codes
+        self.ids[start:end], self.codes[start:end] = ids, codes
+        self.size = end
+        return start
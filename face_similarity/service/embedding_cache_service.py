@@ -0,0 +1,351 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from prometheus_client import Counter, Gauge
+
+from face_similarity.utils.api_util import ApiUtil
+
+embedding_cache_requests = Counter(
+    'embedding_cache_requests', 'Embedding cache lookups',
+    ['result'])
+
+embedding_cache_evictions = Counter(
+    'embedding_cache_evictions', 'Embedding cache evictions',
+    ['reason'])
+
+embedding_cache_bytes = Gauge(
+    'embedding_cache_bytes', 'Embedding cache size in bytes',
+    multiprocess_mode='livesum')
+
+
+class EmbeddingCacheService:
+    """
+    Class that keeps, per worker, the 128 dimension vector and the bounding
+    box of the images already processed, keyed by the content hash of the
+    image. Repeated images (retries, re-verification, one document checked
+    against many selfies) skip the rotate, detect and encode stages.
+    Entries are evicted by least recent use, time to live and memory limit.
+    """
+    __instance = None
+    __lock = threading.Lock()
+
+    def __init__(self, max_bytes, ttl, clock=time.monotonic):
+        """
+        Class Constructor.
+        Args:
+            max_bytes: (int) Memory limit of the entries in bytes.
+            ttl: (float) Seconds an entry is valid.
+            clock: (callable) Time source in seconds.
+        """
+        self.pid = os.getpid()
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.size = 0
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        """
+        Get the cache of the worker, configured by environment: in memory
+        of the worker or shared by every worker of the host (sqlite).
+        Returns:
+            (EmbeddingCacheService) Cache, None when disabled.
+        """
+        with cls.__lock:
+            if cls.__instance is None or cls.__instance.pid != os.getpid():
+                utils = ApiUtil()
+                max_bytes = utils.environ_default(
+                    'EMBEDDING_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+                ttl = utils.environ_default('EMBEDDING_CACHE_TTL', 3600.0)
+                backend = utils.environ_default(
+                    'EMBEDDING_CACHE_BACKEND', 'memory')
+                if backend == 'sqlite' and max_bytes > 0:
+                    cls.__instance = SharedEmbeddingCacheService(
+                        utils.environ_default(
+                            'EMBEDDING_CACHE_PATH',
+                            '/tmp/face_similarity_embeddings.sqlite'),
+                        max_bytes, ttl)
+                else:
+                    cls.__instance = cls(max_bytes, ttl)
+            return cls.__instance if cls.__instance.max_bytes > 0 else None
+
+    def get(self, key):
+        """
+        Get the vector and bounding box of an image.
+        Args:
+            key: (str) Content hash of the image.
+        Returns:
+            (tuple) Vector and bounding box, None when not cached.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] < self.clock():
+                self.__evict(key, 'expired')
+                entry = None
+            if entry is None:
+                self.misses += 1
+                embedding_cache_requests.labels('miss').inc()
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            embedding_cache_requests.labels('hit').inc()
+            return entry[0], entry[1]
+
+    def put(self, key, vector, bounding_box) -> None:
+        """
+        Store the vector and bounding box of an image, evicting the least
+        recently used entries above the memory limit.
+        Args:
+            key: (str) Content hash of the image.
+            vector: (list) 128 dimension vector.
+            bounding_box: (list) Location of the face.
+        """
+        vector = np.asarray(vector, dtype=np.float64)
+        size = self.entry_size(key, vector, bounding_box)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.__evict(key, 'replaced')
+            self.entries[key] = (
+                vector, bounding_box, self.clock() + self.ttl, size)
+            self.size += size
+            embedding_cache_bytes.inc(size)
+            while self.size > self.max_bytes:
+                self.__evict(next(iter(self.entries)), 'capacity')
+
+    def __evict(self, key, reason) -> None:
+        """
+        Remove an entry. Must be called holding the lock.
+        Args:
+            key: (str) Content hash of the image.
+            reason: (str) Eviction reason (expired, capacity, replaced).
+        """
+        size = self.entries.pop(key)[3]
+        self.size -= size
+        embedding_cache_bytes.dec(size)
+        if reason != 'replaced':
+            self.evictions += 1
+            embedding_cache_evictions.labels(reason).inc()
+
+    @staticmethod
+    def entry_size(key, vector, bounding_box) -> int:
+        """
+        Approximate memory used by an entry.
+        Args:
+            key: (str) Content hash of the image.
+            vector: (np.ndarray) 128 dimension vector.
+            bounding_box: (list) Location of the face.
+        Returns:
+            (int) Size in bytes.
+        """
+        return sys.getsizeof(key) + vector.nbytes + sys.getsizeof(
+            bounding_box) + 8 * len(bounding_box or ())
+
+    def stats(self) -> dict:
+        """
+        Counters of the cache.
+        Returns:
+            (dict) Hits, misses, evictions, entries and bytes.
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions,
+                    "entries": len(self.entries), "bytes": self.size}
+
+
+class SharedEmbeddingCacheService:
+    """
+    Embedding cache shared by every gunicorn worker of the host, stored in a
+    local SQLite file (WAL mode). Inserts and evictions are atomic
+    transactions, so the workers see each other's entries, and the file
+    keeps the cache warm after restarts. Same interface of
+    EmbeddingCacheService, safe to call from several threads (the callers
+    in the event loop run it in the loop executor).
+    """
+    # Seconds between updates of the last access of an entry.
+    touch_interval = 60.0
+
+    def __init__(self, path, max_bytes, ttl, clock=time.time):
+        """
+        Class Constructor.
+        Args:
+            path: (str) SQLite database file.
+            max_bytes: (int) Memory limit of the entries in bytes.
+            ttl: (float) Seconds an entry is valid.
+            clock: (callable) Wall clock time in seconds.
+        """
+        self.pid = os.getpid()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        # Guards the counters, each thread has its own connection.
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        with self.connection() as connection:
+            connection.executescript(
+                'CREATE TABLE IF NOT EXISTS embeddings ('
+                ' key TEXT PRIMARY KEY, vector BLOB, bounding_box TEXT,'
+                ' expires REAL, accessed REAL, size INTEGER);'
+                'CREATE INDEX IF NOT EXISTS embeddings_accessed'
+                ' ON embeddings (accessed);'
+                'CREATE INDEX IF NOT EXISTS embeddings_expires'
+                ' ON embeddings (expires);'
+                'CREATE TABLE IF NOT EXISTS usage (id INTEGER PRIMARY KEY,'
+                ' size INTEGER);'
+                'INSERT OR IGNORE INTO usage (id, size) VALUES (0, 0);')
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        Get the connection of the current OS thread.
+        Returns:
+            (Connection) SQLite connection.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=5.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def get(self, key):
+        """
+        Get the vector and bounding box of an image.
+        Args:
+            key: (str) Content hash of the image.
+        Returns:
+            (tuple) Vector and bounding box, None when not cached.
+        """
+        now = self.clock()
+        connection = self.connection()
+        row = connection.execute(
+            'SELECT vector, bounding_box, accessed FROM embeddings'
+            ' WHERE key = ? AND expires >= ?', (key, now)).fetchone()
+        if row is None:
+            with self.lock:
+                self.misses += 1
+            embedding_cache_requests.labels('miss').inc()
+            return None
+        if row[2] < now - self.touch_interval:
+            connection.execute(
+                'UPDATE embeddings SET accessed = ? WHERE key = ?',
+                (now, key))
+        with self.lock:
+            self.hits += 1
+        embedding_cache_requests.labels('hit').inc()
+        return np.frombuffer(row[0], dtype=np.float64), json.loads(row[1])
+
+    def put(self, key, vector, bounding_box) -> None:
+        """
+        Store the vector and bounding box of an image, evicting the expired
+        and the least recently used entries above the memory limit.
+        Args:
+            key: (str) Content hash of the image.
+            vector: (list) 128 dimension vector.
+            bounding_box: (list) Location of the face.
+        """
+        vector = np.asarray(vector, dtype=np.float64).tobytes()
+        bounding_box = json.dumps(bounding_box)
+        size = len(key) + len(vector) + len(bounding_box)
+        if size > self.max_bytes:
+            return
+        now = self.clock()
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            self.__delete(connection, 'key = ?', (key,))
+            connection.execute(
+                'INSERT INTO embeddings VALUES (?, ?, ?, ?, ?, ?)',
+                (key, vector, bounding_box, now + self.ttl, now, size))
+            connection.execute(
+                'UPDATE usage SET size = size + ? WHERE id = 0', (size,))
+            self.evict(connection, now)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def evict(self, connection, now) -> None:
+        """
+        Remove the expired entries and the least recently used ones while
+        the cache is above the memory limit. Must run inside a transaction.
+        Args:
+            connection: (Connection) SQLite connection.
+            now: (float) Current time.
+        """
+        self.__count(self.__delete(
+            connection, 'expires < ?', (now,)), 'expired')
+        excess = connection.execute(
+            'SELECT size FROM usage WHERE id = 0').fetchone()[0] \
+            - self.max_bytes
+        keys = list()
+        for key, size in connection.execute(
+                'SELECT key, size FROM embeddings ORDER BY accessed'):
+            if excess <= 0:
+                break
+            keys.append(key)
+            excess -= size
+        if keys:
+            self.__count(self.__delete(
+                connection, 'key IN (%s)' % ', '.join('?' * len(keys)),
+                tuple(keys)), 'capacity')
+
+    @staticmethod
+    def __delete(connection, where, args) -> int:
+        """
+        Delete entries and discount their size from the usage.
+        Args:
+            connection: (Connection) SQLite connection.
+            where: (str) Filter of the entries.
+            args: (tuple) Filter arguments.
+        Returns:
+            (int) Number of entries deleted.
+        """
+        count, size = connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings WHERE '
+            + where, args).fetchone()
+        if count:
+            connection.execute('DELETE FROM embeddings WHERE ' + where, args)
+            connection.execute(
+                'UPDATE usage SET size = size - ? WHERE id = 0', (size,))
+        return count
+
+    def __count(self, evicted, reason) -> None:
+        """
+        Update the eviction counters.
+        Args:
+            evicted: (int) Number of entries evicted.
+            reason: (str) Eviction reason (expired, capacity).
+        """
+        if evicted:
+            with self.lock:
+                self.evictions += evicted
+            embedding_cache_evictions.labels(reason).inc(evicted)
+
+    def stats(self) -> dict:
+        """
+        Counters of the cache, entries and bytes of the whole host.
+        Returns:
+            (dict) Hits, misses, evictions, entries and bytes.
+        """
+        connection = self.connection()
+        entries = connection.execute(
+            'SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        used = connection.execute(
+            'SELECT size FROM usage WHERE id = 0').fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "entries": entries,
+                "bytes": used}
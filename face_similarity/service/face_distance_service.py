@@ -1,43 +1,98 @@
 
 import numpy as np
-import math
 
 
 class FaceDistanceService:
     """
     Class that contains the methods to calculate the distance between
-    the vectors resulting from two images.
+    the vectors resulting from two images. Every method accepts single
+    vectors or arrays of vectors (float64 or float32) and is vectorized
+    with NumPy.
     """
+    # Above this number of values the distance matrix is computed with the
+    # dot product expansion instead of the difference of every pair.
+    broadcast_limit = 1 << 22
 
     @staticmethod
     def convert_distance_to_percentage(face_distances, threshold=0.6):
         """Calculates faces distance accuracy as a percentage.
         Args:
-            face_distances: (float) Face distance.
+            face_distances: (float|np.ndarray) Face distance, or array of
+                                               face distances.
             threshold: (float) Minimum distance error acceptable.
         Returns:
-            (float) Percent of trust score.
+            (float|np.ndarray) Percent of trust score, an array with the
+                               shape of face_distances for arrays.
         """
-        if face_distances > threshold:
-            threshold = (1.0 - threshold)
-            # Linear value.
-            lin_val = (1.0 - face_distances) / (threshold * 2.0)
-        else:
-            lin_val = 1.0 - (face_distances / (threshold * 2.0))
-            result = ((1.0 - lin_val) * math.pow((lin_val - 0.5) * 2, 0.2))
-            lin_val = lin_val + result
-        return round(float(lin_val * 100), 2)
+        distances = FaceDistanceService.as_float_array(face_distances)
+        # Linear value.
+        lin_val = np.where(
+            distances > threshold,
+            (1.0 - distances) / ((1.0 - threshold) * 2.0),
+            1.0 - (distances / (threshold * 2.0)))
+        near = distances <= threshold
+        base = np.maximum((lin_val - 0.5) * 2, 0)
+        lin_val = np.where(
+            near, lin_val + (1.0 - lin_val) * np.power(base, 0.2), lin_val)
+        if np.ndim(face_distances) == 0:
+            return round(float(lin_val * 100), 2)
+        return np.round(lin_val * 100, 2)
 
     @staticmethod
     def face_distance(vector_1, vector_2):
-        """Calculate norm from faces encodings.
+        """Calculate norm from faces encodings, every vector of vector_1
+        against every vector of vector_2.
         Args:
-            vector_1: (list) Faces encodings.
-            vector_2: (list) Faces encodings.
+            vector_1: (list|np.ndarray) Face encoding (128) or faces
+                                        encodings (M x 128).
+            vector_2: (list|np.ndarray) Face encoding (128) or faces
+                                        encodings (N x 128).
         Returns:
-            (float) Norm of the matrix.
+            (np.ndarray) Norm of the matrix (M x N). The axis of a single
+                         encoding is dropped: (N), (M) or a scalar for one
+                         pair.
         """
-        vector_1 = np.array([vector_1])
-        vector_2 = np.array([vector_2])
+        vectors_1 = FaceDistanceService.as_float_array(vector_1, vector_2)
+        vectors_2 = FaceDistanceService.as_float_array(vector_2, vector_1)
+        single_1, single_2 = vectors_1.ndim == 1, vectors_2.ndim == 1
+        vectors_1, vectors_2 = np.atleast_2d(vectors_1, vectors_2)
+        if vectors_1.size * len(vectors_2) <= \
+                FaceDistanceService.broadcast_limit:
+            distances = np.linalg.norm(
+                vectors_1[:, np.newaxis] - vectors_2[np.newaxis], axis=2)
+        else:
+            squared = (np.einsum('ij,ij->i', vectors_1, vectors_1)[
+                :, np.newaxis] - 2.0 * vectors_1.dot(vectors_2.T)
+                + np.einsum('ij,ij->i', vectors_2, vectors_2)[np.newaxis])
+            distances = np.sqrt(np.maximum(squared, 0))
         # Return norm distance.
-        return np.linalg.norm(vector_1 - vector_2, axis=1)
+        return distances[0 if single_1 else slice(None),
+                         0 if single_2 else slice(None)]
+
+    @staticmethod
+    def pair_distances(vectors_1, vectors_2):
+        """Calculate norm from many pairs of faces encodings at once,
+        row i of vectors_1 against row i of vectors_2.
+        Args:
+            vectors_1: (np.ndarray) Faces encodings (N x 128).
+            vectors_2: (np.ndarray) Faces encodings (N x 128).
+        Returns:
+            (np.ndarray) Norm of each pair (N).
+        """
+        vectors_1 = FaceDistanceService.as_float_array(vectors_1, vectors_2)
+        vectors_2 = FaceDistanceService.as_float_array(vectors_2, vectors_1)
+        return np.linalg.norm(vectors_1 - vectors_2, axis=1)
+
+    @staticmethod
+    def as_float_array(values, other=None):
+        """Convert to a float array, float32 when the values (or the other
+        operand) are float32, float64 otherwise.
+        Args:
+            values: (list|np.ndarray) Values to convert.
+            other: (list|np.ndarray) Other operand of the operation.
+        Returns:
+            (np.ndarray) Float array, not copied when already of that type.
+        """
+        float32 = np.float32 in (getattr(values, 'dtype', None),
+                                 getattr(other, 'dtype', None))
+        return np.asarray(values, np.float32 if float32 else np.float64)
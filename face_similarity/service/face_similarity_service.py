@@ -1,14 +1,44 @@
-
-import json
+import asyncio
+import concurrent.futures
 import logging
 import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import numpy as np
+from prometheus_client import Counter, Histogram
+from werkzeug.exceptions import HTTPException
 
 from face_similarity.utils.api_util import ApiUtil
+from face_similarity.utils.event_loop import (WorkerLoop, first_completed,
+                                              gather_or_cancel)
 from face_similarity.service.requisitions_service import \
-    RequisitionsService
+    RequisitionsService, upstream_retries
+from face_similarity.service.embedding_cache_service import \
+    EmbeddingCacheService, SharedEmbeddingCacheService
 from face_similarity.service.face_distance_service import \
     FaceDistanceService
-from face_similarity.utils.response_error import raise_error
+from face_similarity.service.image_service import ImageService
+from face_similarity.service.micro_batch_service import MicroBatchService
+from face_similarity.utils.deadline import Deadline
+from face_similarity.utils.embedding_codec import EmbeddingCodec
+from face_similarity.utils.image_data import ImageData
+from face_similarity.utils.payload_builder import PayloadBuilder
+from face_similarity.utils.process_pool import ProcessPool
+from face_similarity.utils.response_error import raise_error, response
+from face_similarity.utils.single_flight import SingleFlight
+
+pipeline_stage_latency_seconds = Histogram(
+    'pipeline_stage_latency_seconds',
+    'Latency of the stages of the pipeline of one image in seconds',
+    ['stage'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+             10.0, float('inf')))
+
+orientation_prefilter_results = Counter(
+    'orientation_prefilter_results',
+    'Rotation searches by result of the local orientation pre-filter',
+    ['result'])
 
 
 class FaceSimilarityService:
@@ -17,37 +47,71 @@ class FaceSimilarityService:
     the 'api-preprocess, api-face-detect, api-face-encoding' to obtain the
     vector of 128 dimensions from an image encoded in base 64.
     """
-    face_endpoints = None  # Face Detect API (image/face-detect)
-    rotate_endpoints = None  # Preprocess API (image/rotate-by-angle)
-    encoding_endpoints = None  # Face Encoding API (image/face-encoding)
+    angles = [90, 180, 270]  # Rotations tried when no face is found
 
     def __init__(self):
         """
-        Class Constructor.
+        Class Constructor. The deadline of the request starts counting here.
         """
         self.utils = ApiUtil()
+        self.deadline = Deadline()
         self.face_distance_service = FaceDistanceService()
+        self.requisitions_service = RequisitionsService(self.deadline)
+        self.image_service = ImageService()
+        self.process_pool = ProcessPool.instance()
+        self.rotation_search = self.utils.environ_default(
+            'ROTATION_SEARCH', 'progressive')
+        self.rotation_engine = self.utils.environ_default(
+            'ROTATION_ENGINE', 'local')
+        self.orientation_prefilter = self.utils.environ_default(
+            'ORIENTATION_PREFILTER', False)
+        self.orientation_top = self.utils.environ_default(
+            'ORIENTATION_PREFILTER_TOP', 1)
+
+    def start_vector_comparison_task(self, image_1, image_2):
+        """
+        Submit the comparison to the event loop of the worker and wait for
+        the score in the current OS thread.
+        Args:
+            image_1: (ImageData) Image 1.
+            image_2: (ImageData) Image 2.
+        Returns:
+            (float) Percent of trust score.
+        """
+        return self.run_in_worker_loop(
+            self.vector_comparison(image_1, image_2))
+
+    def run_in_worker_loop(self, coroutine):
+        """
+        Submit a coroutine to the event loop of the worker and wait for its
+        result until the deadline of the request (plus a grace period for
+        the local work). On timeout the coroutine, and the requisitions it
+        has in flight, are cancelled and the request aborts with 504.
+        Args:
+            coroutine: (coroutine) Work to run in the loop.
+        Returns:
+            (any) Result of the coroutine.
+        """
+        grace = self.utils.environ_default('REQUEST_DEADLINE_GRACE', 5.0)
+        try:
+            return WorkerLoop.instance().run(
+                coroutine, self.deadline.remaining() + grace)
+        except concurrent.futures.TimeoutError:
+            raise_error(504)
 
-    def start_vector_comparison_task(self, base64_1, base64_2, loop):
+    async def vector_comparison(self, image_1, image_2):
         """
         Performs the necessary tasks to obtain the score of the distance
         between the vectors of two faces.
         Args:
-            base64_1: (str) Containing base64 code from image 1.
-            base64_2: (str) Containing base64 code from image 2.
-            loop: (event_loop) Event loop in the current OS thread.
+            image_1: (ImageData) Image 1.
+            image_2: (ImageData) Image 2.
         Returns:
             (float) Percent of trust score.
         """
-        self.reset()
         start_time = time.time()
-        # Get faces from base64 images (base64_1, base64_2).
-        face_detect_response = self.get_both_faces(base64_1, base64_2, loop)
         # Get vector for each face.
-        vector_1, vector_2 = self.get_both_vectors(
-            face_detect_response, base64_1, base64_2, loop)
-        # Close loop.
-        loop.close()
+        vector_1, vector_2 = await self.get_both_vectors(image_1, image_2)
         # Get distance between vectors.
         distance = self.face_distance_service.face_distance(vector_1, vector_2)
         # Get confidence score as a percentage.
@@ -60,183 +124,441 @@ class FaceSimilarityService:
         })
         return confidence_score
 
-    def get_both_vectors(self, face_detect_, base64_1, base64_2, loop) -> ():
+    def start_face_vector_task(self, image):
         """
-        Obtain 128-dimensional vector through integration with
-        api-face-encoding.
+        Submit the processing of one image to the event loop of the worker
+        and wait for its vector in the current OS thread.
+        Args:
+            image: (ImageData) Image to process.
+        Returns:
+            (list) 128 dimension vector.
+        """
+        return self.run_in_worker_loop(self.get_face_vector(image))[0]
+
+    def start_batch_comparison_task(self, images, pairs):
+        """
+        Submit the batch comparison to the event loop of the worker and wait
+        for the scores in the current OS thread.
         Args:
-            face_detect_: (list) List of response from api-face-detect.
-                                    contains base64 bounding_box (base64_1,
-                                    base64_2)
-            base64_1: (str) Containing base64 code from image 1.
-            base64_2: (str) Containing base64 code from image 2.
-            loop: (event_loop) Event loop in the current OS thread.
+            images: (list) Images (ImageData).
+            pairs: (list) Pairs of image indexes to compare.
+        Returns:
+            (list) Score of each pair.
+        """
+        return self.run_in_worker_loop(
+            self.batch_comparison(images, pairs))
+
+    async def batch_comparison(self, images, pairs) -> list:
+        """
+        Compare many pairs of images. Repeated images are processed only
+        once and every pair is scored in a single NumPy operation.
+        Args:
+            images: (list) Images (ImageData).
+            pairs: (list) Pairs of image indexes to compare.
+        Returns:
+            (list) Score of each pair, or the error of an image without face
+                   or rejected.
+        """
+        start_time = time.time()
+        # Deduplicate images by content.
+        unique, positions = OrderedDict(), list()
+        for image in images:
+            if image.digest not in unique:
+                unique[image.digest] = [len(unique), image]
+            positions.append(unique[image.digest][0])
+        faces = await gather_or_cancel(
+            *(self.get_batch_vector(item[1]) for item in unique.values()))
+        vectors = np.array([
+            face[0] if isinstance(face, tuple) else np.full(128, np.nan)
+            for face in faces], dtype=np.float64)
+        # Score every pair at once.
+        index_1 = np.array([positions[pair[0]] for pair in pairs], dtype=int)
+        index_2 = np.array([positions[pair[1]] for pair in pairs], dtype=int)
+        scores = self.face_distance_service.convert_distance_to_percentage(
+            self.face_distance_service.pair_distances(
+                vectors[index_1], vectors[index_2])).tolist()
+        results = list()
+        for pair, i, j, score in zip(pairs, index_1, index_2, scores):
+            error = next((face for face in (faces[i], faces[j])
+                          if not isinstance(face, tuple)), None)
+            if error is None:
+                results.append({"pair": pair, "similarity": score})
+            else:
+                results.append({"pair": pair, "similarity": None,
+                                "error": error,
+                                "detail": response(error)["detail"]})
+        logging.getLogger('face_similarity.info').info({
+            "images": len(images), "unique_images": len(unique),
+            "pairs": len(pairs),
+            "time": "%s seconds" % (time.time() - start_time)
+        })
+        return results
+
+    async def get_batch_vector(self, image):
+        """
+        Obtain the vector of one image of a batch. Images without face or
+        rejected by the quality gate do not abort the batch.
+        Args:
+            image: (ImageData) Image to process.
+        Returns:
+            (tuple) Vector and bounding box, or the error code (401, 403,
+                    406).
+        """
+        try:
+            return await self.get_face_vector(image)
+        except HTTPException as exception:
+            if exception.code in (401, 403, 406):
+                return exception.code
+            raise
+
+    async def get_both_vectors(self, image_1, image_2) -> ():
+        """
+        Obtain the 128-dimensional vector of both images at the same time.
+        Args:
+            image_1: (ImageData) Image 1.
+            image_2: (ImageData) Image 2.
         Returns:
             (tuple) 128 dimension vectors for each face.
         """
-        bounding_box_1, bounding_box_2 = self.get_bounding_box(face_detect_)
+        face_1, face_2 = await gather_or_cancel(
+            self.get_face_vector(image_1), self.get_face_vector(image_2))
+        return face_1[0], face_2[0]
+
+    async def get_face_vector(self, image) -> tuple:
+        """
+        Obtain the 128-dimensional vector and the bounding box of the face of
+        an image, from the embedding cache when the same image was already
+        processed, otherwise through integration with api-face-detect and
+        api-face-encoding. Concurrent requests with the same image share one
+        computation (single flight), and its error, except the timeout of the
+        deadline of another request.
+        Args:
+            image: (ImageData) Image to process.
+        Returns:
+            (tuple) 128 dimension vector and bounding box.
+        """
+        cache = EmbeddingCacheService.instance()
+        cached = await self.call_cache(cache, cache.get, image.digest) \
+            if cache is not None else None
+        if cached is not None:
+            return cached
+        single_flight = SingleFlight.instance()
+        if single_flight is None:
+            return await self.compute_face_vector(image, cache)
+        # The work runs with the deadline of the request that started it,
+        # a request with time left starts it again when it timed out.
+        return await single_flight.run(
+            image.digest, lambda: self.compute_face_vector(image, cache),
+            lambda error: getattr(error, 'code', None) == 504 and
+            self.deadline.remaining() > 0)
+
+    async def compute_face_vector(self, image, cache) -> tuple:
+        """
+        Obtain the vector and the bounding box of the face of an image
+        through integration with api-face-detect and api-face-encoding,
+        once the local quality gate accepts it. The remote APIs receive the
+        normalized (downscaled) image, the same one for detection and
+        encoding, so the bounding box refers to the image encoded.
+        Args:
+            image: (ImageData) Image to process.
+            cache: (EmbeddingCacheService) Cache that keeps the result, None
+                                           when disabled.
+        Returns:
+            (tuple) 128 dimension vector and bounding box.
+        """
+        normalized = await self.prepare(image)
+        search_time = time.time()
+        face = await self.get_face(normalized)
+        encode_time = time.time()
+        pipeline_stage_latency_seconds.labels('face_search').observe(
+            encode_time - search_time)
+        vector = await self.get_vector(face)
+        pipeline_stage_latency_seconds.labels('encode').observe(
+            time.time() - encode_time)
+        if cache is not None:
+            await self.call_cache(
+                cache, cache.put, image.digest, vector, face[1])
+        return vector, face[1]
+
+    @staticmethod
+    async def call_cache(cache, method, *args):
+        """
+        Call a method of the embedding cache. The sqlite backend runs in the
+        executor of the loop, since its lock may wait (up to 5 seconds) for
+        the other workers; the memory backend is called in place.
+        Args:
+            cache: (EmbeddingCacheService) Cache of the worker.
+            method: (callable) get or put of the cache.
+            args: (any) Arguments of the method.
+        Returns:
+            (any) Result of the method.
+        """
+        if isinstance(cache, SharedEmbeddingCacheService):
+            return await asyncio.get_event_loop().run_in_executor(
+                None, method, *args)
+        return method(*args)
+
+    async def prepare(self, image) -> ImageData:
+        """
+        Run the quality gate and the normalization of an input image, in the
+        image process pool when enabled (IMAGE_POOL_WORKERS), otherwise in
+        the executor of the loop, so the decoding and encoding do not block
+        the other requests of the worker.
+        Args:
+            image: (ImageData) Image received.
+        Returns:
+            (ImageData) Image forwarded to the remote APIs.
+        """
+        if self.process_pool is not None:
+            normalized, quality_time, normalize_time = \
+                await self.image_service.prepare_in_pool(
+                    self.process_pool, image)
+        else:
+            normalized, quality_time, normalize_time = \
+                await asyncio.get_event_loop().run_in_executor(
+                    None, self.image_service.prepare, image)
+        pipeline_stage_latency_seconds.labels('quality').observe(
+            quality_time)
+        pipeline_stage_latency_seconds.labels('normalize').observe(
+            normalize_time)
+        return normalized
+
+    async def get_vector(self, face) -> list:
+        """
+        Obtain 128-dimensional vector through integration with
+        api-face-encoding, answered in the compact float32 format when the
+        API supports it (EMBEDDING_FORMAT) or in the legacy JSON string.
+        Args:
+            face: (list) Image (rotated if needed) and bounding box of the
+                         face.
+        Returns:
+            (np.ndarray) 128 dimension vector.
+        """
         # Payload and url for 'Face Encoding API'.
-        self.face_encoding_url_payload(
-            base64_1, base64_2, bounding_box_1, bounding_box_2)
-        # Star loop of requisitions.
-        requisitions_service = RequisitionsService()
-        encoding_response = requisitions_service.start_loop(
-            loop, self.encoding_endpoints)
-        # Get vector 1 ans 2.
-        vector_1 = json.loads(encoding_response[0][1]["faces_encoding"])[0]
-        vector_2 = json.loads(encoding_response[1][1]["faces_encoding"])[0]
-        # Return vectors.
-        return vector_1, vector_2
-
-    def get_both_faces(self, base64_1, base64_2, loop):
-        """
-        Get face from an image in base64 code (base64_1, base64_2).
-        Integration done with the api-face-detect.
-        Args:
-            base64_1: (str) Containing base64 code from image 1.
-            base64_2: (str) Containing base64 code from image 2.
-            loop: (event_loop) Event loop in the current OS thread.
-        Returns:
-            (list) list of response from api-face-detect.
-        """
-        requisitions_service = RequisitionsService()
-        # Payload and url for 'Preprocess API'.
-        self.pre_process_url_payload(base64_1, base64_2)
-        # Rotate image at various angles (90, 180, 270).
-        pre_pro_response = requisitions_service.start_loop(
-            loop, self.rotate_endpoints)
-        # Faces from rotated base 64 image.
-        face_detect_response = self.get_faces_from_b64(
-            base64_1, base64_2, pre_pro_response, loop)
-        return face_detect_response
-
-    def get_faces_from_b64(self, base64_1, base64_2, pre_process_resp, loop):
-        """
-        Get face from an image in base64 code, rotated at angles
-        [0, 90. 180, 270]. Integration done with the api-face-detect.
-        Args:
-            base64_1: (str) Containing base64 code from image 1.
-            base64_2: (str) Containing base64 code from image 2.
-            pre_process_resp: (list) List of responses to requests made
-                                     to the api-preprocess.
-            loop: (event_loop) Event loop in the current OS thread.
-        Returns:
-            (list) Responses to requests made to the api-face-detect
-                   (8 request).
-        """
-        requisitions_service = RequisitionsService()
-        # Payload and url for 'Face Detection API'.
-        pre_process_resp.append([200, {"b64_image": base64_1}, "img_1"])
-        pre_process_resp.append([200, {"b64_image": base64_2}, "img_2"])
-        self.face_detect_url_payload(pre_process_resp)
-        # Rotate image at various angles (90, 180, 270)
-        face_detect_response = requisitions_service.start_loop(
-            loop, self.face_endpoints)
-        return face_detect_response
-
-    def face_detect_url_payload(self, pre_process_resp) -> None:
-        """
-        Process and get the url and the payload for each request to
-        api-face-detect.
+        encoding_response = await self.post_upstream(
+            self.face_encoding_url_payload(face[0], face[1]))
+        return EmbeddingCodec.decode(encoding_response[1])[0]
+
+    async def post_upstream(self, endpoint) -> list:
+        """
+        Request api-face-detect or api-face-encoding for one image, joined
+        with the calls of the concurrent requests in a batch when the batch
+        endpoint of the stage is configured.
         Args:
-            pre_process_resp: (list) Responses to requests made to
-                                     api-face-detect (8 request).
+            endpoint: (list) Url, serialized payload, image identifier and
+                             stage.
+        Returns:
+            (list) Status code, response and image identifier.
         """
-        self.face_endpoints = list()
-        url, _ = self.get_face_detect_url_payload()
-        # Append url and payload.
-        for response in pre_process_resp:
-            self.face_endpoints.append([
-                url,
-                {"image": response[1]["b64_image"], "cropped": False},
-                response[2]
-            ])
+        batcher = MicroBatchService.instance(endpoint[3])
+        if batcher is None:
+            return await self.requisitions_service.post(endpoint)
+        return await batcher.post(endpoint, self.deadline)
 
-    def pre_process_url_payload(self, base64_1, base64_2) -> None:
+    async def get_face(self, image) -> list:
         """
-        Process and get the url and the payload for the request for each
-        base64.
+        Search the face of the image rotated at angles [0, 90, 180, 270].
         Args:
-            base64_1: (str) Containing base64 code from image 1.
-            base64_2: (str) Containing base64 code from image 2.
+            image: (ImageData) Image to search.
+        Returns:
+            (list) Image where the face was found (rotated if needed) and
+                   bounding box.
+        """
+        if self.rotation_search == 'exhaustive':
+            face = await self.exhaustive_search(image)
+        else:
+            face = await self.progressive_search(image)
+        # Image does not contain faces.
+        if face is None:
+            raise_error(403)
+        return face
 
+    async def exhaustive_search(self, image):
+        """
+        Detect faces in every rotation at the same time (4 requests to
+        api-face-detect, after rotating the image 3 times) and keep the first
+        angle, in order, that contains a face.
+        Args:
+            image: (ImageData) Image to search.
         Returns:
+            (list) Image and bounding box, None without face.
+        """
+        faces = await gather_or_cancel(*(
+            self.get_face_at_angle(image, angle)
+            for angle in [0] + self.angles))
+        return next((face for face in faces if face is not None), None)
 
+    async def progressive_search(self, image):
+        """
+        Detect the face in the image as received first and only then in the
+        other rotations. The EXIF orientation is not a step of its own:
+        normalize encodes every decodable image with an orientation tag
+        again upright, for both rotation engines, and the quality gate
+        rejects the images that do not decode. With ORIENTATION_PREFILTER
+        the first step is instead the most likely orientations found by a
+        local face detection, and the other rotations the fallback. In each
+        step the first rotation with a face wins and the requisitions still
+        in flight are cancelled.
+        Args:
+            image: (ImageData) Image to search.
+        Returns:
+            (list) Image and bounding box, None without face.
+        """
+        steps = await self.prefilter_steps(image) \
+            if self.orientation_prefilter else None
+        prefiltered = steps is not None
+        if not prefiltered:
+            steps = [[0], list(self.angles)]
+        for number, step in enumerate(steps):
+            face = await first_completed(*(
+                self.get_face_at_angle(image, angle, number > 0)
+                for angle in step))
+            if face is not None:
+                if prefiltered:
+                    orientation_prefilter_results.labels(
+                        'confirmed' if number == 0 else 'fallback').inc()
+                return face
+        return None
+
+    async def prefilter_steps(self, image):
+        """
+        Search steps given by the local orientation pre-filter: the
+        ORIENTATION_PREFILTER_TOP most likely rotations, then the others.
+        The local detection runs in the image process pool or the executor
+        of the loop.
+        Args:
+            image: (ImageData) Image to search.
+        Returns:
+            (list) Angles of each step, None when no face was found locally.
+        """
+        start_time = time.time()
+        limit = max(1, self.orientation_top)
+        if self.process_pool is not None and image.array is not None:
+            likely = list(await self.process_pool.run(
+                'orientation', self.image_service.rank_angles, image.array,
+                limit))
+        else:
+            likely = await asyncio.get_event_loop().run_in_executor(
+                None, self.image_service.likely_angles, image, limit)
+        pipeline_stage_latency_seconds.labels('orientation').observe(
+            time.time() - start_time)
+        if not likely:
+            orientation_prefilter_results.labels('no_local_face').inc()
+            return None
+        return [likely, [angle for angle in [0] + self.angles
+                         if angle not in likely]]
+
+    async def get_face_at_angle(self, image, angle, retry=False):
+        """
+        Rotate the image and detect its face (api-face-detect).
+        Args:
+            image: (ImageData) Image to search.
+            angle: (int) Rotation angle, 0 keeps the image as is.
+            retry: (bool) Call made after a search step without face,
+                          counted in upstream_retries.
+        Returns:
+            (list) Image and bounding box, None without face.
+        """
+        if angle:
+            image = await self.rotate(image, angle)
+        endpoint = self.face_detect_url_payload(image)
+        if retry:
+            upstream_retries.labels(
+                'detect', urlsplit(endpoint[0]).netloc, 'rotation').inc()
+        face_detect_response = await self.post_upstream(endpoint)
+        bounding_box = self.get_bounding_box(face_detect_response)
+        return None if bounding_box is None else [image, bounding_box]
+
+    async def rotate(self, image, angle) -> ImageData:
+        """
+        Rotate the image with OpenCV in the image process pool of the worker,
+        or the executor of the loop (ROTATION_ENGINE=local), falling back to
+        the api-preprocess when the image can not be decoded locally or
+        ROTATION_ENGINE=remote.
+        Args:
+            image: (ImageData) Image to rotate.
+            angle: (int) Rotation angle (90, 180, 270).
+        Returns:
+            (ImageData) Rotated image.
+        """
+        if self.rotation_engine == 'local' and image.array is not None:
+            start_time = time.time()
+            if self.process_pool is not None:
+                rotated = ImageData(None, image.tag, *(
+                    await self.process_pool.run(
+                        'rotate', self.image_service.rotate_array,
+                        image.array, angle)))
+            else:
+                rotated = await asyncio.get_event_loop().run_in_executor(
+                    None, self.image_service.rotate, image, angle)
+            pipeline_stage_latency_seconds.labels('rotate').observe(
+                time.time() - start_time)
+            return rotated
+        pre_pro_response = await self.requisitions_service.post(
+            self.pre_process_url_payload(image, angle))
+        return ImageData(pre_pro_response[1]["b64_image"], image.tag)
+
+    def face_detect_url_payload(self, image) -> list:
+        """
+        Get the url and the payload for the request to api-face-detect.
+        Args:
+            image: (ImageData) Image to detect.
+        Returns:
+            (list) Url, serialized payload, image identifier and stage.
+        """
+        url, fields = self.get_face_detect_url_payload()
+        return [url, PayloadBuilder.build("image", image, fields), image.tag,
+                'detect']
+
+    def pre_process_url_payload(self, image, angle) -> list:
+        """
+        Get the url and the payload for the request to api-preprocess.
+        Args:
+            image: (ImageData) Image to rotate.
+            angle: (int) Rotation angle (90, 180, 270).
+        Returns:
+            (list) Url, serialized payload, image identifier and stage.
         """
         url = self.utils.environ_value('PRE_PROCESS_URL')
-        for angle in [90, 180, 270]:
-            payload_base_1 = {"image": base64_1, "angle": angle}
-            payload_base_2 = {"image": base64_2, "angle": angle}
-            self.rotate_endpoints.append([url, payload_base_1, "img_1"])
-            self.rotate_endpoints.append([url, payload_base_2, "img_2"])
+        return [url, PayloadBuilder.build("image", image, {"angle": angle}),
+                image.tag, 'preprocess']
 
     def get_face_detect_url_payload(self) -> tuple:
         """
-        Get url and payload base for api-face-detect.
+        Get url and payload base (fields besides the image) for
+        api-face-detect.
         Returns:
             (tuple) Url and payload.
         """
-        payload_base = {"image": "", "cropped": False}
+        payload_base = {"cropped": False}
         url = self.utils.environ_value('FACE_DETECT_URL')
         return url, payload_base
 
-    def face_encoding_url_payload(self, base64_1, base64_2, bounding_box_1,
-                                  bounding_box_2):
+    def face_encoding_url_payload(self, image, bounding_box) -> list:
         """
-        Get url and payload base for each base64 image (base64_1, base64_2).
-        Url for integration with api-face-encoding.
+        Get url and payload for the base64 image. Url for integration with
+        api-face-encoding.
         Args:
-            base64_1: (str) Containing base64 code from image 1.
-            base64_2: (str) Containing base64 code from image 2.
-            bounding_box_1: (list) Location of face from image 1.
-            bounding_box_2: (list) Location of face from image 2.
+            image: (ImageData) Image to encode.
+            bounding_box: (list) Location of face from image.
+        Returns:
+            (list) Url, serialized payload, image identifier and stage.
         """
         url = self.utils.environ_value('FACE_ENCODING_URL')
-        self.encoding_endpoints.append([url, {
-            "b64_image": base64_1, "face_locations": bounding_box_1}, "img_1"])
-        self.encoding_endpoints.append([url, {
-            "b64_image": base64_2, "face_locations": bounding_box_2}, "img_2"])
+        return [url, PayloadBuilder.build(
+            "b64_image", image, {"face_locations": bounding_box}), image.tag,
+                'encode']
 
     @staticmethod
-    def get_bounding_box(face_detect_img) -> tuple:
+    def get_bounding_box(face_detect_img):
         """
         Get bounding box from the requisition response to the api-face-detect.
         Args:
-            face_detect_img: (list) Responses from api-face-detect. Location
+            face_detect_img: (list) Response from api-face-detect. Location
                                     of faces (bounding box)
         Returns:
-            (tuple) Bounding box from face of image 1 and face of image 1.
-        """
-        bounding_box_1, bounding_box_2, boxes, i = None, None, list(), 0
-        # Image does not contain faces.
-        if len(face_detect_img) == 0:
-            raise_error(406)
-        # Get bounding box for each image.
-        for item in face_detect_img:
-            if item[1]["number_of_faces"] > 0:
-                boxes.append([item[1]["data"][0]["bounding_box"], item[2]])
-                i = i + 1
-            if i == 2:
-                break
-        # Each image contains a face.
-        if (boxes[0][1] == "img_1" and boxes[1][1] == "img_2") or (
-                boxes[0][1] == "img_2" and boxes[1][1] == "img_1"):
-            bounding_box_1 = boxes[0][0]
-            bounding_box_2 = boxes[1][0]
-        else:
-            raise_error(403)
-        return bounding_box_1, bounding_box_2
-
-    def reset(self):
-        """
-        Clean the variables.
-        """
-        self.face_endpoints = list()
-        self.rotate_endpoints = list()
-        self.encoding_endpoints = list()
-
-    def __del__(self):
-        """"
-        Class destroyer.
+            (list) Bounding box of the first face, None without face.
         """
-        self.reset()
+        if face_detect_img[1]["number_of_faces"] > 0:
+            return face_detect_img[1]["data"][0]["bounding_box"]
+        return None
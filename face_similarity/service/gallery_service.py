@@ -0,0 +1,259 @@
+import logging
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from face_similarity.service.ann_index_service import AnnIndexService
+from face_similarity.service.face_distance_service import \
+    FaceDistanceService
+from face_similarity.utils.api_util import ApiUtil
+
+
+class GalleryService:
+    """
+    Class that keeps the gallery of enrolled subjects for 1:N
+    identification. The vectors are stored in a local SQLite file shared by
+    every worker of the host, and each worker holds them in a contiguous
+    float32 matrix so a search is a single vectorized distance computation.
+    Large galleries are searched through an approximate nearest neighbour
+    index (IVF) instead of the exact scan.
+    """
+    __instance = None
+    __lock = threading.Lock()
+    # Candidates reranked with the exact distance per result (PQ index).
+    rerank = 4
+
+    def __init__(self, path, index=None, index_min_size=50000):
+        """
+        Class Constructor.
+        Args:
+            path: (str) SQLite database file.
+            index: (AnnIndexService) Approximate index, None for exact scan.
+            index_min_size: (int) Gallery size from which the index is
+                                  trained and used.
+        """
+        self.pid = os.getpid()
+        self.path = path
+        self.index = index
+        self.index_min_size = index_min_size
+        self.face_distance_service = FaceDistanceService()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.ids = list()
+        self.rows = dict()
+        self.matrix = np.empty((0, 128), dtype=np.float32)
+        self.size = 0
+        self.last_seq = 0
+        self.training = None
+        self.pending = set()
+        self.connection().executescript(
+            'CREATE TABLE IF NOT EXISTS subjects ('
+            ' subject_id TEXT PRIMARY KEY, vector BLOB, seq INTEGER);'
+            'CREATE INDEX IF NOT EXISTS subjects_seq ON subjects (seq);')
+
+    @classmethod
+    def instance(cls):
+        """
+        Get the gallery of the worker, configured by environment.
+        Returns:
+            (GalleryService) Gallery.
+        """
+        with cls.__lock:
+            if cls.__instance is None or cls.__instance.pid != os.getpid():
+                utils, index = ApiUtil(), None
+                if utils.environ_default('GALLERY_INDEX', 'exact') == 'ivf':
+                    index = AnnIndexService(
+                        utils.environ_default('GALLERY_IVF_LISTS', 1024),
+                        utils.environ_default('GALLERY_IVF_PROBES', 16),
+                        utils.environ_default('GALLERY_IVF_PQ_SUBSPACES', 0))
+                cls.__instance = cls(
+                    utils.environ_default(
+                        'GALLERY_PATH',
+                        '/tmp/face_similarity_gallery.sqlite'),
+                    index,
+                    utils.environ_default('GALLERY_IVF_MIN_SIZE', 50000))
+            return cls.__instance
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        Get the connection of the current OS thread.
+        Returns:
+            (Connection) SQLite connection.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=5.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self.local.connection = connection
+        return connection
+
+    def enroll(self, subject_id, vector) -> None:
+        """
+        Store the vector of a subject, replacing a previous enrollment.
+        Args:
+            subject_id: (str) Subject identifier.
+            vector: (list) 128 dimension vector.
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'INSERT OR REPLACE INTO subjects VALUES (?, ?, ('
+                'SELECT COALESCE(MAX(seq), 0) + 1 FROM subjects))',
+                (subject_id, vector.tobytes()))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        self.refresh()
+
+    def refresh(self) -> None:
+        """
+        Load into the matrix the subjects enrolled (by any worker) since the
+        last refresh.
+        """
+        with self.lock:
+            rows = self.connection().execute(
+                'SELECT subject_id, vector, seq FROM subjects WHERE seq > ?'
+                ' ORDER BY seq', (self.last_seq,)).fetchall()
+            changed = list()
+            for subject_id, vector, seq in rows:
+                changed.append(
+                    self.__set(subject_id, np.frombuffer(vector, np.float32)))
+                self.last_seq = seq
+            if changed and self.index is not None:
+                self.update_index(changed)
+
+    def update_index(self, changed) -> None:
+        """
+        Insert the changed rows in the approximate index. The index is
+        trained when the gallery reaches its minimum size and trained again
+        each time the gallery grows 4 times. The training runs in a
+        background thread on a copy of the matrix, the searches keep using
+        the previous index (or the exact scan) until it is swapped in. Must
+        be called holding the lock.
+        Args:
+            changed: (list) Rows of the matrix written.
+        """
+        if self.size < self.index_min_size:
+            return
+        if self.training is not None:
+            self.pending.update(changed)
+        elif not self.index.trained or \
+                self.size >= 4 * self.index.trained_size:
+            self.pending = set()
+            self.training = threading.Thread(
+                target=self.train_index,
+                args=(self.matrix[:self.size].copy(),), daemon=True)
+            self.training.start()
+        if self.index.trained:
+            rows = np.asarray(sorted(changed), dtype=np.int64)
+            self.index.add(rows, self.matrix[rows])
+
+    def train_index(self, vectors) -> None:
+        """
+        Train a new index on a copy of the matrix, outside the lock, then
+        insert the rows written meanwhile and replace the current index.
+        Args:
+            vectors: (np.ndarray) Rows of the matrix when the training began.
+        """
+        try:
+            index = self.index.untrained_copy()
+            index.train(vectors)
+            index.add(np.arange(len(vectors)), vectors)
+        except Exception as error:
+            logging.getLogger('face_similarity.api').error(
+                'GALLERY > training of the index failed: %s' % error)
+            with self.lock:
+                self.training = None
+            return
+        with self.lock:
+            if self.pending:
+                rows = np.asarray(sorted(self.pending), dtype=np.int64)
+                index.add(rows, self.matrix[rows])
+            self.index, self.training, self.pending = index, None, set()
+
+    def __set(self, subject_id, vector) -> int:
+        """
+        Write a vector in the matrix, growing it when full. Must be called
+        holding the lock.
+        Args:
+            subject_id: (str) Subject identifier.
+            vector: (np.ndarray) 128 dimension vector.
+        Returns:
+            (int) Row of the matrix.
+        """
+        row = self.rows.get(subject_id)
+        if row is None:
+            if self.size == len(self.matrix):
+                matrix = np.empty(
+                    (max(1024, 2 * len(self.matrix)), 128), np.float32)
+                matrix[:self.size] = self.matrix[:self.size]
+                self.matrix = matrix
+            row, self.size = self.size, self.size + 1
+            self.rows[subject_id] = row
+            self.ids.append(subject_id)
+        self.matrix[row] = vector
+        return row
+
+    def search(self, vector, top_k) -> list:
+        """
+        Get the enrolled subjects most similar to a face.
+        Args:
+            vector: (list) 128 dimension vector of the probe face.
+            top_k: (int) Number of subjects returned.
+        Returns:
+            (list) Subject identifier and similarity, most similar first.
+        """
+        self.refresh()
+        with self.lock:
+            if self.size == 0:
+                return list()
+            probe = np.asarray(vector, dtype=np.float32)
+            if self.index is not None and self.index.trained:
+                rows, distances = self.index_search(probe, top_k)
+            else:
+                rows, distances = self.exact_search(probe, top_k)
+            scores = self.face_distance_service.\
+                convert_distance_to_percentage(
+                    distances.astype(np.float64)).tolist()
+            return [{"subject_id": self.ids[row], "similarity": score}
+                    for row, score in zip(rows.tolist(), scores)]
+
+    def exact_search(self, probe, top_k) -> tuple:
+        """
+        Scan the whole matrix. Must be called holding the lock.
+        Args:
+            probe: (np.ndarray) Probe vector (128).
+            top_k: (int) Number of subjects returned.
+        Returns:
+            (tuple) Rows and distances, most similar first.
+        """
+        distances = self.face_distance_service.face_distance(
+            probe, self.matrix[:self.size])
+        top_k = min(top_k, self.size)
+        best = np.argpartition(distances, top_k - 1)[:top_k]
+        best = best[np.argsort(distances[best])]
+        return best, distances[best]
+
+    def index_search(self, probe, top_k) -> tuple:
+        """
+        Search the approximate index. With PQ, the candidates are reranked
+        with the exact distance. Must be called holding the lock.
+        Args:
+            probe: (np.ndarray) Probe vector (128).
+            top_k: (int) Number of subjects returned.
+        Returns:
+            (tuple) Rows and distances, most similar first.
+        """
+        if not self.index.pq_subspaces:
+            return self.index.search(probe, top_k)
+        rows, _ = self.index.search(probe, top_k * self.rerank)
+        distances = self.face_distance_service.face_distance(
+            probe, self.matrix[rows])
+        best = np.argsort(distances)[:top_k]
+        return rows[best], distances[best]
@@ -0,0 +1,421 @@
+import logging
+import os
+import threading
+import time
+
+import cv2
+from prometheus_client import Counter
+
+from face_similarity.utils.api_util import ApiUtil
+from face_similarity.utils.image_data import ImageData
+from face_similarity.utils.response_error import raise_error
+
+input_image_bytes = Counter(
+    'input_image_bytes', 'Bytes of the input images',
+    ['stage'])
+
+input_image_bytes_saved = Counter(
+    'input_image_bytes_saved',
+    'Bytes removed from the input images by the normalization')
+
+input_images = Counter(
+    'input_images', 'Input images by normalization result',
+    ['result'])
+
+quality_gate_rejections = Counter(
+    'quality_gate_rejections', 'Input images rejected by the quality gate',
+    ['reason'])
+
+
+class ImageService:
+    """
+    Class that makes available the image operations done inside the worker
+    with OpenCV, avoiding the round trips to the api-preprocess.
+    """
+    # Counter-clockwise angles, same convention as api-preprocess.
+    rotate_codes = {
+        90: cv2.ROTATE_90_COUNTERCLOCKWISE,
+        180: cv2.ROTATE_180,
+        270: cv2.ROTATE_90_CLOCKWISE,
+    }
+    # Haar cascade shipped with opencv-python (not in every OpenCV build).
+    cascade_file = 'haarcascade_frontalface_default.xml'
+    __cascades = threading.local()
+
+    def __init__(self):
+        """
+        Class Constructor.
+        """
+        self.utils = ApiUtil()
+        self.jpeg_quality = self.utils.environ_default(
+            'ROTATION_JPEG_QUALITY', 95)
+        self.input_max_side = self.utils.environ_default(
+            'INPUT_MAX_SIDE', 1280)
+        self.input_jpeg_quality = self.utils.environ_default(
+            'INPUT_JPEG_QUALITY', 90)
+        self.orientation_side = self.utils.environ_default(
+            'ORIENTATION_PREFILTER_SIDE', 160)
+        self.quality_gate = self.utils.environ_default('QUALITY_GATE', True)
+        self.quality_min_side = self.utils.environ_default(
+            'QUALITY_MIN_SIDE', 64)
+        self.quality_min_sharpness = self.utils.environ_default(
+            'QUALITY_MIN_SHARPNESS', 10.0)
+        self.quality_min_brightness = self.utils.environ_default(
+            'QUALITY_MIN_BRIGHTNESS', 20.0)
+        self.quality_max_brightness = self.utils.environ_default(
+            'QUALITY_MAX_BRIGHTNESS', 235.0)
+
+    def check_quality(self, image) -> None:
+        """
+        Reject, before any upstream call, the images the remote APIs could
+        not use: not decodable or truncated (401), smaller than
+        QUALITY_MIN_SIDE, blurry (variance of the Laplacian under
+        QUALITY_MIN_SHARPNESS) or too dark or bright (mean gray level out of
+        QUALITY_MIN_BRIGHTNESS and QUALITY_MAX_BRIGHTNESS) (406). A threshold
+        of 0 disables its check, QUALITY_GATE=false disables the gate.
+        Args:
+            image: (ImageData) Image received.
+        """
+        if not self.quality_gate:
+            return
+        reason = self.quality_problem(image)
+        if reason is not None:
+            self.reject(reason)
+
+    @staticmethod
+    def reject(reason) -> None:
+        """
+        Count and answer the rejection of an image by the quality gate.
+        Args:
+            reason: (str) Reason of the rejection.
+        """
+        quality_gate_rejections.labels(reason).inc()
+        raise_error(401 if reason in ('undecodable', 'truncated') else 406)
+
+    def quality_problem(self, image):
+        """
+        Find the first quality problem of an image.
+        Args:
+            image: (ImageData) Image received.
+        Returns:
+            (str) Reason of the rejection, None for a usable image.
+        """
+        if self.is_truncated(image.raw):
+            return 'truncated'
+        array = image.array
+        if array is None:
+            return 'undecodable'
+        height, width = array.shape[:2]
+        if min(height, width) < self.quality_min_side:
+            return 'too_small'
+        gray = cv2.cvtColor(array, cv2.COLOR_BGR2GRAY) \
+            if array.ndim == 3 else array
+        # Measured on a copy of fixed size, the sharpness depends on scale.
+        scale = 512 / max(height, width)
+        if scale < 1:
+            gray = cv2.resize(gray, (max(1, round(width * scale)),
+                                     max(1, round(height * scale))),
+                              interpolation=cv2.INTER_AREA)
+        brightness = float(gray.mean())
+        if self.quality_min_brightness and \
+                brightness < self.quality_min_brightness:
+            return 'underexposed'
+        if self.quality_max_brightness and \
+                brightness > self.quality_max_brightness:
+            return 'overexposed'
+        if self.quality_min_sharpness and cv2.Laplacian(
+                gray, cv2.CV_64F).var() < self.quality_min_sharpness:
+            return 'blurry'
+        return None
+
+    @staticmethod
+    def is_truncated(raw) -> bool:
+        """
+        Whether a JPEG or PNG file is cut before its end marker (OpenCV
+        decodes the part received and fills the rest). Data appended after
+        the end marker (motion photos, vendor trailers) is accepted.
+        Args:
+            raw: (bytes) Image file bytes.
+        Returns:
+            (bool) True for a truncated JPEG or PNG.
+        """
+        if raw[:2] == b'\xff\xd8':
+            # End of image after the start of the main scan: the markers of
+            # the scan data are stuffed.
+            start_of_scan = ImageService.start_of_scan(raw)
+            return start_of_scan < 0 or \
+                raw.find(b'\xff\xd9', start_of_scan) < 0
+        if raw[:8] == b'\x89PNG\r\n\x1a\n':
+            # IEND chunk: empty, type and constant CRC.
+            return b'\x00\x00\x00\x00IEND\xaeB`\x82' not in raw
+        return False
+
+    @staticmethod
+    def start_of_scan(raw) -> int:
+        """
+        Find the start of scan marker of the image by walking its marker
+        segments, so the scan (and end of image) of an EXIF thumbnail,
+        inside its APP1 segment, is skipped.
+        Args:
+            raw: (bytes) JPEG file bytes.
+        Returns:
+            (int) Offset of the marker, -1 when the file ends before it.
+        """
+        offset = 2
+        while offset + 4 <= len(raw) and raw[offset] == 0xFF:
+            marker = raw[offset + 1]
+            if marker == 0xFF:
+                # Fill byte before a marker.
+                offset += 1
+            elif marker == 0xDA:
+                return offset
+            elif marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                # Markers without a segment.
+                offset += 2
+            else:
+                offset += 2 + int.from_bytes(raw[offset + 2:offset + 4], 'big')
+        return -1
+
+    def normalize(self, image) -> ImageData:
+        """
+        Prepare an input image for the remote APIs: decode it once, downscale
+        it so its longest side is at most INPUT_MAX_SIDE and encode it again
+        as JPEG. JPEG images already within the limit (unless their EXIF
+        orientation is not upright), images OpenCV can not decode and
+        re-encodings that are not smaller are kept as they are.
+        Args:
+            image: (ImageData) Image received.
+        Returns:
+            (ImageData) Image forwarded to the remote APIs.
+        """
+        result, normalized = self.shrink(image)
+        self.count_normalization(image, normalized, result)
+        return normalized
+
+    def shrink(self, image) -> tuple:
+        """
+        Downscale and re-encode an input image, see normalize.
+        Args:
+            image: (ImageData) Image received.
+        Returns:
+            (tuple) Result (unchanged, resized, reoriented, recompressed)
+                    and image forwarded to the remote APIs.
+        """
+        result, normalized = 'unchanged', image
+        # OpenCV decodes the pixels upright (EXIF orientation applied), a
+        # JPEG with another orientation is always encoded again, without
+        # the tag, so every stage and rotation starts from the same frame.
+        oriented = self.utils.bytes_exif_orientation(image.raw[:65536]) != 1
+        if (self.input_max_side > 0 or oriented) and \
+                image.array is not None:
+            array = image.array
+            height, width = array.shape[:2]
+            scale = self.input_max_side / max(height, width) \
+                if self.input_max_side > 0 else 1
+            if scale < 1:
+                result = 'resized'
+                array = cv2.resize(
+                    array, (max(1, round(width * scale)),
+                            max(1, round(height * scale))),
+                    interpolation=cv2.INTER_AREA)
+            elif oriented:
+                result = 'reoriented'
+            elif image.raw[:2] != b'\xff\xd8':
+                result = 'recompressed'
+            if result != 'unchanged':
+                normalized = ImageData(None, image.tag, array, self.to_jpeg(
+                    array, self.input_jpeg_quality))
+                if result == 'recompressed' and \
+                        len(normalized.raw) >= len(image.raw):
+                    result, normalized = 'unchanged', image
+        return result, normalized
+
+    @staticmethod
+    def count_normalization(image, normalized, result) -> None:
+        """
+        Record the bytes received and forwarded of an input image.
+        Args:
+            image: (ImageData) Image received.
+            normalized: (ImageData) Image forwarded to the remote APIs.
+            result: (str) Result of the normalization.
+        """
+        input_image_bytes.labels('received').inc(len(image.raw))
+        input_images.labels(result).inc()
+        input_image_bytes.labels('forwarded').inc(len(normalized.raw))
+        input_image_bytes_saved.inc(len(image.raw) - len(normalized.raw))
+
+    def prepare(self, image) -> tuple:
+        """
+        Quality gate (check_quality) and normalization (normalize) of an
+        input image, run in a thread of the executor of the loop when the
+        image process pool is disabled.
+        Args:
+            image: (ImageData) Image received.
+        Returns:
+            (tuple) Image forwarded to the remote APIs and seconds of the
+                    quality gate and of the normalization.
+        """
+        start_time = time.time()
+        self.check_quality(image)
+        normalize_time = time.time()
+        normalized = self.normalize(image)
+        return (normalized, normalize_time - start_time,
+                time.time() - normalize_time)
+
+    def prepare_bytes(self, raw) -> tuple:
+        """
+        Quality gate and normalization of the file bytes of an input image,
+        run in a process of the image process pool (without metrics, the
+        worker records them).
+        Args:
+            raw: (bytes) Image file bytes.
+        Returns:
+            (tuple) Rejection reason (None when accepted), pixels and JPEG
+                    bytes of the image forwarded (no bytes when unchanged,
+                    then the pixels are those of the input), result of the
+                    normalization and seconds of the quality gate and of the
+                    normalization.
+        """
+        image = ImageData(None, None, raw=raw)
+        start_time = time.time()
+        reason = self.quality_problem(image) if self.quality_gate else None
+        normalize_time = time.time()
+        if reason is not None:
+            return reason, None, None, None, normalize_time - start_time, 0.0
+        result, normalized = self.shrink(image)
+        return (None, normalized.array,
+                None if normalized is image else normalized.raw, result,
+                normalize_time - start_time, time.time() - normalize_time)
+
+    async def prepare_in_pool(self, pool, image) -> tuple:
+        """
+        Quality gate (check_quality) and normalization (normalize) of an
+        input image in the image process pool.
+        Args:
+            pool: (ProcessPool) Image process pool of the worker.
+            image: (ImageData) Image received.
+        Returns:
+            (tuple) Image forwarded to the remote APIs and seconds of the
+                    quality gate and of the normalization.
+        """
+        reason, array, raw, result, quality_time, normalize_time = \
+            await pool.run('prepare', self.prepare_bytes, image.raw)
+        if reason is not None:
+            self.reject(reason)
+        if raw is None:
+            image.set_array(array)
+            normalized = image
+        else:
+            normalized = ImageData(None, image.tag, array, raw)
+        self.count_normalization(image, normalized, result)
+        return normalized, quality_time, normalize_time
+
+    def rotate(self, image, angle) -> ImageData:
+        """
+        Rotate the decoded image and encode it again as JPEG.
+        Args:
+            image: (ImageData) Image to rotate, must be decodable.
+            angle: (int) Rotation angle (90, 180, 270).
+        Returns:
+            (ImageData) Rotated image.
+        """
+        return ImageData(None, image.tag, *self.rotate_array(
+            image.array, angle))
+
+    def rotate_array(self, array, angle) -> tuple:
+        """
+        Rotate pixels and encode them as JPEG.
+        Args:
+            array: (np.ndarray) Pixels (BGR).
+            angle: (int) Rotation angle (90, 180, 270).
+        Returns:
+            (tuple) Rotated pixels and their JPEG file bytes.
+        """
+        array = cv2.rotate(array, self.rotate_codes[angle])
+        return array, self.to_jpeg(array)
+
+    def likely_angles(self, image, limit=4) -> list:
+        """
+        Rank the rotations of an image by the confidence of a local Haar
+        cascade face detection on a small grayscale copy, so the remote
+        detector is asked first for the most likely orientation. The four
+        rotations are scored and the limit best of them are kept.
+        Args:
+            image: (ImageData) Image to search.
+            limit: (int) Number of rotations returned.
+        Returns:
+            (list) Angles (0, 90, 180, 270) where a face was found locally,
+                   most likely first. Empty without local face, for images
+                   OpenCV can not decode or without the cascade.
+        """
+        if image.array is None:
+            return []
+        return list(self.rank_angles(image.array, limit))
+
+    def rank_angles(self, array, limit=4) -> tuple:
+        """
+        Rank the rotations of decoded pixels, see likely_angles.
+        Args:
+            array: (np.ndarray) Pixels (BGR).
+            limit: (int) Number of rotations returned.
+        Returns:
+            (tuple) Angles where a face was found locally, most likely first.
+        """
+        cascade = self.face_cascade()
+        if cascade is None:
+            return ()
+        gray = cv2.cvtColor(array, cv2.COLOR_BGR2GRAY) \
+            if array.ndim == 3 else array
+        height, width = gray.shape[:2]
+        scale = self.orientation_side / max(height, width)
+        if scale < 1:
+            gray = cv2.resize(gray, (max(1, round(width * scale)),
+                                     max(1, round(height * scale))),
+                              interpolation=cv2.INTER_AREA)
+        gray = cv2.equalizeHist(gray)
+        min_side = max(20, min(gray.shape[:2]) // 8)
+        scores = list()
+        for angle in [0, 90, 270, 180]:
+            rotated = cv2.rotate(gray, self.rotate_codes[angle]) \
+                if angle else gray
+            faces, _, weights = cascade.detectMultiScale3(
+                rotated, scaleFactor=1.1, minNeighbors=4,
+                minSize=(min_side, min_side), outputRejectLevels=True)
+            if len(faces):
+                scores.append((float(max(weights)), angle))
+        return tuple(angle for _, angle in sorted(
+            scores, key=lambda score: score[0], reverse=True)[:limit])
+
+    @classmethod
+    def face_cascade(cls):
+        """
+        Haar cascade of frontal faces, loaded once per thread.
+        Returns:
+            (CascadeClassifier) Face detector, None when this OpenCV build
+                                does not provide it.
+        """
+        cascade = getattr(cls.__cascades, 'cascade', False)
+        if cascade is False:
+            cascade = None
+            data = getattr(getattr(cv2, 'data', None), 'haarcascades', '')
+            path = os.path.join(data, cls.cascade_file)
+            if hasattr(cv2, 'CascadeClassifier') and os.path.isfile(path):
+                cascade = cv2.CascadeClassifier(path)
+            else:
+                logging.getLogger('face_similarity.api').info(
+                    'ORIENTATION_PREFILTER > Haar cascade not available')
+            cls.__cascades.cascade = cascade
+        return cascade
+
+    def to_jpeg(self, array, quality=None) -> bytes:
+        """
+        Encode pixels as JPEG.
+        Args:
+            array: (np.ndarray) Pixels (BGR).
+            quality: (int) JPEG quality, ROTATION_JPEG_QUALITY by default.
+        Returns:
+            (bytes) JPEG file bytes.
+        """
+        _, buffer = cv2.imencode('.jpg', array, [
+            cv2.IMWRITE_JPEG_QUALITY, quality or self.jpeg_quality])
+        return buffer.tobytes()
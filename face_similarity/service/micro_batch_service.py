@@ -0,0 +1,150 @@
+import asyncio
+import threading
+
+from prometheus_client import Histogram
+from werkzeug.exceptions import HTTPException
+
+from face_similarity.service.requisitions_service import RequisitionsService
+from face_similarity.utils.api_util import ApiUtil
+from face_similarity.utils.batch_adapter import BatchAdapter
+from face_similarity.utils.deadline import Deadline
+from face_similarity.utils.response_error import raise_error
+
+upstream_batch_size = Histogram(
+    'upstream_batch_size', 'Images per batched upstream call',
+    ['stage'], buckets=(1, 2, 4, 8, 16, 32, 64, float('inf')))
+
+
+class MicroBatchService:
+    """
+    Class that joins the api-face-detect (or api-face-encoding) calls of the
+    concurrent requests of the worker into batched calls. The calls arriving
+    within UPSTREAM_BATCH_WINDOW_MS of the first one, up to
+    UPSTREAM_BATCH_MAX_SIZE, are sent in one request to the batch endpoint
+    (FACE_DETECT_BATCH_URL, FACE_ENCODING_BATCH_URL) and each caller gets its
+    own result. The batch protocol is given by a BatchAdapter.
+    """
+    batch_urls = {'detect': 'FACE_DETECT_BATCH_URL',
+                  'encode': 'FACE_ENCODING_BATCH_URL'}
+    __instances = dict()
+    __lock = threading.Lock()
+
+    def __init__(self, stage, url, adapter, window=0.005, max_size=16):
+        """
+        Class Constructor.
+        Args:
+            stage: (str) Pipeline stage (detect, encode).
+            url: (str) Batch endpoint.
+            adapter: (BatchAdapter) Protocol of the batch endpoint.
+            window: (float) Seconds the first call of a batch waits for
+                            others.
+            max_size: (int) Calls of a full batch, sent at once.
+        """
+        self.stage = stage
+        self.url = url
+        self.adapter = adapter
+        self.window = window
+        self.max_size = max_size
+        self.pending = list()
+        self.timer = None
+        # Batches in flight, referenced until done so the loop, which only
+        # keeps weak references to its tasks, does not collect them.
+        self.tasks = set()
+
+    @classmethod
+    def instance(cls, stage):
+        """
+        Get the batcher of the stage in the running event loop, None when
+        the batch endpoint of the stage is not configured.
+        Args:
+            stage: (str) Pipeline stage (detect, encode).
+        Returns:
+            (MicroBatchService) Batcher of the stage.
+        """
+        utils = ApiUtil()
+        name = cls.batch_urls.get(stage)
+        url = utils.environ_default(name, '') if name else ''
+        if not url:
+            return None
+        key = (asyncio.get_event_loop(), stage)
+        with cls.__lock:
+            if key not in cls.__instances:
+                cls.__instances[key] = cls(
+                    stage, url, BatchAdapter.load(utils.environ_default(
+                        'UPSTREAM_BATCH_ADAPTER',
+                        'face_similarity.utils.batch_adapter.'
+                        'JsonBatchAdapter')),
+                    utils.environ_default(
+                        'UPSTREAM_BATCH_WINDOW_MS', 5.0) / 1000.0,
+                    utils.environ_default('UPSTREAM_BATCH_MAX_SIZE', 16))
+            return cls.__instances[key]
+
+    async def post(self, endpoint, deadline) -> list:
+        """
+        Add a call to the next batch and wait for its result.
+        Args:
+            endpoint: (list) Url, serialized payload, image identifier and
+                             stage of the single call.
+            deadline: (Deadline) Time budget of the request of the call.
+        Returns:
+            (list) Status code, response and image identifier.
+        """
+        timeout = deadline.timeout(self.stage)
+        future = asyncio.get_event_loop().create_future()
+        self.pending.append((endpoint, future, deadline))
+        if len(self.pending) >= self.max_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_event_loop().call_later(
+                self.window, self.flush)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            raise_error(504)
+
+    def flush(self) -> None:
+        """
+        Send the calls waiting as one batch.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        jobs, self.pending = self.pending, list()
+        if jobs:
+            task = asyncio.ensure_future(self.send(jobs))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def send(self, jobs) -> None:
+        """
+        Request the batch endpoint and hand each result, or the error of the
+        whole batch, to its caller. The batch lives until the latest
+        deadline of its calls.
+        Args:
+            jobs: (list) Endpoint, future and deadline of each call.
+        """
+        upstream_batch_size.labels(self.stage).observe(len(jobs))
+        requisitions_service = RequisitionsService(Deadline(
+            max(deadline.remaining() for _, _, deadline in jobs)))
+        try:
+            response = await requisitions_service.post([
+                self.url, self.adapter.payload([ep[1] for ep, _, _ in jobs]),
+                'batch', self.stage])
+            results = self.adapter.split(response[1], len(jobs))
+        except asyncio.CancelledError:
+            for _, future, _ in jobs:
+                future.cancel()
+            raise
+        except Exception as exception:
+            for _, future, _ in jobs:
+                if not future.done():
+                    future.set_exception(exception)
+            return
+        for (ep, future, _), (status, body) in zip(jobs, results):
+            if future.done():
+                continue
+            try:
+                future.set_result(RequisitionsService.get_response_values(
+                    [status, body, ep[2]], ep[0]))
+            except HTTPException as exception:
+                future.set_exception(exception)
@@ -1,78 +1,286 @@
 import asyncio
-import json
 import logging
 import os
 import time
 import urllib.request
+from urllib.parse import urlsplit
 
-from aiohttp import ClientSession
+from aiohttp import ClientTimeout
+from prometheus_client import Counter, Histogram
+from werkzeug.exceptions import HTTPException
 
+from face_similarity.utils.adaptive_limiter import AdaptiveLimiter
+from face_similarity.utils.api_util import ApiUtil
+from face_similarity.utils.circuit_breaker import CircuitBreaker
+from face_similarity.utils.deadline import Deadline
+from face_similarity.utils.embedding_codec import EmbeddingCodec
+from face_similarity.utils.http_client import HttpClient
+from face_similarity.utils.latency_window import LatencyWindow
+from face_similarity.utils.payload_builder import PayloadBuilder
 from face_similarity.utils.response_error import raise_error
 
+upstream_request_latency_seconds = Histogram(
+    'upstream_request_latency_seconds',
+    'Upstream API request latency in seconds, body included',
+    ['stage', 'host', 'http_status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+             30.0, float('inf')))
+
+upstream_payload_bytes = Histogram(
+    'upstream_payload_bytes', 'Upstream API payload size in bytes',
+    ['stage', 'host', 'direction'],
+    buckets=(1024, 16384, 131072, 524288, 1048576, 2097152, 4194304,
+             8388608, 16777216, float('inf')))
+
+upstream_retries = Counter(
+    'upstream_retries', 'Upstream API requests repeated for the same image',
+    ['stage', 'host', 'reason'])
+
+# Recent latency of each stage and upstream host, shared by the requests of
+# the worker.
+recent_latency = dict()
+
 
 class RequisitionsService:
     """
     Class that guarantees the methods to make simultaneous requisitions using
-    event loop in the current OS thread. Coroutines will be wrapped in a
-    future and scheduled in the event loop. I create the list of requisitions
-    linked to a session that will be executed at the same time.
+    the event loop of the worker. Coroutines will be wrapped in a future and
+    scheduled in the event loop. I create the list of requisitions linked to
+    the worker session that will be executed at the same time.
+    Every call is bounded by the deadline of the request and, when
+    UPSTREAM_HEDGE_PERCENTILE is configured, a call slower than that
+    percentile of the recent latency of its upstream is duplicated and the
+    first answer wins. The calls to each upstream go through its circuit
+    breaker and its adaptive concurrency limit.
     """
-    response_api = list()
-    __header = {'content-type': 'application/json'}
+    # Error codes of the calls that count as failures of the upstream, and
+    # the error its open circuit answers with.
+    upstream_failures = {405: 405, 424: 424, 504: 405}
+
+    def __init__(self, deadline=None):
+        """
+        Class Constructor.
+        Args:
+            deadline: (Deadline) Time budget of the request.
+        """
+        utils = ApiUtil()
+        self.deadline = deadline or Deadline()
+        self.hedge_percentile = utils.environ_default(
+            'UPSTREAM_HEDGE_PERCENTILE', 0.0)
+        self.hedge_min_samples = utils.environ_default(
+            'UPSTREAM_HEDGE_MIN_SAMPLES', 20)
+        self.latency_window = utils.environ_default(
+            'UPSTREAM_LATENCY_WINDOW', 200)
+        # Headers of the calls of each stage.
+        self.stage_headers = dict()
+        if utils.environ_default('EMBEDDING_FORMAT', 'float32') == \
+                EmbeddingCodec.float32:
+            self.stage_headers['encode'] = {
+                EmbeddingCodec.header: EmbeddingCodec.float32}
+
+    async def post(self, endpoint) -> list:
+        """
+        Make a single request in the running event loop of the worker.
+        Args:
+            endpoint: (list) Endpoint, payload, image identifier and
+                             pipeline stage.
+        Returns:
+            (list) Status code, response and image identifier.
+        """
+        return await self.__hedged_request(HttpClient.session(), endpoint)
+
+    async def __hedged_request(self, session, ep) -> list:
+        """
+        Perform the request within the deadline. When the answer takes
+        longer than the hedge delay of the upstream a duplicate is sent and
+        the first successful answer is kept; the other one is cancelled.
+        Args:
+            session: (ClientSession) Interface for making HTTP requests.
+            ep: (list) Endpoint, payload, image identifier and stage.
+        Returns:
+            (list) Status code, response and image identifier.
+        """
+        stage, host = self.stage(ep), urlsplit(ep[0]).netloc
+        timeout = self.deadline.timeout(stage)
+        delay = self.hedge_delay(stage, host)
+        if delay is None or delay >= timeout:
+            return await self.__guarded_request(session, ep, timeout)
+        tasks = [asyncio.ensure_future(
+            self.__guarded_request(session, ep, timeout))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                upstream_retries.labels(stage, host, 'hedge').inc()
+                tasks.append(asyncio.ensure_future(self.__guarded_request(
+                    session, ep, self.deadline.timeout(stage))))
+            error = None
+            for future in asyncio.as_completed(tasks):
+                try:
+                    return await future
+                except asyncio.CancelledError:
+                    raise
+                except Exception as exception:
+                    error = exception
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
 
-    def start_loop(self, loop, endpoints_list):
+    async def __guarded_request(self, session, ep, timeout=None) -> list:
         """
-        Start task execution. Run until finished. Make multiple requests
-        simultaneously.
+        Perform the request through the circuit breaker of the upstream,
+        which fails fast while open, and its adaptive concurrency limit,
+        waiting for a free slot within the timeout of the call.
         Args:
-            loop: (event_loop) Event loop in the current OS thread.
-            endpoints_list: (list) Endpoint list with those to be required.
+            session: (ClientSession) Interface for making HTTP requests.
+            ep: (list) Endpoint, payload, image identifier and stage.
+            timeout: (float) Seconds the call may take, waiting included.
+        Returns:
+            (list) Status code, response and image identifier.
+        """
+        stage, host = self.stage(ep), urlsplit(ep[0]).netloc
+        breaker = CircuitBreaker.instance(stage, host)
+        limiter = AdaptiveLimiter.instance(stage, host)
+        if breaker is not None:
+            breaker.before_call()
+        acquired, called, answered, error = False, False, False, None
+        start_time = time.time()
+        try:
+            if limiter is not None:
+                acquired = await limiter.acquire(timeout)
+                if not acquired:
+                    raise_error(504)
+                if timeout is not None:
+                    timeout -= time.time() - start_time
+            start_time, called = time.time(), True
+            response = await self.__make_requests(session, ep, timeout)
+            answered = True
+            return response
+        except HTTPException as exception:
+            # Errors before the call (queue timeout) say nothing of the
+            # upstream.
+            answered = called
+            error = self.upstream_failures.get(exception.code)
+            raise
+        finally:
+            if breaker is not None:
+                if not answered:
+                    breaker.abandon()
+                elif error is None:
+                    breaker.success()
+                else:
+                    breaker.failure(error)
+            if acquired:
+                limiter.release(
+                    time.time() - start_time if answered else None,
+                    error is not None)
+
+    def hedge_delay(self, stage, host):
+        """
+        Time after which a call to the upstream is hedged.
+        Args:
+            stage: (str) Pipeline stage.
+            host: (str) Upstream host.
         Returns:
-            (list) Requisition response list.
+            (float) Seconds, None when hedging is disabled or there is not
+                    enough recent latency.
+        """
+        if self.hedge_percentile <= 0:
+            return None
+        window = recent_latency.get((stage, host))
+        if window is None:
+            return None
+        return window.percentile(
+            self.hedge_percentile, self.hedge_min_samples)
+
+    def add_latency(self, stage, host, latency) -> None:
+        """
+        Record the latency of a successful call of the upstream.
+        Args:
+            stage: (str) Pipeline stage.
+            host: (str) Upstream host.
+            latency: (float) Seconds of the call.
         """
-        self.response_api = list()
-        loop.create_task(self.__fetch(loop, endpoints_list))
-        loop.run_forever()
-        return self.get_response_values(endpoints_list[0])
+        window = recent_latency.get((stage, host))
+        if window is None:
+            window = recent_latency.setdefault(
+                (stage, host), LatencyWindow(self.latency_window))
+        window.add(latency)
 
-    async def __make_requests(self, session, ep):
+    async def __make_requests(self, session, ep, timeout=None) -> list:
         """
-        Create a new session and perform asynchronous request using a loop
-        event.
+        Perform asynchronous request using the pooled session of the loop.
+        Latency, status and payload sizes are recorded per pipeline stage and
+        upstream host. The calls of the encode stage ask for the compact
+        vectors (X-Embedding-Format) unless EMBEDDING_FORMAT=json.
         Args:
             session: (ClientSession) Interface for making HTTP requests.
-            ep: (list) Endpoint and payload to request.
-            loop: (event_loop) Event loop in the current OS thread.
+            ep: (list) Endpoint and payload to request, a dict or the
+                       already serialized bytes, image identifier and
+                       optionally the pipeline stage.
+            timeout: (float) Seconds the call may take, sent to the upstream
+                             in the X-Request-Timeout header.
+        Returns:
+            (list) Status code, response and image identifier.
         """
         start_time = time.time()
-        data = json.dumps(ep[1])
+        stage, host = self.stage(ep), urlsplit(ep[0]).netloc
+        data = ep[1] if isinstance(ep[1], bytes) else \
+            PayloadBuilder.dumps(ep[1])
+        upstream_payload_bytes.labels(stage, host, 'request').observe(
+            len(data))
         proxy = self.__get_proxy(ep[0])
+        options = dict()
+        headers = dict(self.stage_headers.get(stage, ()))
+        if timeout is not None:
+            options['timeout'] = ClientTimeout(total=timeout)
+            headers['X-Request-Timeout'] = '%.3f' % timeout
+        if headers:
+            options['headers'] = headers
+        status = 'error'
         try:
-            async with session.post(url=ep[0], data=data, proxy=proxy) as resp:
+            async with session.post(url=ep[0], data=data, proxy=proxy,
+                                    **options) as resp:
+                self.set_logger(start_time, ep[0], resp.status)
+                body = await resp.read()
+                status = resp.status
+                upstream_payload_bytes.labels(stage, host, 'response').observe(
+                    len(body))
                 if resp.status == 200:
-                    self.set_logger(start_time, ep[0], resp.status)
-                    response = await resp.json()
-                    self.response_api.append([resp.status, response, ep[2]])
+                    # Only successful answers: fast errors would lower the
+                    # hedge delay and duplicate the calls of an upstream
+                    # already failing.
+                    self.add_latency(stage, host, time.time() - start_time)
+                    response = [resp.status, PayloadBuilder.loads(body), ep[2]]
                 else:
-                    self.set_logger(start_time, ep[0], resp.status)
-                    self.response_api.append([resp.status, resp])
+                    response = [resp.status, body.decode('utf-8', 'replace'),
+                                ep[2]]
+        except asyncio.CancelledError:
+            status = 'cancelled'
+            raise
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            logging.getLogger('face_similarity.api').info(
+                'Upstream timeout > %s after %s seconds' % (ep[0], timeout))
+            raise_error(504)
         except Exception as exception:
             logging.getLogger('face_similarity.api').info(str(exception))
             raise_error(405)
+        finally:
+            upstream_request_latency_seconds.labels(
+                stage, host, status).observe(time.time() - start_time)
+        return self.get_response_values(response, ep[0])
 
-    async def __fetch(self, loop, endpoints):
+    @staticmethod
+    def stage(endpoint) -> str:
         """
-        Coroutines will be wrapped in a future and scheduled in the event
-        loop. I create the list of requisitions linked to a session that will
-         be executed at the same time.
+        Pipeline stage of an endpoint (preprocess, detect, encode).
         Args:
-            loop: (event_loop) Event loop in the current OS thread.
-            endpoints: (list) List the endpoint and payload to request.
+            endpoint: (list) Endpoint, payload, image identifier and stage.
+        Returns:
+            (str) Stage, 'other' when not informed.
         """
-        async with ClientSession(headers=self.__header, loop=loop) as session:
-            tasks = (self.__make_requests(session, ep) for ep in endpoints)
-            await asyncio.gather(*tasks, return_exceptions=True)
-            loop.stop()
+        return endpoint[3] if len(endpoint) > 3 else 'other'
 
     @staticmethod
     def set_logger(start_time, url, code) -> None:
@@ -113,24 +321,21 @@ class RequisitionsService:
             raise_error(428)
         return http_proxy
 
-    def get_response_values(self, endpoints) -> list:
+    @staticmethod
+    def get_response_values(response, endpoint) -> list:
         """
         Verify the response code of the requisition,
-        case 200 returns the answer otherwise it aborts.
+        case 200 returns the answer otherwise it aborts. The server errors
+        (500, 502, 503, 504...) are failures of the upstream (424), the
+        other codes are answers about the image (417).
         Args:
-            endpoints: (str) Endpoint with which the request was made.
+            response: (list) Status code, response and image identifier.
+            endpoint: (str) Endpoint with which the request was made.
         Returns:
-            (list) List of responses obtained from simultaneous requisitions.
-        """
-        for response in self.response_api:
-            if response[0] == 500:
-                raise_error(424)
-            elif response[0] > 200:
-                raise_error(417, str(response[1].text), endpoints[0])
-        return self.response_api
-
-    def __del__(self):
-        """"
-        Class destroyer.
+            (list) Response obtained from the requisition.
         """
-        del self.response_api
+        if response[0] >= 500:
+            raise_error(424)
+        elif response[0] > 200:
+            raise_error(417, str(response[1]), endpoint)
+        return response
@@ -0,0 +1,169 @@
+import asyncio
+import threading
+from collections import deque
+
+from prometheus_client import Counter, Gauge
+
+from face_similarity.utils.api_util import ApiUtil
+
+upstream_concurrency_limit = Gauge(
+    'upstream_concurrency_limit',
+    'Adaptive limit of concurrent calls to an upstream API',
+    ['stage', 'host'], multiprocess_mode='livesum')
+
+upstream_in_flight = Gauge(
+    'upstream_in_flight', 'Calls to an upstream API in flight',
+    ['stage', 'host'], multiprocess_mode='livesum')
+
+upstream_queued = Gauge(
+    'upstream_queued', 'Calls waiting for the concurrency limit of an '
+    'upstream API', ['stage', 'host'], multiprocess_mode='livesum')
+
+upstream_rejections = Counter(
+    'upstream_rejections', 'Upstream API calls rejected before being sent',
+    ['stage', 'host', 'reason'])
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit of the calls of the worker to one upstream, adapted to
+    its latency (AIMD): every call answered in time raises the limit by
+    1 / limit (about one more call per round trip), every call slower than
+    UPSTREAM_LIMIT_TOLERANCE times the usual latency, failed or timed out
+    multiplies it by UPSTREAM_LIMIT_BACKOFF. When the upstream slows down
+    the calls over the limit wait in the worker instead of piling more load
+    on it.
+    """
+    __instances = dict()
+    __lock = threading.Lock()
+
+    def __init__(self, stage, host, initial=16, minimum=1, maximum=32,
+                 tolerance=2.0, backoff=0.9, smoothing=0.01):
+        """
+        Class Constructor.
+        Args:
+            stage: (str) Pipeline stage of the upstream.
+            host: (str) Upstream host.
+            initial: (int) Limit before any call.
+            minimum: (int) Lowest limit.
+            maximum: (int) Highest limit.
+            tolerance: (float) Latency, relative to the usual one, from
+                               which a call counts as overload.
+            backoff: (float) Factor applied to the limit on overload.
+            smoothing: (float) Weight of each call in the usual latency
+                               (exponential moving average).
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.baseline = None
+        self.in_flight = 0
+        self.waiters = deque()
+        self.labels = (stage, host)
+        upstream_concurrency_limit.labels(*self.labels).set(self.limit)
+
+    @classmethod
+    def instance(cls, stage, host):
+        """
+        Get the limiter of the upstream in the running event loop, None when
+        disabled (UPSTREAM_LIMIT_MAX=0).
+        Args:
+            stage: (str) Pipeline stage of the upstream.
+            host: (str) Upstream host.
+        Returns:
+            (AdaptiveLimiter) Limiter of the upstream.
+        """
+        key = (asyncio.get_event_loop(), stage, host)
+        limiter = cls.__instances.get(key)
+        if limiter is not None:
+            return limiter
+        utils = ApiUtil()
+        maximum = utils.environ_default('UPSTREAM_LIMIT_MAX', 32)
+        if maximum <= 0:
+            return None
+        with cls.__lock:
+            if key not in cls.__instances:
+                cls.__instances[key] = cls(
+                    stage, host,
+                    utils.environ_default('UPSTREAM_LIMIT_INITIAL', 16),
+                    utils.environ_default('UPSTREAM_LIMIT_MIN', 1),
+                    maximum,
+                    utils.environ_default('UPSTREAM_LIMIT_TOLERANCE', 2.0),
+                    utils.environ_default('UPSTREAM_LIMIT_BACKOFF', 0.9))
+            return cls.__instances[key]
+
+    async def acquire(self, timeout=None) -> bool:
+        """
+        Wait for a free slot under the limit. Must be followed by release
+        when it succeeds.
+        Args:
+            timeout: (float) Seconds to wait for the slot.
+        Returns:
+            (bool) True with the slot, False when the timeout passed first.
+        """
+        if not self.waiters and self.in_flight < int(self.limit):
+            self.take()
+            return True
+        future = asyncio.get_event_loop().create_future()
+        self.waiters.append(future)
+        upstream_queued.labels(*self.labels).inc()
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except (asyncio.CancelledError, asyncio.TimeoutError) as exception:
+            if future.done() and not future.cancelled():
+                # The slot was handed over as the wait ended.
+                self.release()
+            elif future in self.waiters:
+                self.waiters.remove(future)
+            if isinstance(exception, asyncio.CancelledError):
+                raise
+            upstream_rejections.labels(*self.labels, 'queue_timeout').inc()
+            return False
+        finally:
+            upstream_queued.labels(*self.labels).dec()
+
+    def take(self) -> None:
+        """
+        Occupy a slot.
+        """
+        self.in_flight += 1
+        upstream_in_flight.labels(*self.labels).inc()
+
+    def release(self, latency=None, failed=False) -> None:
+        """
+        Free the slot of a finished call, adapt the limit to its outcome and
+        hand the free slots over to the calls waiting.
+        Args:
+            latency: (float) Seconds of the call, None for a call abandoned
+                             without an answer (no adaptation).
+            failed: (bool) The call failed or timed out.
+        """
+        self.in_flight -= 1
+        upstream_in_flight.labels(*self.labels).dec()
+        if failed:
+            self.decrease()
+        elif latency is not None:
+            if self.baseline is None:
+                self.baseline = latency
+            if latency > self.tolerance * self.baseline:
+                self.decrease()
+            elif 2 * (self.in_flight + 1) >= self.limit:
+                # Only grow a limit that is in use.
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.baseline += self.smoothing * (latency - self.baseline)
+        upstream_concurrency_limit.labels(*self.labels).set(self.limit)
+        while self.waiters and self.in_flight < int(self.limit):
+            future = self.waiters.popleft()
+            if not future.done():
+                self.take()
+                future.set_result(None)
+
+    def decrease(self) -> None:
+        """
+        Multiplicative decrease of the limit.
+        """
+        self.limit = max(self.minimum, self.limit * self.backoff)
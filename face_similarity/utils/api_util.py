@@ -1,11 +1,12 @@
 import base64
 import binascii
+import json
 import logging
 import os
 
-import cv2
 import numpy as np
 
+from face_similarity.utils.image_data import ImageData
 from face_similarity.utils.response_error import raise_error
 
 
@@ -22,13 +23,17 @@ class ApiUtil:
         Returns:
             'np.ndarray: An ndimentional array of the input image.
         """
-        np_res = None
-        np_array = np.frombuffer(base64.b64decode(encoded), np.uint8)
-        try:
-            np_res = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
-        except cv2.error:
-            raise_error(401)
-        return np_res
+        return ApiUtil.bytes_to_numpy(base64.b64decode(encoded))
+
+    @staticmethod
+    def bytes_to_numpy(raw) -> np.ndarray:
+        """Convert encoded image bytes (JPEG, PNG) to numpy.
+        Args:
+            raw (bytes): Image file bytes.
+        Returns:
+            'np.ndarray: An ndimentional array of the input image.
+        """
+        return ImageData.decode(raw)
 
     @staticmethod
     def is_base64(str_b64):
@@ -38,29 +43,197 @@ class ApiUtil:
         Returns:
             bool: True if input is base64 encoded, raise ValueError otherwise.
         """
+        ApiUtil.decode_base64(str_b64)
+
+    @staticmethod
+    def decode_base64(str_b64) -> bytes:
+        """Decode a base64 image, aborting when it is not base64.
+        Args:
+            str_b64 (str): String containing base64 code.
+        Returns:
+            bytes: Image file bytes.
+        """
         try:
-            base64.b64decode(str_b64)
-        except binascii.Error:
+            return base64.b64decode(str_b64)
+        except (binascii.Error, TypeError, ValueError):
             raise_error(401)
 
+    @staticmethod
+    def bytes_exif_orientation(header) -> int:
+        """Read the EXIF orientation tag of JPEG image bytes.
+        Args:
+            header (bytes): Image file bytes, or their beginning.
+        Returns:
+            int: Orientation (1 to 8), 1 when the tag is not present.
+        """
+        if header[:2] != b'\xff\xd8':
+            return 1
+        offset = 2
+        while offset + 4 <= len(header) and header[offset] == 0xFF:
+            marker = header[offset + 1]
+            length = int.from_bytes(header[offset + 2:offset + 4], 'big')
+            # Start of scan, no more metadata segments.
+            if marker == 0xDA:
+                break
+            segment = header[offset + 4:offset + 2 + length]
+            if marker == 0xE1 and segment[:6] == b'Exif\x00\x00':
+                return ApiUtil.__tiff_orientation(segment[6:])
+            offset += 2 + length
+        return 1
+
+    @staticmethod
+    def __tiff_orientation(tiff) -> int:
+        """Read the orientation tag (0x0112) from the IFD0 of a TIFF header.
+        Args:
+            tiff (bytes): TIFF header of the EXIF segment.
+        Returns:
+            int: Orientation (1 to 8), 1 when the tag is not present.
+        """
+        order = {b'II': 'little', b'MM': 'big'}.get(tiff[:2])
+        if order is None or len(tiff) < 8:
+            return 1
+        ifd = int.from_bytes(tiff[4:8], order)
+        count = int.from_bytes(tiff[ifd:ifd + 2], order)
+        for i in range(count):
+            entry = tiff[ifd + 2 + i * 12:ifd + 14 + i * 12]
+            if len(entry) < 12:
+                break
+            if int.from_bytes(entry[:2], order) == 0x0112:
+                orientation = int.from_bytes(entry[8:10], order)
+                return orientation if 1 <= orientation <= 8 else 1
+        return 1
+
+    def request_parameters(self, request, file_key=None) -> tuple:
+        """Get the parameters and the uploaded image files of a request.
+        JSON bodies carry base64 images. multipart/form-data bodies carry the
+        image files and the other parameters as form fields. For single image
+        requests (file_key), an application/octet-stream body is the image
+        and the other parameters go in the query string.
+        Args:
+            request (Request): Object of the request.
+            file_key (str): Parameter of the image of an octet-stream body.
+        Returns:
+            tuple: Parameters (dict) and image files (dict of lists of bytes).
+        """
+        if request.is_json:
+            return request.get_json(), dict()
+        if request.mimetype == 'multipart/form-data':
+            files = {key: [upload.read() for upload in uploads]
+                     for key, uploads in request.files.lists()}
+            return request.form.to_dict(), files
+        if request.mimetype == 'application/octet-stream' and file_key:
+            # Read the body from the stream, without caching a copy of it.
+            return request.args.to_dict(), {
+                file_key: [request.stream.read()]}
+        raise_error(400)
+
+    def request_images(self, params, files, key, start=1) -> list:
+        """Get the images of a parameter, decoding each one only once.
+        Args:
+            params (dict): Parameters of the request, base64 images.
+            files (dict): Uploaded image files.
+            key (str): Parameter of the images.
+            start (int): Number of the first image identifier (img_1).
+        Returns:
+            list: Images (ImageData).
+        """
+        if key in files:
+            return [ImageData(None, 'img_%s' % (start + i), raw=raw)
+                    for i, raw in enumerate(files[key])]
+        values = params[key] if isinstance(params[key], list) else [
+            params[key]]
+        # str represents base64?
+        return [ImageData(value, 'img_%s' % (start + i),
+                          raw=self.decode_base64(value))
+                for i, value in enumerate(values)]
+
+    @staticmethod
+    def form_value(params, key, value_type):
+        """Convert a form or query string parameter (str) to the type of
+        the JSON parameter.
+        Args:
+            params (dict): Parameters of the request.
+            key (str): Parameter name.
+            value_type (type): Type of the JSON parameter.
+        """
+        if isinstance(params.get(key), str) and value_type is not str:
+            try:
+                params[key] = json.loads(params[key])
+            except ValueError:
+                raise_error(400)
+
     def is_valid_request(self, request) -> tuple:
         """Check if the request has the valid parameters and values.
         Args:
             request (Request): Object of the request.
         Returns:
-            vector: (np.ndarray) an n dimensional array of the 64 image.
+            tuple: Both images (ImageData).
         """
-        if not request.is_json:
-            raise_error(400)
-        result = request.get_json()
+        result, files = self.request_parameters(request)
         # The request contains the correct parameters?
-        if not all(key in result for key in ['img1', 'img2']):
+        if not isinstance(result, dict) or not all(
+                key in result or key in files for key in ['img1', 'img2']):
             raise_error(404)
-        # str represents base64?
-        self.is_base64(result['img1'])
-        self.is_base64(result['img2'])
+        return (self.request_images(result, files, 'img1')[0],
+                self.request_images(result, files, 'img2', 2)[0])
 
-        return result["img1"], result['img2']
+    def is_valid_gallery_request(self, request, keys) -> dict:
+        """Check if the gallery request has the valid parameters and values.
+        Args:
+            request (Request): Object of the request.
+            keys (list): Required parameters, 'image' is the image file or
+                         its base64 code.
+        Returns:
+            dict: Parameters of the request, 'image' as ImageData.
+        """
+        result, files = self.request_parameters(request, 'image')
+        # The request contains the correct parameters?
+        if not isinstance(result, dict) or not all(
+                key in result or key in files for key in keys):
+            raise_error(404)
+        self.form_value(result, 'top_k', int)
+        if 'subject_id' in result and not isinstance(
+                result['subject_id'], str):
+            raise_error(400)
+        if 'top_k' in result and not (
+                isinstance(result['top_k'], int) and result['top_k'] > 0):
+            raise_error(400)
+        result['image'] = self.request_images(result, files, 'image')[0]
+        return result
+
+    def is_valid_batch_request(self, request, max_images) -> tuple:
+        """Check if the batch request has the valid parameters and values.
+        The pairs to compare are informed as a list of image indexes
+        ('pairs') or as the index of one image compared with all the others
+        ('probe').
+        Args:
+            request (Request): Object of the request.
+            max_images (int): Maximum number of images of the batch.
+        Returns:
+            tuple: Images (ImageData) and pairs of indexes to compare.
+        """
+        result, files = self.request_parameters(request)
+        # The request contains the correct parameters?
+        if not isinstance(result, dict) or not (
+                'images' in result or 'images' in files) or not (
+                'pairs' in result or 'probe' in result):
+            raise_error(404)
+        self.form_value(result, 'pairs', list)
+        self.form_value(result, 'probe', int)
+        images = files.get('images', result.get('images'))
+        if not isinstance(images, list) or not 0 < len(images) <= max_images:
+            raise_error(400)
+        if 'pairs' in result:
+            pairs = result['pairs']
+        else:
+            pairs = [[result['probe'], i] for i in range(len(images))
+                     if i != result['probe']]
+        if not isinstance(pairs, list) or not all(
+                isinstance(pair, list) and len(pair) == 2 and all(
+                    isinstance(i, int) and 0 <= i < len(images)
+                    for i in pair) for pair in pairs):
+            raise_error(400)
+        return self.request_images(result, files, 'images'), pairs
 
     @staticmethod
     def environ_value(environ):
@@ -77,3 +250,27 @@ class ApiUtil:
             logging.getLogger('face_similarity.api').info(
                 environ + ' > not found')
             raise_error(428)
+
+    @staticmethod
+    def environ_default(environ, default):
+        """
+        Get optional values from operating system environment. The value is
+        converted to the type of the default value.
+        Args:
+            environ: (str) Environment variable name.
+            default: (any) Value used when the variable is not configured.
+        Returns:
+            (any) Value of the environment variable or default.
+        """
+        try:
+            value = os.environ[environ]
+        except KeyError:
+            return default
+        if isinstance(default, bool):
+            return value.strip().lower() in ('1', 'true', 'yes', 'on')
+        try:
+            return type(default)(value)
+        except (TypeError, ValueError):
+            logging.getLogger('face_similarity.api').info(
+                environ + ' > invalid value, using default')
+            return default
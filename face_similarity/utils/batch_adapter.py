@@ -0,0 +1,69 @@
+import importlib
+
+from face_similarity.utils.response_error import raise_error
+
+
+class BatchAdapter:
+    """
+    Protocol of a batch endpoint of an upstream API: how the payloads of
+    single-image calls are combined in one request and how its answer is
+    split back into one result per image. Subclass it and point
+    UPSTREAM_BATCH_ADAPTER to the class to talk to another batch API.
+    """
+
+    def payload(self, payloads) -> bytes:
+        """
+        Build the request of a batch.
+        Args:
+            payloads: (list) Serialized payloads (bytes) of single calls.
+        Returns:
+            (bytes) Serialized request.
+        """
+        raise NotImplementedError
+
+    def split(self, response, count) -> list:
+        """
+        Split the answer of a batch.
+        Args:
+            response: (any) Parsed answer of the batch endpoint.
+            count: (int) Number of payloads sent.
+        Returns:
+            (list) Status code and answer of each payload, in order.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def load(path):
+        """
+        Build the adapter of a dotted path (package.module.Class).
+        Args:
+            path: (str) Dotted path of a BatchAdapter subclass.
+        Returns:
+            (BatchAdapter) Adapter.
+        """
+        module, _, name = path.rpartition('.')
+        try:
+            return getattr(importlib.import_module(module), name)()
+        except (ImportError, AttributeError, ValueError):
+            raise_error(428)
+
+
+class JsonBatchAdapter(BatchAdapter):
+    """
+    Default batch protocol: the payloads of the single calls go in a list,
+    {"items": [payload, ...]}, and the endpoint answers
+    {"results": [{"status": 200, "body": answer}, ...]} in the same order,
+    each body being the answer of the single call.
+    """
+
+    def payload(self, payloads) -> bytes:
+        return b''.join((b'{"items":[', b','.join(payloads), b']}'))
+
+    def split(self, response, count) -> list:
+        results = response.get('results') if isinstance(
+            response, dict) else None
+        if not isinstance(results, list) or len(results) != count:
+            raise_error(417, 'batch answer with %s results for %s items' % (
+                len(results) if isinstance(results, list) else None, count))
+        return [[item.get('status', 500), item.get('body')]
+                for item in results]
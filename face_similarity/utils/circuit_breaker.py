@@ -0,0 +1,137 @@
+import threading
+import time
+
+from prometheus_client import Gauge
+
+from face_similarity.utils.adaptive_limiter import upstream_rejections
+from face_similarity.utils.api_util import ApiUtil
+from face_similarity.utils.response_error import raise_error
+
+upstream_circuit_state = Gauge(
+    'upstream_circuit_state',
+    'Circuit breaker of an upstream API: 0 closed, 1 half open, 2 open',
+    ['stage', 'host'], multiprocess_mode='livemax')
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of the calls of the worker to one upstream. After
+    UPSTREAM_BREAKER_FAILURES consecutive failures (connection errors,
+    timeouts, 500 answers) the circuit opens and the calls fail fast with the
+    error of the last failure (405 or 424) for UPSTREAM_BREAKER_RESET
+    seconds. Then one call probes the upstream: its success closes the
+    circuit, its failure opens it again.
+    """
+    closed, half_open, open = 0, 1, 2
+    __instances = dict()
+    __lock = threading.Lock()
+
+    def __init__(self, stage, host, failures=5, reset_timeout=10.0,
+                 clock=time.monotonic):
+        """
+        Class Constructor.
+        Args:
+            stage: (str) Pipeline stage of the upstream.
+            host: (str) Upstream host.
+            failures: (int) Consecutive failures that open the circuit.
+            reset_timeout: (float) Seconds the circuit stays open.
+            clock: (callable) Time source in seconds.
+        """
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.closed
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.error = 405
+        self.labels = (stage, host)
+        self.lock = threading.Lock()
+        upstream_circuit_state.labels(*self.labels).set(self.state)
+
+    @classmethod
+    def instance(cls, stage, host):
+        """
+        Get the circuit breaker of the upstream in the worker, None when
+        disabled (UPSTREAM_BREAKER_FAILURES=0).
+        Args:
+            stage: (str) Pipeline stage of the upstream.
+            host: (str) Upstream host.
+        Returns:
+            (CircuitBreaker) Circuit breaker of the upstream.
+        """
+        breaker = cls.__instances.get((stage, host))
+        if breaker is not None:
+            return breaker
+        utils = ApiUtil()
+        failures = utils.environ_default('UPSTREAM_BREAKER_FAILURES', 5)
+        if failures <= 0:
+            return None
+        with cls.__lock:
+            if (stage, host) not in cls.__instances:
+                cls.__instances[(stage, host)] = cls(
+                    stage, host, failures, utils.environ_default(
+                        'UPSTREAM_BREAKER_RESET', 10.0))
+            return cls.__instances[(stage, host)]
+
+    def before_call(self) -> None:
+        """
+        Let a call through, or abort with the error of the last failure
+        while the circuit is open (or already probing). A call let through
+        must be followed by success, failure or abandon.
+        """
+        with self.lock:
+            if self.state == self.open and \
+                    self.clock() - self.opened_at >= self.reset_timeout:
+                self.set_state(self.half_open)
+            if self.state == self.closed:
+                return
+            if self.state == self.half_open and not self.probing:
+                self.probing = True
+                return
+            error = self.error
+        upstream_rejections.labels(*self.labels, 'circuit_open').inc()
+        raise_error(error)
+
+    def success(self) -> None:
+        """
+        Record a call answered by the upstream, closing the circuit.
+        """
+        with self.lock:
+            self.consecutive_failures = 0
+            self.probing = False
+            self.set_state(self.closed)
+
+    def failure(self, error) -> None:
+        """
+        Record a failed call, opening the circuit after too many in a row or
+        when the probe fails.
+        Args:
+            error: (int) Error code of the failure (405, 424).
+        """
+        with self.lock:
+            self.consecutive_failures += 1
+            self.error = error
+            if self.state == self.half_open or \
+                    self.consecutive_failures >= self.failures:
+                self.probing = False
+                self.opened_at = self.clock()
+                self.set_state(self.open)
+
+    def abandon(self) -> None:
+        """
+        Record a call abandoned without an answer (cancelled), freeing the
+        probe of a half open circuit.
+        """
+        with self.lock:
+            self.probing = False
+
+    def set_state(self, state) -> None:
+        """
+        Change the state of the circuit and publish it in the
+        upstream_circuit_state gauge. Must be called holding the lock.
+        Args:
+            state: (int) New state (closed, half_open, open).
+        """
+        self.state = state
+        upstream_circuit_state.labels(*self.labels).set(state)
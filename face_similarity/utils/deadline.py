@@ -0,0 +1,66 @@
+import time
+
+from face_similarity.utils.api_util import ApiUtil
+from face_similarity.utils.response_error import raise_error
+
+
+class Deadline:
+    """
+    Time budget of one request (REQUEST_DEADLINE seconds), shared by all of
+    its upstream calls. Every call waits at most the limit of its pipeline
+    stage (UPSTREAM_TIMEOUT_PREPROCESS, _DETECT, _ENCODE) and never past the
+    end of the budget, so a stuck upstream can not hold the request until the
+    worker timeout. When the budget left is short, it is split between the
+    stage of the call and the stages after it in proportion to their limits,
+    so a slow detection leaves time for the encoding.
+    """
+    stage_timeouts = {'preprocess': 5.0, 'detect': 10.0, 'encode': 10.0}
+    # Order of the stages in the pipeline of one image.
+    stage_order = ['preprocess', 'detect', 'encode']
+
+    def __init__(self, budget=None, clock=time.monotonic):
+        """
+        Class Constructor. The budget starts counting now.
+        Args:
+            budget: (float) Seconds of the request, REQUEST_DEADLINE when
+                            not informed.
+            clock: (callable) Time source in seconds.
+        """
+        utils = ApiUtil()
+        if budget is None:
+            budget = utils.environ_default('REQUEST_DEADLINE', 30.0)
+        self.clock = clock
+        self.expires_at = clock() + budget
+        self.limits = {
+            stage: utils.environ_default(
+                'UPSTREAM_TIMEOUT_' + stage.upper(), limit)
+            for stage, limit in self.stage_timeouts.items()}
+
+    def remaining(self) -> float:
+        """
+        Seconds left of the budget.
+        Returns:
+            (float) Remaining seconds, 0 when expired.
+        """
+        return max(0.0, self.expires_at - self.clock())
+
+    def timeout(self, stage) -> float:
+        """
+        Timeout of the next upstream call of a stage: its limit, or its share
+        of the budget left when that is shorter. Aborts with 504 when the
+        budget is over.
+        Args:
+            stage: (str) Pipeline stage (preprocess, detect, encode).
+        Returns:
+            (float) Seconds the call may take.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise_error(504)
+        limit = self.limits.get(stage)
+        if limit is None:
+            return remaining
+        ahead = sum(self.limits[name] for name in self.stage_order[
+            self.stage_order.index(stage):])
+        share = remaining * limit / ahead if ahead > 0 else remaining
+        return min(remaining, limit, share)
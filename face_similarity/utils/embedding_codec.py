@@ -0,0 +1,56 @@
+import base64
+import binascii
+import json
+
+import numpy as np
+
+from face_similarity.utils.response_error import raise_error
+
+
+class EmbeddingCodec:
+    """
+    Formats of the vectors answered by api-face-encoding in its
+    'faces_encoding' field. The legacy format is a JSON string with the list
+    of vectors, parsed twice into Python floats. The compact format, asked
+    for with the X-Embedding-Format header and marked in the answer by
+    'encoding_format', is the base64 code of the little-endian float32
+    values of the vectors, read with NumPy without intermediate lists.
+    """
+    header = 'X-Embedding-Format'
+    float32 = 'float32'
+    dimensions = 128
+
+    @classmethod
+    def encode(cls, vectors) -> dict:
+        """
+        Build an answer in the compact format.
+        Args:
+            vectors: (np.ndarray) Faces encodings (N x 128).
+        Returns:
+            (dict) Fields of the answer.
+        """
+        data = np.ascontiguousarray(vectors, dtype='<f4').tobytes()
+        return {'faces_encoding': base64.b64encode(data).decode('ascii'),
+                'encoding_format': cls.float32}
+
+    @classmethod
+    def decode(cls, answer) -> np.ndarray:
+        """
+        Read the vectors of an answer of api-face-encoding, in the compact
+        or the legacy format.
+        Args:
+            answer: (dict) Answer of api-face-encoding.
+        Returns:
+            (np.ndarray) Faces encodings (N x 128), float32 (read-only) for
+                         the compact format, float64 for the legacy one.
+        """
+        encoding = answer['faces_encoding']
+        if answer.get('encoding_format') != cls.float32:
+            return np.asarray(json.loads(encoding), dtype=np.float64)
+        try:
+            data = base64.b64decode(encoding)
+        except (binascii.Error, TypeError, ValueError):
+            raise_error(417, 'faces_encoding is not base64')
+        if len(data) % (4 * cls.dimensions):
+            raise_error(417, 'faces_encoding with %s bytes' % len(data))
+        return np.frombuffer(data, '<f4').reshape(-1, cls.dimensions)
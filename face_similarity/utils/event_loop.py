@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+import threading
+
+from face_similarity.utils.http_client import HttpClient
+from face_similarity.utils.process_pool import ProcessPool
+
+
+class WorkerLoop:
+    """
+    Long-running event loop owned by the worker process. The loop runs in a
+    daemon thread and the request threads submit the whole pipeline coroutine
+    to it and wait on a future, so the loop (and the sessions, caches and
+    limiters bound to it) is not created and destroyed on every request.
+    """
+    __instance = None
+    __lock = threading.Lock()
+
+    def __init__(self):
+        """
+        Class Constructor. Start the loop thread.
+        """
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.__run, name='face-similarity-loop', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def instance(cls):
+        """
+        Get the loop of the current worker process, started on first use
+        (after gunicorn forks the worker).
+        Returns:
+            (WorkerLoop) Loop of the worker.
+        """
+        with cls.__lock:
+            if cls.__instance is None or cls.__instance.pid != os.getpid():
+                cls.__instance = cls()
+            return cls.__instance
+
+    def __run(self):
+        """
+        Thread target, run the loop until it is stopped.
+        """
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coroutine, timeout=None):
+        """
+        Submit a coroutine to the worker loop and wait for its result in the
+        calling thread. Exceptions raised by the coroutine are re-raised.
+        Args:
+            coroutine: (coroutine) Work to run in the loop.
+            timeout: (float) Seconds to wait for the result.
+        Returns:
+            (any) Result of the coroutine.
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """
+        Close the pooled sessions, stop the image process pool and the loop
+        of the worker.
+        """
+        with cls.__lock:
+            worker_loop, cls.__instance = cls.__instance, None
+        HttpClient.shutdown()
+        ProcessPool.shutdown()
+        if worker_loop is None or worker_loop.pid != os.getpid():
+            return
+        worker_loop.loop.call_soon_threadsafe(worker_loop.loop.stop)
+        worker_loop.thread.join(timeout=5)
+        logging.getLogger('face_similarity.api').info(
+            'Worker loop > stopped')
+
+
+async def gather_or_cancel(*coroutines) -> list:
+    """
+    Run coroutines concurrently and return their results in order. When one
+    of them fails the others are cancelled before the error is re-raised.
+    Args:
+        coroutines: (coroutine) Work to run concurrently.
+    Returns:
+        (list) Results of the coroutines.
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def first_completed(*coroutines):
+    """
+    Run coroutines concurrently and return the first result that is not
+    None, in order of completion. The coroutines still running are cancelled.
+    Args:
+        coroutines: (coroutine) Work to run concurrently.
+    Returns:
+        (any) First result found, None when every result is None.
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            if result is not None:
+                return result
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import threading
+
+from aiohttp import ClientSession, TCPConnector
+
+from face_similarity.utils.api_util import ApiUtil
+
+
+class HttpClient:
+    """
+    Long-lived HTTP client of the worker. Keeps one aiohttp session, and its
+    bounded connection pool, per event loop so the connections to
+    'api-preprocess, api-face-detect, api-face-encoding' are kept alive and
+    reused between requisitions instead of paying a new TCP (and TLS)
+    handshake for every stage.
+    """
+    __header = {'content-type': 'application/json'}
+    __sessions = dict()
+    __lock = threading.Lock()
+
+    @classmethod
+    def session(cls, loop=None) -> ClientSession:
+        """
+        Get the session bound to the event loop, created on first use.
+        Must be called from a coroutine running in that loop.
+        Args:
+            loop: (event_loop) Event loop in the current OS thread.
+        Returns:
+            (ClientSession) Interface for making HTTP requests.
+        """
+        loop = loop or asyncio.get_event_loop()
+        with cls.__lock:
+            session = cls.__sessions.get(loop)
+            if session is None or session.closed:
+                session = ClientSession(
+                    headers=cls.__header, connector=cls.connector())
+                cls.__sessions[loop] = session
+        return session
+
+    @staticmethod
+    def connector() -> TCPConnector:
+        """
+        Build the connection pool used by the sessions.
+        Returns:
+            (TCPConnector) Connector with keep-alive, DNS cache and limits.
+        """
+        utils = ApiUtil()
+        return TCPConnector(
+            limit=utils.environ_default('HTTP_POOL_LIMIT', 100),
+            limit_per_host=utils.environ_default(
+                'HTTP_POOL_LIMIT_PER_HOST', 32),
+            keepalive_timeout=utils.environ_default(
+                'HTTP_KEEPALIVE_TIMEOUT', 60.0),
+            use_dns_cache=True,
+            ttl_dns_cache=utils.environ_default('HTTP_DNS_CACHE_TTL', 300))
+
+    @classmethod
+    async def close(cls) -> None:
+        """
+        Close the session of the running loop and its pooled connections.
+        Used by the ASGI lifespan shutdown, inside the loop of the server.
+        """
+        with cls.__lock:
+            session = cls.__sessions.pop(asyncio.get_event_loop(), None)
+        if session is not None and not session.closed:
+            await session.close()
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """
+        Close every session and its pooled connections. Used as the worker
+        shutdown hook.
+        """
+        with cls.__lock:
+            sessions, cls.__sessions = cls.__sessions, dict()
+        for loop, session in sessions.items():
+            if session.closed or loop.is_closed():
+                continue
+            try:
+                if loop.is_running():
+                    asyncio.run_coroutine_threadsafe(
+                        session.close(), loop).result(timeout=5)
+                else:
+                    loop.run_until_complete(session.close())
+            except Exception as exception:
+                logging.getLogger('face_similarity.api').info(str(exception))
+        logging.getLogger('face_similarity.api').info(
+            'HTTP client > closed %s session(s)' % len(sessions))
@@ -0,0 +1,122 @@
+import base64
+import hashlib
+
+import cv2
+import numpy as np
+
+from face_similarity.utils.payload_builder import PayloadBuilder
+from face_similarity.utils.response_error import raise_error
+
+
+class ImageData:
+    """
+    Image handled by the pipeline. Keeps the base64 code sent to the remote
+    APIs and decodes the bytes and pixels at most once, on demand, so every
+    stage (cache, rotation, detection, encoding) shares the same buffers.
+    Images uploaded as files start from the bytes and are base64 encoded
+    only when a remote API needs them.
+    """
+
+    def __init__(self, b64, tag, array=None, raw=None):
+        """
+        Class Constructor.
+        Args:
+            b64: (str) Containing base64 code from image, None when the
+                       bytes are informed.
+            tag: (str) Image identifier (img_1, img_2).
+            array: (np.ndarray) Decoded pixels, when already known.
+            raw: (bytes) Image file bytes, when already known.
+        """
+        self.tag = tag
+        self.__b64 = b64
+        self.__raw = raw
+        self.__digest = None
+        self.__b64_json = None
+        self.__array = array
+        self.__decoded = array is not None
+
+    @property
+    def b64(self) -> str:
+        """
+        Base64 code of the image file bytes.
+        Returns:
+            (str) Base64 code.
+        """
+        if self.__b64 is None:
+            self.__b64 = base64.b64encode(self.__raw).decode('ascii')
+        return self.__b64
+
+    @property
+    def raw(self) -> bytes:
+        """
+        Image file bytes decoded from base64.
+        Returns:
+            (bytes) Image file bytes.
+        """
+        if self.__raw is None:
+            self.__raw = base64.b64decode(self.__b64)
+        return self.__raw
+
+    @property
+    def b64_json(self) -> bytes:
+        """
+        Base64 code serialized as a JSON string, shared by every payload
+        that carries the image.
+        Returns:
+            (bytes) JSON string.
+        """
+        if self.__b64_json is None:
+            self.__b64_json = PayloadBuilder.dumps(self.b64)
+        return self.__b64_json
+
+    @property
+    def digest(self) -> str:
+        """
+        Content hash of the image file bytes, used as cache key.
+        Returns:
+            (str) Hexadecimal digest.
+        """
+        if self.__digest is None:
+            self.__digest = hashlib.blake2b(
+                self.raw, digest_size=16).hexdigest()
+        return self.__digest
+
+    @property
+    def array(self):
+        """
+        Decoded pixels (BGR), None if OpenCV can not decode the image.
+        Returns:
+            (np.ndarray) An ndimentional array of the image.
+        """
+        if not self.__decoded:
+            self.__array = self.decode(self.raw)
+            self.__decoded = True
+        return self.__array
+
+    def set_array(self, array) -> None:
+        """
+        Keep pixels decoded elsewhere (in the image process pool), so they
+        are not decoded again.
+        Args:
+            array: (np.ndarray) Decoded pixels, None if OpenCV can not
+                                decode the image.
+        """
+        self.__array = array
+        self.__decoded = True
+
+    @staticmethod
+    def decode(raw):
+        """
+        Decode image file bytes (JPEG, PNG) without copying them.
+        Args:
+            raw: (bytes) Image file bytes.
+        Returns:
+            (np.ndarray) Pixels (BGR), None if OpenCV can not decode them.
+        """
+        np_res = None
+        try:
+            np_res = cv2.imdecode(
+                np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR)
+        except cv2.error:
+            raise_error(401)
+        return np_res
@@ -0,0 +1,44 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class LatencyWindow:
+    """
+    Latency of the most recent calls to one upstream, used to decide when a
+    call in flight is slow enough to send a hedged duplicate.
+    """
+
+    def __init__(self, size=200):
+        """
+        Class Constructor.
+        Args:
+            size: (int) Number of recent calls kept.
+        """
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, latency) -> None:
+        """
+        Record the latency of a finished call.
+        Args:
+            latency: (float) Seconds of the call.
+        """
+        with self.lock:
+            self.samples.append(latency)
+
+    def percentile(self, percent, min_samples=20):
+        """
+        Percentile of the recent latency.
+        Args:
+            percent: (float) Percentile, between 0 and 100.
+            min_samples: (int) Calls needed for a meaningful value.
+        Returns:
+            (float) Seconds, None with less than min_samples calls.
+        """
+        with self.lock:
+            samples = list(self.samples)
+        if len(samples) < min_samples:
+            return None
+        return float(np.percentile(samples, percent))
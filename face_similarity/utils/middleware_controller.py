@@ -4,61 +4,83 @@ import time
 from flask import g, request
 from prometheus_client import Counter, Gauge, Histogram
 
+# Milliseconds, as the name says (the latency is measured in seconds).
+http_request_latency_ms = Histogram(
+    'http_request_latency_ms', 'HTTP Request Latency in milliseconds',
+    ['method', 'endpoint', 'http_status'],
+    buckets=(5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000,
+             float('inf')))
+
+http_request_size_bytes = Histogram(
+    'http_request_size_bytes', 'HTTP request size in bytes',
+    ['method', 'endpoint'],
+    buckets=(1024, 16384, 131072, 524288, 1048576, 2097152, 4194304,
+             8388608, 16777216, float('inf')))
+
+http_response_size_bytes = Histogram(
+    'http_response_size_bytes', 'HTTP response size in bytes',
+    ['method', 'endpoint', 'http_status'],
+    buckets=(64, 256, 1024, 4096, 16384, 65536, float('inf')))
+
+http_request_count = Counter(
+    'http_request_count', 'HTTP Request Count',
+    ['method', 'endpoint', 'http_status'])
+
+http_concurrent_request_count = Gauge(
+    'http_concurrent_request_count',
+    'Flask Concurrent Request Count',
+    multiprocess_mode='livesum')
+
+
+def observe_request(method, path, status, latency, response_size) -> None:
+    """
+    Record a finished request.
+    Args:
+        method: (str) HTTP method.
+        path: (str) Request path.
+        status: (int) Response status code.
+        latency: (float) Seconds spent on the request.
+        response_size: (int) Response body size in bytes.
+    """
+    logging.getLogger('face_similarity.middleware').debug(
+        f'request_latency: {latency}')
+    http_request_latency_ms.labels(method, path, status).observe(
+        latency * 1000.0)
+    http_request_count.labels(method, path, status).inc()
+    http_response_size_bytes.labels(method, path, status).observe(
+        response_size)
+
+
+def observe_request_size(method, path, content_length) -> None:
+    """
+    Record the size of a request body.
+    Args:
+        method: (str) HTTP method.
+        path: (str) Request path.
+        content_length: (int) Request body size in bytes.
+    """
+    if content_length:
+        http_request_size_bytes.labels(method, path).observe(content_length)
+
 
 def setup_metrics(app):
     def before_request():
         if 'metric' not in request.path:
             g.start_time = time.time()
             http_concurrent_request_count.inc()
-            content_length = request.content_length
-            if content_length:
-                http_request_size_bytes.labels(
-                    request.method,
-                    request.path).observe(content_length)
+            observe_request_size(
+                request.method, request.path, request.content_length)
 
     def after_request(response):
         if 'metric' not in request.path:
-            request_latency = time.time() - g.start_time
-            logging.getLogger('face_similarity.middleware').debug(
-                f'request_latency: {request_latency}')
-            http_request_latency_ms.labels(
-                request.method, request.path,
-                response.status_code).observe(request_latency)
-
             http_concurrent_request_count.dec()
-
-            http_request_count.labels(
-                request.method, request.path,
-                response.status_code).inc()
-
             resp_length = response.calculate_content_length()
-            http_response_size_bytes.labels(
-                request.method, request.path, response.status_code).observe(
-                    0 if resp_length is None else resp_length)
+            observe_request(
+                request.method, request.path, response.status_code,
+                time.time() - g.start_time,
+                0 if resp_length is None else resp_length)
 
         return response
 
-    http_request_latency_ms = Histogram(
-        'http_request_latency_ms', 'HTTP Request Latency',
-        ['method', 'endpoint', 'http_status'],
-        buckets=(1, 3, 10, 50, 100, 200, 500, float('inf')))
-
-    http_request_size_bytes = Histogram(
-        'http_request_size_bytes', 'HTTP request size in bytes',
-        ['method', 'endpoint'])
-
-    http_response_size_bytes = Histogram(
-        'http_response_size_bytes', 'HTTP response size in bytes',
-        ['method', 'endpoint', 'http_status'])
-
-    http_request_count = Counter(
-        'http_request_count', 'HTTP Request Count',
-        ['method', 'endpoint', 'http_status'])
-
-    http_concurrent_request_count = Gauge(
-        'http_concurrent_request_count',
-        'Flask Concurrent Request Count',
-        multiprocess_mode='livesum')
-
     app.before_request(before_request)
     app.after_request(after_request)
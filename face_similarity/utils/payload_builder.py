@@ -0,0 +1,59 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # Optional: pip install face-similarity[fast-json]
+    orjson = None
+
+
+class PayloadBuilder:
+    """
+    Class that serializes the JSON documents exchanged with the remote APIs.
+    The base64 code of an image is escaped once (ImageData.b64_json) and each
+    payload is built by filling a template of the other fields (angle,
+    cropped, face_locations) around those same bytes. Uses orjson when it is
+    installed, otherwise the standard json module.
+    """
+    backend = 'json' if orjson is None else 'orjson'
+
+    @staticmethod
+    def dumps(value) -> bytes:
+        """
+        Serialize a value.
+        Args:
+            value: JSON serializable value.
+        Returns:
+            (bytes) JSON document, UTF-8 encoded.
+        """
+        if orjson is not None:
+            return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+        return json.dumps(value, separators=(',', ':')).encode()
+
+    @staticmethod
+    def loads(document):
+        """
+        Parse a JSON document.
+        Args:
+            document: (str|bytes) JSON document.
+        Returns:
+            Parsed value.
+        """
+        if orjson is not None:
+            return orjson.loads(document)
+        return json.loads(document)
+
+    @classmethod
+    def build(cls, key, image, fields) -> bytes:
+        """
+        Serialize a payload object with the image and the other fields,
+        without serializing the image again.
+        Args:
+            key: (str) Field of the image.
+            image: (ImageData) Image of the payload.
+            fields: (dict) Other fields of the payload.
+        Returns:
+            (bytes) JSON document.
+        """
+        tail = cls.dumps(fields)
+        tail = b',' + tail[1:] if len(tail) > 2 else b'}'
+        return b''.join((b'{', cls.dumps(key), b':', image.b64_json, tail))
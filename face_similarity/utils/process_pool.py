@@ -0,0 +1,342 @@
+import asyncio
+import concurrent.futures
+import importlib
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from prometheus_client import Gauge, Histogram
+
+from face_similarity.utils.api_util import ApiUtil
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8, the buffers are pickled.
+    shared_memory = None
+
+process_pool_queue_depth = Gauge(
+    'process_pool_queue_depth',
+    'Image operations submitted to the process pool and not finished',
+    multiprocess_mode='livesum')
+
+process_pool_task_latency_seconds = Histogram(
+    'process_pool_task_latency_seconds',
+    'Latency of the image operations of the process pool in seconds, '
+    'waiting for a free process (queue) and in total',
+    ['task', 'phase'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+             float('inf')))
+
+
+class SharedBuffer:
+    """
+    Reference to pixels (np.ndarray) or file bytes copied to a shared memory
+    segment. Only the reference is pickled between the worker and the pool
+    processes, the buffer is copied once into the segment and once out of
+    it. The segment is unlinked by the worker once the operation is over.
+    """
+
+    def __init__(self, name, size, shape=None, dtype=None):
+        """
+        Class Constructor.
+        Args:
+            name: (str) Name of the shared memory segment.
+            size: (int) Bytes of the buffer.
+            shape: (tuple) Shape of the pixels, None for bytes.
+            dtype: (str) Type of the pixels, None for bytes.
+        """
+        self.name = name
+        self.size = size
+        self.shape = shape
+        self.dtype = dtype
+
+    @classmethod
+    def share(cls, value) -> tuple:
+        """
+        Copy a buffer to a new shared memory segment.
+        Args:
+            value: (bytes|np.ndarray) Buffer to share.
+        Returns:
+            (tuple) Reference and segment (SharedMemory) of the buffer.
+        """
+        if isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            shape, dtype = value.shape, value.dtype.str
+        else:
+            shape, dtype = None, None
+        data = memoryview(value).cast('B')
+        segment = shared_memory.SharedMemory(create=True, size=data.nbytes)
+        segment.buf[:data.nbytes] = data
+        return cls(segment.name, data.nbytes, shape, dtype), segment
+
+    def load(self, unlink=False):
+        """
+        Copy the buffer out of its segment.
+        Args:
+            unlink: (bool) Remove the segment once read.
+        Returns:
+            (bytes|np.ndarray) Buffer.
+        """
+        segment = shared_memory.SharedMemory(self.name)
+        try:
+            if self.shape is None:
+                return bytes(segment.buf[:self.size])
+            view = np.ndarray(self.shape, self.dtype, segment.buf)
+            value = view.copy()
+            del view
+            return value
+        finally:
+            segment.close()
+            if unlink:
+                segment.unlink()
+
+    def unlink(self) -> None:
+        """
+        Remove the segment without reading it.
+        """
+        segment = shared_memory.SharedMemory(self.name)
+        segment.close()
+        segment.unlink()
+
+
+def share_values(values, min_bytes) -> tuple:
+    """
+    Move the buffers of at least min_bytes to shared memory (only when
+    multiprocessing.shared_memory is available).
+    Args:
+        values: (iterable) Arguments or results of an operation.
+        min_bytes: (int) Smallest buffer worth a segment.
+    Returns:
+        (tuple) Values with the references in place of the buffers, and the
+                segments created.
+    """
+    shared, segments = list(), list()
+    try:
+        for value in values:
+            if shared_memory is not None and isinstance(
+                    value, (bytes, np.ndarray)) and (
+                    len(value) if isinstance(value, bytes)
+                    else value.nbytes) >= max(1, min_bytes):
+                value, segment = SharedBuffer.share(value)
+                segments.append(segment)
+            shared.append(value)
+    except BaseException:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+        raise
+    return tuple(shared), segments
+
+
+def load_values(values, unlink=False) -> tuple:
+    """
+    Replace the references to shared memory by their buffers.
+    Args:
+        values: (tuple) Values with references.
+        unlink: (bool) Remove the segments once read.
+    Returns:
+        (tuple) Values.
+    """
+    return tuple(value.load(unlink) if isinstance(value, SharedBuffer)
+                 else value for value in values)
+
+
+def unlink_values(values) -> None:
+    """
+    Remove the segments of the references, without reading them.
+    Args:
+        values: (tuple) Values with references.
+    """
+    for value in values:
+        if isinstance(value, SharedBuffer):
+            value.unlink()
+
+
+def call_shared(function, args, min_bytes) -> tuple:
+    """
+    Run an operation in a pool process, reading its buffers from shared
+    memory and sharing the buffers of its result the same way (the worker
+    unlinks them).
+    Args:
+        function: (callable) Operation, returns a tuple.
+        args: (tuple) Arguments, with references to shared memory.
+        min_bytes: (int) Smallest result buffer worth a segment.
+    Returns:
+        (tuple) Time the operation started and its result.
+    """
+    started = time.time()
+    result, segments = share_values(
+        function(*load_values(args)), min_bytes)
+    for segment in segments:
+        segment.close()
+    return started, result
+
+
+def warm_up(module) -> int:
+    """
+    Import a module in a pool process before the first operation.
+    Args:
+        module: (str) Module name.
+    Returns:
+        (int) Process id.
+    """
+    importlib.import_module(module)
+    return os.getpid()
+
+
+class ProcessPool:
+    """
+    Pool of processes of the worker for the CPU-bound image operations
+    (decoding, quality gate, resizing, rotation, JPEG encoding), which hold
+    the GIL for long and would otherwise stall the event loop of the worker
+    and its other request threads. The pixels and file bytes move to and
+    from the processes through shared memory instead of being pickled.
+    """
+    __instance = None
+    __lock = threading.Lock()
+
+    def __init__(self, workers, start_method='spawn',
+                 shared_min_bytes=65536):
+        """
+        Class Constructor. Start the processes, importing the image
+        operations in each of them.
+        Args:
+            workers: (int) Number of processes.
+            start_method: (str) Multiprocessing start method (spawn,
+                                forkserver, fork).
+            shared_min_bytes: (int) Smallest buffer sent through shared
+                                    memory, the smaller ones are pickled.
+        """
+        self.pid = os.getpid()
+        self.broken = False
+        self.shared_min_bytes = shared_min_bytes
+        options = dict()
+        if sys.version_info >= (3, 7):
+            options['mp_context'] = multiprocessing.get_context(start_method)
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            workers, **options)
+        for _ in range(workers):
+            self.executor.submit(
+                warm_up, 'face_similarity.service.image_service')
+
+    @classmethod
+    def instance(cls):
+        """
+        Get the pool of the current worker process, started on first use,
+        None when disabled (IMAGE_POOL_WORKERS=0).
+        Returns:
+            (ProcessPool) Pool of the worker.
+        """
+        utils = ApiUtil()
+        workers = utils.environ_default('IMAGE_POOL_WORKERS', 0)
+        if workers <= 0:
+            return None
+        with cls.__lock:
+            pool = cls.__instance
+            if pool is None or pool.pid != os.getpid() or pool.broken:
+                if pool is not None and pool.pid == os.getpid():
+                    pool.executor.shutdown(wait=False)
+                cls.__instance = cls(
+                    workers,
+                    utils.environ_default('IMAGE_POOL_START_METHOD', 'spawn'),
+                    utils.environ_default(
+                        'IMAGE_POOL_SHARED_MIN_BYTES', 65536))
+            return cls.__instance
+
+    async def run(self, task, function, *args) -> tuple:
+        """
+        Run an image operation in a process of the pool.
+        Args:
+            task: (str) Name of the operation, for the metrics.
+            function: (callable) Picklable operation (module function or
+                                 method of a picklable object) returning a
+                                 tuple.
+            args: (any) Arguments of the operation.
+        Returns:
+            (tuple) Result of the operation.
+        """
+        submitted = time.time()
+        shared, segments = share_values(args, self.shared_min_bytes)
+        try:
+            future = self.executor.submit(
+                call_shared, function, shared, self.shared_min_bytes)
+        except BaseException as error:
+            self.release(segments)
+            self.check_broken(error)
+            raise
+        process_pool_queue_depth.inc()
+        future.add_done_callback(lambda done: self.finish(done, segments))
+        try:
+            started, result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # The result arrives later, nobody will read its segments.
+            future.add_done_callback(self.discard)
+            raise
+        except BrokenProcessPool as error:
+            self.check_broken(error)
+            raise
+        result = load_values(result, unlink=True)
+        process_pool_task_latency_seconds.labels(task, 'queue').observe(
+            max(0.0, started - submitted))
+        process_pool_task_latency_seconds.labels(task, 'total').observe(
+            time.time() - submitted)
+        return result
+
+    def check_broken(self, error) -> None:
+        """
+        Mark the pool to be replaced when one of its processes died (killed
+        or crashed), the executor refuses every operation after that.
+        Args:
+            error: (BaseException) Error of an operation.
+        """
+        if isinstance(error, BrokenProcessPool) and not self.broken:
+            self.broken = True
+            logging.getLogger('face_similarity.api').error(
+                'IMAGE_POOL > a process of the pool died, restarting it')
+
+    def finish(self, future, segments) -> None:
+        """
+        Done callback of an operation: its arguments are no longer read.
+        Args:
+            future: (Future) Operation finished.
+            segments: (list) Segments of its arguments.
+        """
+        process_pool_queue_depth.dec()
+        self.release(segments)
+
+    @staticmethod
+    def release(segments) -> None:
+        """
+        Close and remove the segments of the arguments of an operation.
+        Args:
+            segments: (list) Segments created by the worker.
+        """
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+    @staticmethod
+    def discard(future) -> None:
+        """
+        Done callback of an operation abandoned by its caller: remove the
+        segments of its result.
+        Args:
+            future: (Future) Operation finished.
+        """
+        if not future.cancelled() and future.exception() is None:
+            unlink_values(future.result()[1])
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """
+        Stop the processes of the pool of the worker.
+        """
+        with cls.__lock:
+            pool, cls.__instance = cls.__instance, None
+        if pool is not None and pool.pid == os.getpid():
+            pool.executor.shutdown(wait=True)
@@ -25,8 +25,16 @@ error_dict = {
                     ' FACE_DETECT_URL, FACE_ENCODING_URL, SCHEMES,'
                     ' IBI_FERRAMENTA, IBI_VERSAO_FERRAMENTA,'
                     ' IBI_QUANTIDADE_IDENTIFICADORES, IBI_TIMEOUT]'},
+    504: {'detail': 'Gateway Timeout, the remote APIs did not answer within '
+                    'the deadline of the request '
+                    '[REQUEST_DEADLINE, UPSTREAM_TIMEOUT_*].'},
 }
 
+# HTTP status returned for each error code, shared by the WSGI error
+# handlers and the ASGI application.
+error_status = {400: 400, 401: 400, 403: 400, 404: 400, 405: 400, 406: 400,
+                417: 417, 424: 424, 428: 428, 504: 504}
+
 
 def raise_error(code, msg=None, api=None):
     """
@@ -54,44 +62,49 @@ def response(code):
 
 @error_handler.app_errorhandler(400)
 def wrong_syntax(error):
-    return jsonify(response(400)), 400
+    return jsonify(response(400)), error_status[400]
 
 
 @error_handler.app_errorhandler(401)
 def wrong_base64(error):
-    return jsonify(response(401)), 400
+    return jsonify(response(401)), error_status[401]
 
 
 @error_handler.app_errorhandler(403)
 def face_not_found(error):
-    return jsonify(response(403)), 400
+    return jsonify(response(403)), error_status[403]
 
 
 @error_handler.app_errorhandler(404)
 def required_parameters_missing(error):
-    return jsonify(response(404)), 400
+    return jsonify(response(404)), error_status[404]
 
 
 @error_handler.app_errorhandler(405)
 def error_connecting_to_remote_api(error):
-    return jsonify(response(405)), 400
+    return jsonify(response(405)), error_status[405]
 
 
 @error_handler.app_errorhandler(406)
 def more_than_one_face(error):
-    return jsonify(response(406)), 400
+    return jsonify(response(406)), error_status[406]
 
 
 @error_handler.app_errorhandler(424)
 def external_api_error_500(error):
-    return jsonify(response(424)), 424
+    return jsonify(response(424)), error_status[424]
 
 
 @error_handler.app_errorhandler(428)
 def not_configured(error):
-    return jsonify(response(428)), 428
+    return jsonify(response(428)), error_status[428]
 
 
 @error_handler.app_errorhandler(417)
 def external_api_response_not_200(error):
-    return jsonify(response(417)), 417
+    return jsonify(response(417)), error_status[417]
+
+
+@error_handler.app_errorhandler(504)
+def external_api_timeout(error):
+    return jsonify(response(504)), error_status[504]
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+
+from prometheus_client import Counter
+
+from face_similarity.utils.api_util import ApiUtil
+
+single_flight_requests = Counter(
+    'single_flight_requests',
+    'Image computations started (leader), joined while in flight (shared)'
+    ' or started again after the deadline of another request (retried)',
+    ['result'])
+
+
+class SingleFlight:
+    """
+    Coalesces the concurrent computations of the worker with the same key
+    (the content hash of an image): the first caller starts the work as a
+    task and the callers arriving while it is in flight wait for the same
+    result, errors included, except the timeouts of the deadline of the
+    first caller when the retry allows it. The task is shielded from the
+    cancellation of one caller and cancelled only when every caller has
+    left.
+    """
+    __instances = dict()
+    __lock = threading.Lock()
+
+    def __init__(self):
+        """
+        Class Constructor.
+        """
+        self.calls = dict()
+
+    @classmethod
+    def instance(cls):
+        """
+        Get the single flight of the running event loop, None when disabled
+        (SINGLE_FLIGHT=false).
+        Returns:
+            (SingleFlight) Single flight of the loop.
+        """
+        if not ApiUtil().environ_default('SINGLE_FLIGHT', True):
+            return None
+        loop = asyncio.get_event_loop()
+        with cls.__lock:
+            if loop not in cls.__instances:
+                cls.__instances[loop] = cls()
+            return cls.__instances[loop]
+
+    async def run(self, key, work, retry=None):
+        """
+        Run the work, or join the one already in flight with the same key.
+        The work runs with the deadline of the caller that started it, so a
+        caller that joined it and still has time may start it again when it
+        fails on that deadline.
+        Args:
+            key: (hashable) Identity of the work.
+            work: (callable) Coroutine function doing the work.
+            retry: (callable) Whether a caller that joined the work starts it
+                              again after its error, None to never retry.
+        Returns:
+            (any) Result of the work.
+        """
+        while True:
+            call = self.calls.get(key)
+            leader = call is None or call[0].done()
+            if leader:
+                call = self.calls[key] = [asyncio.ensure_future(work()), 0]
+                call[0].add_done_callback(
+                    lambda task, call=call: self.forget(key, call))
+                single_flight_requests.labels('leader').inc()
+            else:
+                single_flight_requests.labels('shared').inc()
+            call[1] += 1
+            try:
+                return await asyncio.shield(call[0])
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                if leader or retry is None or not retry(error):
+                    raise
+            finally:
+                call[1] -= 1
+                if call[1] == 0 and not call[0].done():
+                    self.forget(key, call)
+                    call[0].cancel()
+            single_flight_requests.labels('retried').inc()
+
+    def forget(self, key, call) -> None:
+        """
+        Remove a finished (or abandoned) work, so the next caller starts a
+        new one.
+        Args:
+            key: (hashable) Identity of the work.
+            call: (list) Task and number of callers waiting.
+        """
+        if self.calls.get(key) is call:
+            del self.calls[key]
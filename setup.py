@@ -19,6 +19,15 @@ unit_test_requirements = [
 integration_test_requirements = [
     'pytest',
 ]
+fast_json_requirements = [
+    'orjson',
+]
+asgi_requirements = [
+    'uvicorn',
+]
+benchmark_requirements = [
+    'pytest', 'pytest-benchmark',
+]
 run_requirements = [
     'flask', 'gunicorn', 'pyyaml', 'flask-swagger-ui', 'prometheus_client',
     'requests', 'aiohttp', 'numpy', 'opencv-python'
@@ -53,6 +62,9 @@ setup(
          'dev': dev_requirements,
          'unit': unit_test_requirements,
          'integration': integration_test_requirements,
+         'fast-json': fast_json_requirements,
+         'asgi': asgi_requirements,
+         'benchmark': benchmark_requirements,
     },
     python_requires='>=3.6',
     classifiers=[
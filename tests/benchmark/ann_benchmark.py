@@ -0,0 +1,116 @@
+"""
+Recall versus latency of the approximate gallery index (IVF, IVF-PQ)
+against the exact scan, on a synthetic gallery of face vectors.
+
+    python -m tests.benchmark.ann_benchmark --size 1000000 --probes 1,8,32
+"""
+import argparse
+import time
+
+import numpy as np
+
+from face_similarity.service.ann_index_service import AnnIndexService
+from face_similarity.service.gallery_service import GalleryService
+
+THRESHOLD = 0.6
+
+
+def synthetic_gallery(size, queries, seed=0):
+    """
+    One vector per subject (different subjects are ~0.9 apart) and probes
+    that are other photos of enrolled subjects (~0.4 from the enrolled one)
+    or of unknown people.
+    """
+    random = np.random.RandomState(seed)
+    gallery = (random.randn(size, 128) * 0.056).astype(np.float32)
+    subjects = random.randint(0, size, queries)
+    probes = gallery[subjects] + (
+        random.randn(queries, 128) * 0.025).astype(np.float32)
+    unknown = random.rand(queries) < 0.2
+    probes[unknown] = (random.randn(int(unknown.sum()), 128) * 0.056)
+    return gallery, probes
+
+
+def percentile(values, q):
+    return float(np.percentile(np.asarray(values) * 1000.0, q))
+
+
+def exact_scan(gallery, probes, k):
+    results, latencies = list(), list()
+    for probe in probes:
+        start = time.perf_counter()
+        distances = np.linalg.norm(gallery - probe, axis=1)
+        best = np.argpartition(distances, k - 1)[:k]
+        best = best[np.argsort(distances[best])]
+        latencies.append(time.perf_counter() - start)
+        results.append((best, distances[best]))
+    return results, latencies
+
+
+def index_scan(gallery, index, probes, k, n_probe):
+    results, latencies = list(), list()
+    for probe in probes:
+        start = time.perf_counter()
+        if index.pq_subspaces:
+            rows, _ = index.search(probe, k * GalleryService.rerank, n_probe)
+            distances = np.linalg.norm(gallery[rows] - probe, axis=1)
+            best = np.argsort(distances)[:k]
+            result = rows[best], distances[best]
+        else:
+            result = index.search(probe, k, n_probe)
+        latencies.append(time.perf_counter() - start)
+        results.append(result)
+    return results, latencies
+
+
+def compare(exact, approximate):
+    """Recall@1, recall@k and agreement of the 0.6 threshold decision."""
+    recall_1, recall_k, agreement = 0, 0, 0
+    for (exact_rows, exact_distances), (rows, distances) in zip(
+            exact, approximate):
+        recall_1 += len(rows) > 0 and rows[0] == exact_rows[0]
+        recall_k += len(set(rows) & set(exact_rows)) / len(exact_rows)
+        match = len(distances) > 0 and distances[0] <= THRESHOLD
+        agreement += match == (exact_distances[0] <= THRESHOLD)
+    return (recall_1 / len(exact), recall_k / len(exact),
+            agreement / len(exact))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--lists', type=int, default=1024)
+    parser.add_argument('--probes', default='1,4,16,64')
+    parser.add_argument('--pq', type=int, default=0,
+                        help='PQ subspaces, 0 stores the vectors')
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    gallery, probes = synthetic_gallery(args.size, args.queries)
+    exact, exact_latencies = exact_scan(gallery, probes, args.k)
+    print('gallery %s, queries %s, k %s' % (
+        args.size, args.queries, args.k))
+    print('%-12s %10s %10s %10s %10s %12s' % (
+        'search', 'p50 ms', 'p99 ms', 'recall@1', 'recall@k', 'agree@0.6'))
+    print('%-12s %10.2f %10.2f %10.3f %10.3f %12.3f' % (
+        'exact', percentile(exact_latencies, 50),
+        percentile(exact_latencies, 99), 1.0, 1.0, 1.0))
+
+    index = AnnIndexService(args.lists, pq_subspaces=args.pq)
+    start = time.perf_counter()
+    index.train(gallery)
+    index.add(np.arange(len(gallery)), gallery)
+    print('index built in %.1f s' % (time.perf_counter() - start))
+    for n_probe in [int(n) for n in args.probes.split(',')]:
+        approximate, latencies = index_scan(
+            gallery, index, probes, args.k, n_probe)
+        recall_1, recall_k, agreement = compare(exact, approximate)
+        print('%-12s %10.2f %10.2f %10.3f %10.3f %12.3f' % (
+            'ivf%s/%s' % ('-pq' if args.pq else '', n_probe),
+            percentile(latencies, 50), percentile(latencies, 99),
+            recall_1, recall_k, agreement))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Microbenchmarks of the CPU-bound glue code of the pipeline, with
+pytest-benchmark (pip install -e .[benchmark]). Not collected by the unit
+test run; run them explicitly, saving a baseline and then comparing each
+run with the last saved one:
+
+    python -m pytest tests/benchmark/bench_hot_paths.py --benchmark-autosave
+    python -m pytest tests/benchmark/bench_hot_paths.py \\
+        --benchmark-autosave --benchmark-compare \\
+        --benchmark-compare-fail=median:10%
+"""
+import base64
+import json
+
+import cv2
+import numpy as np
+import pytest
+
+from face_similarity.service.face_distance_service import \
+    FaceDistanceService
+from face_similarity.service.face_similarity_service import \
+    FaceSimilarityService
+from face_similarity.service.image_service import ImageService
+from face_similarity.utils.api_util import ApiUtil
+from face_similarity.utils.embedding_codec import EmbeddingCodec
+from face_similarity.utils.image_data import ImageData
+from face_similarity.utils.payload_builder import PayloadBuilder
+
+pytest.importorskip('pytest_benchmark')
+
+SIDES = [320, 1024, 2048, 4032]
+
+
+def photo_b64(side) -> str:
+    """Base64 JPEG of side x 3/4 side with photo-like content."""
+    random_state = np.random.RandomState(side)
+    small = random_state.randint(0, 255, (24, 18, 3)).astype(np.uint8)
+    array = cv2.resize(small, (side * 3 // 4, side),
+                       interpolation=cv2.INTER_CUBIC)
+    array = cv2.add(array, random_state.randint(
+        0, 8, array.shape).astype(np.uint8))
+    return base64.b64encode(cv2.imencode(
+        '.jpg', array, [cv2.IMWRITE_JPEG_QUALITY, 92])[1]).decode('ascii')
+
+
+@pytest.fixture(scope='module', params=SIDES, ids=lambda side: str(side))
+def image_b64(request):
+    return photo_b64(request.param)
+
+
+@pytest.fixture(scope='module')
+def vectors():
+    random_state = np.random.RandomState(0)
+    return random_state.randn(10000, 128) * 0.05
+
+
+def test_is_base64(benchmark, image_b64):
+    benchmark(ApiUtil.is_base64, image_b64)
+
+
+def test_to_numpy(benchmark, image_b64):
+    benchmark(ApiUtil.to_numpy, image_b64)
+
+
+def test_normalize(benchmark, image_b64):
+    service = ImageService()
+    benchmark(lambda: service.normalize(ImageData(image_b64, 'img_1')))
+
+
+def test_quality_gate(benchmark, image_b64):
+    """Quality checks of an image already decoded."""
+    service, image = ImageService(), ImageData(image_b64, 'img_1')
+    image.array
+    benchmark(service.quality_problem, image)
+
+
+def test_payload_json_dumps(benchmark, image_b64):
+    """Serialization of a detect payload as a dict (one copy per call)."""
+    benchmark(PayloadBuilder.dumps, {"image": image_b64, "cropped": False})
+
+
+def test_payload_builder(benchmark, image_b64):
+    """Detect payload built around the image serialized once."""
+    image = ImageData(image_b64, 'img_1')
+    image.b64_json
+    benchmark(PayloadBuilder.build, 'image', image, {"cropped": False})
+
+
+def test_faces_encoding_loads(benchmark, vectors):
+    """Encoding response: JSON body with the vector as a nested JSON."""
+    body = json.dumps({"faces_encoding": json.dumps(
+        [vectors[0].tolist()])}).encode()
+    benchmark(lambda: json.loads(
+        PayloadBuilder.loads(body)["faces_encoding"])[0])
+
+
+def test_faces_encoding_float32(benchmark, vectors):
+    """Encoding response in the compact format: base64 float32 vector."""
+    body = json.dumps(EmbeddingCodec.encode(vectors[:1])).encode()
+    benchmark(lambda: EmbeddingCodec.decode(PayloadBuilder.loads(body))[0])
+
+
+def test_faces_encoding_legacy(benchmark, vectors):
+    """Encoding response in the legacy format read by EmbeddingCodec."""
+    body = json.dumps({"faces_encoding": json.dumps(
+        [vectors[0].tolist()])}).encode()
+    benchmark(lambda: EmbeddingCodec.decode(PayloadBuilder.loads(body))[0])
+
+
+def test_face_distance_pair(benchmark, vectors):
+    benchmark(FaceDistanceService.face_distance, list(vectors[0]),
+              list(vectors[1]))
+
+
+def test_face_distance_gallery(benchmark, vectors):
+    benchmark(FaceDistanceService.face_distance, vectors[0], vectors)
+
+
+def test_face_distance_matrix(benchmark, vectors):
+    benchmark(FaceDistanceService.face_distance, vectors[:64], vectors[:64])
+
+
+def test_percentage_scalar(benchmark):
+    benchmark(FaceDistanceService.convert_distance_to_percentage, 0.42)
+
+
+def test_percentage_array(benchmark, vectors):
+    distances = FaceDistanceService.face_distance(vectors[0], vectors)
+    benchmark(FaceDistanceService.convert_distance_to_percentage, distances)
+
+
+def test_get_bounding_box(benchmark):
+    response = [200, {"number_of_faces": 1, "data": [
+        {"bounding_box": [10, 90, 90, 10]}]}, 'img_1']
+    benchmark(FaceSimilarityService.get_bounding_box, response)
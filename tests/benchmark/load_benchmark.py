@@ -0,0 +1,267 @@
+"""
+End-to-end load benchmark of /image/face-distance against local stub
+upstream services. Starts the stubs and the API (gunicorn, WSGI or ASGI
+workers), drives the endpoint at each concurrency level and reports
+throughput, p50/p95/p99 latency, upstream calls per request and the memory
+of each worker.
+
+    python -m tests.benchmark.load_benchmark --concurrency 1,8,32,128 \\
+        --requests 500 --stub-latency-ms 30 --json baseline.json
+    python -m tests.benchmark.load_benchmark --server asgi --workers 1 \\
+        --compare baseline.json
+    python -m tests.benchmark.load_benchmark --batch --compare baseline.json
+
+Use --target to drive an API that is already running (no worker memory).
+Extra API settings go in --env, e.g. --env EMBEDDING_CACHE_MAX_BYTES=0.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def synthetic_images(count, side, seed=0) -> list:
+    """Base64 JPEG photos (smooth random content with some sharp shapes,
+    so they pass the quality gate) of side x 3/4 side."""
+    random_state = np.random.RandomState(seed)
+    images = list()
+    for _ in range(count):
+        small = random_state.randint(0, 255, (24, 18, 3)).astype(np.uint8)
+        array = cv2.resize(small, (side * 3 // 4, side),
+                           interpolation=cv2.INTER_CUBIC)
+        for _ in range(12):
+            center = tuple(int(v) for v in random_state.randint(0, side, 2))
+            cv2.circle(array, center, int(random_state.randint(
+                side // 40 + 1, side // 8 + 2)), tuple(int(v) for v in (
+                    random_state.randint(0, 255, 3))), -1)
+        noise = random_state.randint(0, 8, array.shape).astype(np.uint8)
+        jpeg = cv2.imencode('.jpg', cv2.add(array, noise),
+                            [cv2.IMWRITE_JPEG_QUALITY, 92])[1]
+        images.append(base64.b64encode(jpeg).decode('ascii'))
+    return images
+
+
+def wait_until_up(url, process=None, timeout=60.0) -> None:
+    """Poll a GET url until it answers."""
+    async def poll():
+        deadline = time.time() + timeout
+        async with ClientSession() as session:
+            while time.time() < deadline:
+                if process is not None and process.poll() is not None:
+                    raise RuntimeError('%s exited' % process.args)
+                try:
+                    async with session.get(url) as response:
+                        await response.read()
+                        return
+                except OSError:
+                    await asyncio.sleep(0.2)
+        raise RuntimeError('%s did not start' % url)
+    asyncio.get_event_loop().run_until_complete(poll())
+
+
+def start_stubs(args) -> subprocess.Popen:
+    process = subprocess.Popen([
+        sys.executable, '-m', 'tests.benchmark.stub_upstreams',
+        '--port', str(args.stub_port),
+        '--latency-ms', str(args.stub_latency_ms),
+        '--sigma', str(args.stub_sigma),
+        '--error-rate', str(args.stub_error_rate),
+        '--face-probability', str(args.stub_face_probability),
+        '--capacity', str(args.stub_capacity),
+        '--embedding-format', args.stub_embedding_format], cwd=ROOT)
+    wait_until_up('http://127.0.0.1:%s/stats' % args.stub_port, process)
+    return process
+
+
+def start_api(args, metrics_dir) -> subprocess.Popen:
+    stub = 'http://127.0.0.1:%s' % args.stub_port
+    env = dict(os.environ, SCHEMES='http', MODE='bench',
+               PRE_PROCESS_URL=stub + '/image/rotate-by-angle',
+               FACE_DETECT_URL=stub + '/image/face-detect',
+               FACE_ENCODING_URL=stub + '/image/face-encoding',
+               EMBEDDING_CACHE_MAX_BYTES='0',
+               PROMETHEUS_MULTIPROC_DIR=metrics_dir,
+               WORKERS=str(args.workers), THREADS=str(args.threads))
+    if args.batch:
+        env.update(FACE_DETECT_BATCH_URL=stub + '/image/face-detect/batch',
+                   FACE_ENCODING_BATCH_URL=stub + '/image/face-encoding/batch')
+    env.update(item.split('=', 1) for item in args.env)
+    command = ['gunicorn', '-c', 'face_similarity/config/config.py',
+               '--bind', '127.0.0.1:%s' % args.port]
+    if args.server == 'asgi':
+        command += ['-k', 'uvicorn.workers.UvicornWorker',
+                    'face_similarity.asgi:app']
+    else:
+        command += ['face_similarity.main:app']
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    wait_until_up('http://127.0.0.1:%s/' % args.port, process)
+    return process
+
+
+def worker_rss_mb(master_pid) -> list:
+    """Resident memory (MB) of each child process of the gunicorn master."""
+    rss = list()
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            status = Path('/proc', entry, 'status').read_text()
+        except OSError:
+            continue
+        fields = dict(line.split(':', 1) for line in status.splitlines()
+                      if ':' in line)
+        if int(fields.get('PPid', '0')) == master_pid and 'VmRSS' in fields:
+            rss.append(int(fields['VmRSS'].split()[0]) / 1024.0)
+    return sorted(rss)
+
+
+async def upstream_calls(session, stub_url, reset=False) -> dict:
+    method = session.post if reset else session.get
+    async with method(stub_url + ('/reset' if reset else '/stats')) as resp:
+        return await resp.json()
+
+
+async def run_level(url, stub_url, images, concurrency, requests,
+                    seed) -> dict:
+    """Send the requests with a fixed number of clients in flight."""
+    pairs = random.Random(seed)
+    bodies = [json.dumps({'img1': pairs.choice(images),
+                          'img2': pairs.choice(images)}).encode()
+              for _ in range(requests)]
+    latencies, statuses = list(), dict()
+    connector = TCPConnector(limit=concurrency)
+    async with ClientSession(connector=connector,
+                             timeout=ClientTimeout(total=600)) as session:
+        await upstream_calls(session, stub_url, reset=True)
+
+        async def client():
+            while bodies:
+                body = bodies.pop()
+                start = time.perf_counter()
+                try:
+                    async with session.post(url, data=body, headers={
+                            'content-type': 'application/json'}) as resp:
+                        await resp.read()
+                    status = resp.status
+                except ClientError:
+                    status = 'error'
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        calls = await upstream_calls(session, stub_url)
+    milliseconds = np.asarray(latencies) * 1000.0
+    return {
+        'concurrency': concurrency, 'requests': requests,
+        'throughput': requests / elapsed,
+        'p50_ms': float(np.percentile(milliseconds, 50)),
+        'p95_ms': float(np.percentile(milliseconds, 95)),
+        'p99_ms': float(np.percentile(milliseconds, 99)),
+        'statuses': {str(k): v for k, v in statuses.items()},
+        'upstream_calls': calls,
+        'upstream_calls_per_request': sum(
+            v for k, v in calls.items() if k != 'error') / requests,
+    }
+
+
+def report(results, baseline=None) -> None:
+    print('%6s %10s %9s %9s %9s %8s %10s  %s' % (
+        'conc', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'calls/r',
+        'rss MB', 'statuses'))
+    previous = {r['concurrency']: r for r in (baseline or [])}
+    for result in results:
+        rss = result.get('worker_rss_mb') or []
+        print('%6d %10.1f %9.1f %9.1f %9.1f %8.2f %10s  %s' % (
+            result['concurrency'], result['throughput'], result['p50_ms'],
+            result['p95_ms'], result['p99_ms'],
+            result['upstream_calls_per_request'],
+            '/'.join('%.0f' % value for value in rss) or '-',
+            result['statuses']))
+        before = previous.get(result['concurrency'])
+        if before:
+            print('%6s %+9.1f%% %+8.1f%% %+8.1f%% %+8.1f%%' % (
+                'vs', *(100.0 * (result[key] / before[key] - 1.0) for key in (
+                    'throughput', 'p50_ms', 'p95_ms', 'p99_ms'))))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--target', help='URL of a running API')
+    parser.add_argument('--server', choices=['wsgi', 'asgi'], default='wsgi')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=2)
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--batch', action='store_true',
+                        help='micro-batch the detect and encode calls')
+    parser.add_argument('--env', action='append', default=[],
+                        help='API environment variable, KEY=VALUE')
+    parser.add_argument('--concurrency', default='1,8,32')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per concurrency level')
+    parser.add_argument('--images', type=int, default=64,
+                        help='distinct images the pairs are drawn from')
+    parser.add_argument('--image-side', type=int, default=1600)
+    parser.add_argument('--stub-port', type=int, default=8765)
+    parser.add_argument('--stub-latency-ms', type=float, default=30.0)
+    parser.add_argument('--stub-sigma', type=float, default=0.5)
+    parser.add_argument('--stub-error-rate', type=float, default=0.0)
+    parser.add_argument('--stub-face-probability', type=float, default=1.0)
+    parser.add_argument('--stub-capacity', type=int, default=0,
+                        help='calls each stub route serves at once')
+    parser.add_argument('--stub-embedding-format', choices=['auto', 'json'],
+                        default='auto',
+                        help='json for an encoder with the legacy vectors')
+    parser.add_argument('--json', help='save the results to this file')
+    parser.add_argument('--compare', help='results of a previous run')
+    args = parser.parse_args()
+
+    images = synthetic_images(args.images, args.image_side)
+    stubs, api = start_stubs(args), None
+    metrics_dir = tempfile.TemporaryDirectory()
+    try:
+        url = args.target
+        if url is None:
+            api = start_api(args, metrics_dir.name)
+            url = 'http://127.0.0.1:%s/image/face-distance' % args.port
+        results = list()
+        for level, concurrency in enumerate(
+                int(c) for c in args.concurrency.split(',')):
+            result = asyncio.get_event_loop().run_until_complete(run_level(
+                url, 'http://127.0.0.1:%s' % args.stub_port, images,
+                concurrency, args.requests, level))
+            if api is not None:
+                result['worker_rss_mb'] = worker_rss_mb(api.pid)
+            results.append(result)
+        baseline = None
+        if args.compare:
+            baseline = json.loads(Path(args.compare).read_text())['results']
+        report(results, baseline)
+        if args.json:
+            Path(args.json).write_text(json.dumps(
+                {'args': vars(args), 'results': results}, indent=2))
+    finally:
+        for process in (api, stubs):
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=30)
+        metrics_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
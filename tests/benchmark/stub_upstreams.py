@@ -0,0 +1,181 @@
+"""
+Stub api-preprocess, api-face-detect and api-face-encoding for the load
+benchmark, with configurable latency, error rate, face probability,
+capacity and vector format.
+
+    python -m tests.benchmark.stub_upstreams --port 8765 --latency-ms 30
+
+Routes: POST /image/rotate-by-angle, /image/face-detect, /image/face-encoding,
+the batch endpoints /image/face-detect/batch and /image/face-encoding/batch
+(JsonBatchAdapter protocol, one latency per batch), GET /stats (calls per
+route) and POST /reset. The encoder answers the compact float32 vectors to
+the calls with the X-Embedding-Format: float32 header, unless it runs with
+--embedding-format json (an encoder without the compact format).
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+
+import numpy as np
+from aiohttp import web
+
+ROUTES = {
+    '/image/rotate-by-angle': 'preprocess',
+    '/image/face-detect': 'detect',
+    '/image/face-encoding': 'encode',
+}
+
+BATCH_ROUTES = {
+    '/image/face-detect/batch': 'detect',
+    '/image/face-encoding/batch': 'encode',
+}
+
+
+class StubUpstreams:
+    """
+    Upstream APIs answering after a log-normal latency (median and sigma per
+    call), failing with the error status (500) at the error rate and finding
+    a face at the face probability. The vector of an image is derived from
+    its content, so the same image always has the same vector. With a
+    capacity, each route serves at most that many calls at once and the
+    others queue, as an overloaded service (calls abandoned by the client
+    are still served).
+    """
+
+    def __init__(self, latency_ms=30.0, sigma=0.5, error_rate=0.0,
+                 face_probability=1.0, seed=0, capacity=0,
+                 embedding_format='auto', error_status=500):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.face_probability = face_probability
+        self.random = random.Random(seed)
+        self.capacity = capacity
+        self.embedding_format = embedding_format
+        self.slots = dict()
+        self.calls = dict()
+
+    def application(self) -> web.Application:
+        """aiohttp application serving the routes of the stubs."""
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        for path in ROUTES:
+            app.router.add_post(path, self.handle)
+        for path in BATCH_ROUTES:
+            app.router.add_post(path, self.handle_batch)
+        app.router.add_get('/stats', self.stats)
+        app.router.add_post('/reset', self.reset)
+        return app
+
+    async def handle(self, request):
+        """Answer one image (ROUTES)."""
+        stage = ROUTES[request.path]
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+        body = await request.json()
+        await self.serve(stage)
+        status, answer = self.answer(stage, body, self.compact(request))
+        if status != 200:
+            return web.Response(status=status, text=answer)
+        return web.json_response(answer)
+
+    async def handle_batch(self, request):
+        """Answer the items of a batch after one latency (BATCH_ROUTES)."""
+        stage = BATCH_ROUTES[request.path]
+        self.calls[stage + '_batch'] = self.calls.get(stage + '_batch', 0) + 1
+        items = (await request.json())['items']
+        await self.serve(stage)
+        compact = self.compact(request)
+        return web.json_response({'results': [
+            dict(zip(('status', 'body'), self.answer(stage, body, compact)))
+            for body in items]})
+
+    def compact(self, request) -> bool:
+        """Whether to answer the vectors in the compact float32 format."""
+        return self.embedding_format == 'auto' and request.headers.get(
+            'X-Embedding-Format') == 'float32'
+
+    async def serve(self, stage):
+        """Wait the latency of a call, queued when over capacity."""
+        if self.capacity > 0:
+            if stage not in self.slots:
+                self.slots[stage] = asyncio.Semaphore(self.capacity)
+            async with self.slots[stage]:
+                await self.wait()
+        else:
+            await self.wait()
+
+    def answer(self, stage, body, compact=False):
+        """Status and answer of one image."""
+        if self.random.random() < self.error_rate:
+            self.calls['error'] = self.calls.get('error', 0) + 1
+            return self.error_status, 'stub error'
+        if stage == 'preprocess':
+            return 200, {'b64_image': body['image']}
+        if stage == 'detect':
+            found = self.random.random() < self.face_probability
+            return 200, {
+                'number_of_faces': int(found),
+                'data': [{'bounding_box': [10, 90, 90, 10]}] if found else []}
+        vector = self.vector(body['b64_image'])
+        if compact:
+            return 200, {'faces_encoding': base64.b64encode(
+                vector.astype('<f4').tobytes()).decode('ascii'),
+                'encoding_format': 'float32'}
+        return 200, {'faces_encoding': json.dumps([vector.tolist()])}
+
+    async def wait(self):
+        """Sleep a log-normal latency around the median."""
+        if self.latency_ms > 0:
+            await asyncio.sleep(self.random.lognormvariate(
+                0, self.sigma) * self.latency_ms / 1000.0)
+
+    @staticmethod
+    def vector(b64_image) -> np.ndarray:
+        """Vector of an image, derived from its content."""
+        seed = hashlib.blake2b(
+            base64.b64decode(b64_image), digest_size=4).digest()
+        return np.random.RandomState(
+            int.from_bytes(seed, 'little')).randn(128) * 0.05
+
+    async def stats(self, request):
+        """Calls per route (and failed calls) since the last reset."""
+        return web.json_response(self.calls)
+
+    async def reset(self, request):
+        """Clear the calls counted by stats."""
+        self.calls = dict()
+        return web.json_response(self.calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=30.0,
+                        help='median latency of each call')
+    parser.add_argument('--sigma', type=float, default=0.5,
+                        help='log-normal sigma of the latency (tail)')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=500,
+                        help='status of the failed calls (500, 502, 503)')
+    parser.add_argument('--face-probability', type=float, default=1.0,
+                        help='probability of a face in each detection')
+    parser.add_argument('--capacity', type=int, default=0,
+                        help='calls served at once per route, 0 unlimited')
+    parser.add_argument('--embedding-format', choices=['auto', 'json'],
+                        default='auto',
+                        help='json answers the legacy vectors to every call')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    stubs = StubUpstreams(args.latency_ms, args.sigma, args.error_rate,
+                          args.face_probability, args.seed, args.capacity,
+                          args.embedding_format, args.error_status)
+    web.run_app(stubs.application(), host=args.host, port=args.port,
+                print=None, access_log=None)
+
+
+if __name__ == '__main__':
+    main()
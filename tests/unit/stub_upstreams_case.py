@@ -0,0 +1,45 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+from aiohttp import web
+
+from face_similarity.utils.http_client import HttpClient
+from tests.benchmark.stub_upstreams import StubUpstreams
+
+
+class StubUpstreamsTestCase(unittest.TestCase):
+    """
+    Base of the tests that call the stub upstreams served on a local port,
+    in a new event loop of each test. The environment is restored after
+    each test.
+    """
+    # Options of the stubs (StubUpstreams arguments).
+    stub_options = {'latency_ms': 0.0}
+    # Environment of the tests, on top of SCHEMES=http.
+    environ = {}
+
+    def setUp(self):
+        environ = mock.patch.dict(
+            os.environ, dict(self.environ, SCHEMES='http'))
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.stubs = StubUpstreams(**self.stub_options)
+        self.runner = web.AppRunner(self.stubs.application())
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        self.host = '127.0.0.1:%s' % self.runner.addresses[0][1]
+
+    def tearDown(self):
+        self.loop.run_until_complete(HttpClient.close())
+        self.loop.run_until_complete(self.runner.cleanup())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def url(self, path) -> str:
+        """Url of a route of the stubs."""
+        return 'http://%s%s' % (self.host, path)
@@ -0,0 +1,75 @@
+import asyncio
+import unittest
+
+from face_similarity.utils.adaptive_limiter import AdaptiveLimiter
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.limiter = AdaptiveLimiter('detect', 'test', initial=2,
+                                       maximum=4)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def acquire(self, timeout=None):
+        return self.loop.run_until_complete(self.limiter.acquire(timeout))
+
+    def test_waits_over_the_limit(self):
+        self.assertTrue(self.acquire())
+        self.assertTrue(self.acquire())
+        self.assertFalse(self.acquire(0.01))
+        self.assertEqual(self.limiter.in_flight, 2)
+        self.assertFalse(self.limiter.waiters)
+
+    def test_release_hands_over_the_slot(self):
+        self.acquire()
+        self.acquire()
+
+        async def scenario():
+            waiter = asyncio.ensure_future(self.limiter.acquire(1.0))
+            await asyncio.sleep(0)
+            self.limiter.release(0.1)
+            return await waiter
+        self.assertTrue(self.loop.run_until_complete(scenario()))
+        self.assertEqual(self.limiter.in_flight, 2)
+
+    def test_additive_increase(self):
+        self.acquire()
+        self.limiter.release(0.1)
+        self.assertEqual(self.limiter.limit, 2.5)
+
+    def test_idle_limit_does_not_grow(self):
+        self.acquire()
+        self.limiter.release(0.1)
+        self.acquire()
+        self.limiter.release(0.1)
+        self.assertEqual(self.limiter.limit, 2.5)
+
+    def test_multiplicative_decrease(self):
+        self.acquire()
+        self.limiter.release(0.1)
+        self.acquire()
+        self.limiter.release(1.0)
+        self.assertAlmostEqual(self.limiter.limit, 2.25)
+        self.acquire()
+        self.limiter.release(0.1, failed=True)
+        self.assertAlmostEqual(self.limiter.limit, 2.025)
+
+    def test_bounds(self):
+        for _ in range(50):
+            self.acquire()
+            self.acquire()
+            self.limiter.release(0.1)
+            self.limiter.release(0.1)
+        self.assertEqual(self.limiter.limit, 4)
+        for _ in range(50):
+            self.acquire()
+            self.limiter.release(None, failed=True)
+        self.assertEqual(self.limiter.limit, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
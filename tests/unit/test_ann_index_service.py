@@ -0,0 +1,58 @@
+import unittest
+
+import numpy as np
+
+from face_similarity.service.ann_index_service import AnnIndexService
+
+
+def clustered_vectors(size, seed=0):
+    """Vectors around 200 identities, like the faces of a gallery."""
+    random = np.random.RandomState(seed)
+    identities = random.rand(200, 128).astype(np.float32) * 0.2
+    return identities[random.randint(0, 200, size)] + random.randn(
+        size, 128).astype(np.float32) * 0.02
+
+
+class TestAnnIndexService(unittest.TestCase):
+
+    def setUp(self):
+        self.vectors = clustered_vectors(3000)
+
+    def index(self, pq_subspaces=0):
+        index = AnnIndexService(n_lists=16, n_probe=4,
+                                pq_subspaces=pq_subspaces, iterations=5)
+        index.train(self.vectors)
+        index.add(np.arange(len(self.vectors)), self.vectors)
+        return index
+
+    def exact(self, probe):
+        return int(np.argmin(np.linalg.norm(self.vectors - probe, axis=1)))
+
+    def test_all_lists_probed_is_exact(self):
+        index = self.index()
+        probe = self.vectors[10] + 0.001
+        ids, distances = index.search(probe, 3, n_probe=16)
+        self.assertEqual(ids[0], self.exact(probe))
+        self.assertTrue(np.all(np.diff(distances) >= 0))
+
+    def test_recall(self):
+        index = self.index()
+        probes = self.vectors[:100] + 0.005
+        found = sum(self.exact(probe) in index.search(probe, 10)[0]
+                    for probe in probes)
+        self.assertGreaterEqual(found, 95)
+
+    def test_incremental_insert_and_replace(self):
+        index = self.index()
+        vector = np.full(128, 0.5, dtype=np.float32)
+        index.add([5000], [vector])
+        self.assertEqual(index.search(vector, 1, n_probe=16)[0][0], 5000)
+        index.add([5000], [vector + 1.0])
+        self.assertNotEqual(index.search(vector, 1, n_probe=16)[0][0], 5000)
+        index.remove(5000)
+        self.assertNotIn(5000, index.search(vector + 1.0, 5, n_probe=16)[0])
+
+    def test_product_quantization(self):
+        index = self.index(pq_subspaces=16)
+        probe = self.vectors[20] + 0.001
+        self.assertIn(self.exact(probe), index.search(probe, 10)[0])
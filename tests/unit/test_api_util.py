@@ -0,0 +1,74 @@
+import base64
+import io
+import json
+import unittest
+
+from flask import Flask
+from werkzeug.exceptions import HTTPException
+
+from face_similarity.utils.api_util import ApiUtil
+from tests.unit.test_image_service import jpeg_b64
+
+JPEG = b'\xff\xd8\xff\xe0jpeg'
+
+
+class TestRequestImages(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.utils = ApiUtil()
+
+    def test_json_base64_is_decoded_once(self):
+        body = {"img1": base64.b64encode(JPEG).decode(), "img2": "YQ=="}
+        with self.app.test_request_context(
+                method='POST', data=json.dumps(body),
+                content_type='application/json') as context:
+            image_1, image_2 = self.utils.is_valid_request(context.request)
+        self.assertEqual(image_1.raw, JPEG)
+        self.assertEqual((image_1.tag, image_2.tag), ('img_1', 'img_2'))
+        self.assertEqual(image_2.b64, 'YQ==')
+
+    def test_wrong_base64(self):
+        body = {"img1": "YQ==", "img2": "not base64"}
+        with self.app.test_request_context(
+                method='POST', data=json.dumps(body),
+                content_type='application/json') as context:
+            with self.assertRaises(HTTPException) as error:
+                self.utils.is_valid_request(context.request)
+        self.assertEqual(error.exception.code, 401)
+
+    def test_multipart_batch(self):
+        data = {"images": [(io.BytesIO(JPEG), 'a.jpg'),
+                           (io.BytesIO(b'png'), 'b.png')],
+                "probe": "0"}
+        with self.app.test_request_context(
+                method='POST', data=data,
+                content_type='multipart/form-data') as context:
+            images, pairs = self.utils.is_valid_batch_request(
+                context.request, 64)
+        self.assertEqual([image.raw for image in images], [JPEG, b'png'])
+        self.assertEqual(images[0].b64, base64.b64encode(JPEG).decode())
+        self.assertEqual(pairs, [[0, 1]])
+
+    def test_octet_stream_gallery_search(self):
+        with self.app.test_request_context(
+                '/?top_k=3', method='POST', data=JPEG,
+                content_type='application/octet-stream') as context:
+            params = self.utils.is_valid_gallery_request(
+                context.request, ['image'])
+        self.assertEqual(params['image'].raw, JPEG)
+        self.assertEqual(params['top_k'], 3)
+
+
+class TestExifOrientation(unittest.TestCase):
+
+    def test_orientation_tag(self):
+        self.assertEqual(ApiUtil.bytes_exif_orientation(
+            base64.b64decode(jpeg_b64(6))), 6)
+
+    def test_without_exif(self):
+        self.assertEqual(ApiUtil.bytes_exif_orientation(
+            base64.b64decode(jpeg_b64())), 1)
+
+    def test_not_an_image(self):
+        self.assertEqual(ApiUtil.bytes_exif_orientation(b'hello'), 1)
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import threading
+import unittest
+from unittest import mock
+
+from face_similarity.asgi import app
+from face_similarity.utils.response_error import raise_error
+
+
+class TestAsgiApplication(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def call(self, scope, messages):
+        sent = list()
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        self.loop.run_until_complete(app(scope, receive, send))
+        return sent
+
+    def request(self, method, path, body=b''):
+        sent = self.call({
+            'type': 'http', 'method': method, 'path': path,
+            'query_string': b'',
+            'headers': [(b'content-type', b'application/json')]},
+            [{'type': 'http.request', 'body': body, 'more_body': False}])
+        return sent[0]['status'], sent[1]['body']
+
+    def test_errors_map_like_flask(self):
+        status, body = self.request(
+            'POST', '/image/face-distance',
+            json.dumps({"img1": "YQ=="}).encode())
+        self.assertEqual(status, 400)
+        self.assertEqual(json.loads(body)['detail'], (
+            "Bad Request, required parameters missing, parameters wasn't "
+            "found."))
+        status, _ = self.request(
+            'POST', '/image/face-distance',
+            json.dumps({"img1": "YQ==", "img2": "not base64"}).encode())
+        self.assertEqual(status, 400)
+
+    def test_body_is_parsed_outside_the_loop(self):
+        threads = list()
+
+        def is_valid_request(utils, request):
+            threads.append(threading.current_thread())
+            raise_error(401)
+
+        with mock.patch(
+                'face_similarity.utils.api_util.ApiUtil.is_valid_request',
+                is_valid_request):
+            status, _ = self.request(
+                'POST', '/image/face-distance',
+                json.dumps({"img1": "YQ==", "img2": "YQ=="}).encode())
+        self.assertEqual(status, 400)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_other_routes_are_served_by_flask(self):
+        status, body = self.request('GET', '/')
+        self.assertEqual(status, 200)
+        self.assertIn(b'Welcome', body)
+
+    def test_lifespan(self):
+        sent = self.call({'type': 'lifespan'}, [
+            {'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        self.assertEqual([message['type'] for message in sent], [
+            'lifespan.startup.complete', 'lifespan.shutdown.complete'])
@@ -0,0 +1,71 @@
+import unittest
+
+from werkzeug.exceptions import HTTPException
+
+from face_similarity.utils.circuit_breaker import CircuitBreaker
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker('encode', 'test', failures=2,
+                                      reset_timeout=10.0, clock=self.clock)
+
+    def assertRejected(self, code):
+        with self.assertRaises(HTTPException) as context:
+            self.breaker.before_call()
+        self.assertEqual(context.exception.code, code)
+
+    def open(self, error=424):
+        for _ in range(2):
+            self.breaker.before_call()
+            self.breaker.failure(error)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.before_call()
+        self.breaker.failure(405)
+        self.breaker.before_call()
+        self.breaker.success()
+        self.breaker.before_call()
+        self.breaker.failure(405)
+        self.assertEqual(self.breaker.state, CircuitBreaker.closed)
+        self.breaker.before_call()
+        self.breaker.failure(424)
+        self.assertRejected(424)
+
+    def test_probe_closes(self):
+        self.open()
+        self.clock.now = 10.0
+        self.breaker.before_call()
+        self.assertRejected(424)
+        self.breaker.success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.closed)
+        self.breaker.before_call()
+
+    def test_probe_fails(self):
+        self.open(405)
+        self.clock.now = 10.0
+        self.breaker.before_call()
+        self.breaker.failure(405)
+        self.assertRejected(405)
+
+    def test_abandoned_probe(self):
+        self.open()
+        self.clock.now = 10.0
+        self.breaker.before_call()
+        self.breaker.abandon()
+        self.breaker.before_call()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from face_similarity.service.embedding_cache_service import (
+    EmbeddingCacheService, SharedEmbeddingCacheService)
+from face_similarity.service.face_similarity_service import \
+    FaceSimilarityService
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestEmbeddingCacheService(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        size = EmbeddingCacheService.entry_size(
+            'a', np.zeros(128), [1, 2, 3, 4])
+        self.cache = EmbeddingCacheService(3 * size, 10.0, self.clock)
+
+    def put(self, key):
+        self.cache.put(key, [0.5] * 128, [1, 2, 3, 4])
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.put('a')
+        vector, bounding_box = self.cache.get('a')
+        self.assertEqual(len(vector), 128)
+        self.assertEqual(bounding_box, [1, 2, 3, 4])
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_least_recently_used_is_evicted(self):
+        for key in 'abc':
+            self.put(key)
+        self.cache.get('a')
+        self.put('d')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertLessEqual(self.cache.size, self.cache.max_bytes)
+
+    def test_expired_entry(self):
+        self.put('a')
+        self.clock.now = 11.0
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.assertEqual(self.cache.size, 0)
+
+
+class TestSharedEmbeddingCacheService(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'embeddings.sqlite')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def cache(self, max_bytes=10 ** 6):
+        return SharedEmbeddingCacheService(
+            self.path, max_bytes, 10.0, self.clock)
+
+    def test_shared_between_workers_and_restarts(self):
+        self.cache().put('a', [0.5] * 128, [1, 2, 3, 4])
+        vector, bounding_box = self.cache().get('a')
+        self.assertEqual(vector.tolist(), [0.5] * 128)
+        self.assertEqual(bounding_box, [1, 2, 3, 4])
+
+    def test_expired_entry(self):
+        cache = self.cache()
+        cache.put('a', [0.5] * 128, [1, 2, 3, 4])
+        self.clock.now = 11.0
+        self.assertIsNone(cache.get('a'))
+        cache.put('b', [0.5] * 128, [1, 2, 3, 4])
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = self.cache(max_bytes=3000)
+        for i, key in enumerate('abc'):
+            self.clock.now = float(i)
+            cache.put(key, [0.5] * 128, [1, 2, 3, 4])
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertLessEqual(cache.stats()['bytes'], 3000)
+
+    def test_called_outside_the_event_loop(self):
+        cache, threads = self.cache(), list()
+        cache.put('a', [0.5] * 128, [1, 2, 3, 4])
+
+        def get(key):
+            threads.append(threading.current_thread())
+            return cache.get(key)
+
+        loop = asyncio.new_event_loop()
+        try:
+            vector, _ = loop.run_until_complete(
+                FaceSimilarityService.call_cache(cache, get, 'a'))
+        finally:
+            loop.close()
+        self.assertEqual(vector.tolist(), [0.5] * 128)
+        self.assertIsNot(threads[0], threading.current_thread())
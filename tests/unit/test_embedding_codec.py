@@ -0,0 +1,65 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+from werkzeug.exceptions import HTTPException
+
+from face_similarity.service.requisitions_service import RequisitionsService
+from face_similarity.utils.embedding_codec import EmbeddingCodec
+from tests.benchmark.stub_upstreams import StubUpstreams
+from tests.unit.stub_upstreams_case import StubUpstreamsTestCase
+
+
+class TestEmbeddingCodec(unittest.TestCase):
+
+    def test_compact_round_trip(self):
+        vectors = np.random.RandomState(0).randn(2, 128)
+        decoded = EmbeddingCodec.decode(EmbeddingCodec.encode(vectors))
+        self.assertEqual(decoded.dtype, np.float32)
+        np.testing.assert_array_equal(decoded, vectors.astype(np.float32))
+
+    def test_legacy_string(self):
+        vector = np.random.RandomState(0).randn(128)
+        decoded = EmbeddingCodec.decode(
+            {'faces_encoding': json.dumps([vector.tolist()])})
+        np.testing.assert_array_equal(decoded, [vector])
+
+    def test_wrong_size(self):
+        with self.assertRaises(HTTPException) as context:
+            EmbeddingCodec.decode({'faces_encoding': 'AAAA',
+                                   'encoding_format': 'float32'})
+        self.assertEqual(context.exception.code, 417)
+
+
+class TestEmbeddingFormatNegotiation(StubUpstreamsTestCase):
+    """Calls to the stub encoder on a local port."""
+
+    def encode(self):
+        answer = self.loop.run_until_complete(RequisitionsService().post(
+            [self.url('/image/face-encoding'), b'{"b64_image":"YQ=="}',
+             'img_1', 'encode']))
+        return answer[1], EmbeddingCodec.decode(answer[1])[0]
+
+    def test_compact_vectors(self):
+        answer, vector = self.encode()
+        self.assertEqual(answer['encoding_format'], 'float32')
+        np.testing.assert_array_equal(
+            vector, StubUpstreams.vector('YQ==').astype(np.float32))
+
+    def test_legacy_vectors(self):
+        with mock.patch.dict(os.environ, {'EMBEDDING_FORMAT': 'json'}):
+            answer, vector = self.encode()
+        self.assertNotIn('encoding_format', answer)
+        np.testing.assert_array_equal(vector, StubUpstreams.vector('YQ=='))
+
+    def test_encoder_without_compact_format(self):
+        self.stubs.embedding_format = 'json'
+        answer, vector = self.encode()
+        self.assertNotIn('encoding_format', answer)
+        np.testing.assert_array_equal(vector, StubUpstreams.vector('YQ=='))
+
+
+if __name__ == '__main__':
+    unittest.main()
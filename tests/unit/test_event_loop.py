@@ -0,0 +1,109 @@
+import asyncio
+import concurrent.futures
+import threading
+import unittest
+from unittest import mock
+
+from face_similarity.utils.event_loop import (WorkerLoop, first_completed,
+                                              gather_or_cancel)
+
+
+class TestWorkerLoop(unittest.TestCase):
+
+    def setUp(self):
+        self.worker_loops = list()
+
+    def tearDown(self):
+        WorkerLoop.shutdown()
+        for worker_loop in self.worker_loops:
+            if worker_loop.thread.is_alive():
+                worker_loop.loop.call_soon_threadsafe(worker_loop.loop.stop)
+                worker_loop.thread.join(timeout=5)
+            worker_loop.loop.close()
+
+    def instance(self):
+        worker_loop = WorkerLoop.instance()
+        if worker_loop not in self.worker_loops:
+            self.worker_loops.append(worker_loop)
+        return worker_loop
+
+    def test_result_and_error(self):
+        async def double(value):
+            return 2 * value
+
+        async def fail():
+            raise KeyError('missing')
+
+        worker_loop = self.instance()
+        self.assertIs(self.instance(), worker_loop)
+        self.assertEqual(worker_loop.run(double(21), 5), 42)
+        with self.assertRaises(KeyError):
+            worker_loop.run(fail(), 5)
+
+    def test_new_loop_after_fork(self):
+        parent = self.instance()
+        with mock.patch('face_similarity.utils.event_loop.os.getpid',
+                        return_value=parent.pid + 1):
+            child = self.instance()
+            self.assertIsNot(child, parent)
+            self.assertIsNot(child.loop, parent.loop)
+            self.assertIs(self.instance(), child)
+
+    def test_timeout_cancels_coroutine(self):
+        cancelled = threading.Event()
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            self.instance().run(slow(), 0.05)
+        self.assertTrue(cancelled.wait(5))
+
+
+class TestConcurrentHelpers(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_gather_or_cancel_cancels_on_error(self):
+        cancelled = list()
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def fail():
+            raise KeyError('missing')
+
+        async def scenario():
+            try:
+                await gather_or_cancel(slow(), fail())
+            finally:
+                await asyncio.sleep(0)
+
+        with self.assertRaises(KeyError):
+            self.loop.run_until_complete(scenario())
+        self.assertEqual(cancelled, [True])
+
+    def test_first_completed_skips_none(self):
+        async def answer(value, delay):
+            await asyncio.sleep(delay)
+            return value
+
+        self.assertEqual(self.loop.run_until_complete(first_completed(
+            answer(None, 0), answer('face', 0.01), answer('late', 5))),
+            'face')
+
+
+if __name__ == '__main__':
+    unittest.main()
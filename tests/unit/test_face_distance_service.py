@@ -0,0 +1,70 @@
+import math
+import unittest
+
+import numpy as np
+
+from face_similarity.service.face_distance_service import \
+    FaceDistanceService
+
+
+def scalar_percentage(distance, threshold=0.6):
+    """Reference scalar curve of the percentage."""
+    if distance > threshold:
+        return round(((1.0 - distance) / ((1.0 - threshold) * 2.0)) * 100, 2)
+    lin_val = 1.0 - (distance / (threshold * 2.0))
+    return round((lin_val + ((1.0 - lin_val) * math.pow(
+        (lin_val - 0.5) * 2, 0.2))) * 100, 2)
+
+
+class TestFaceDistanceService(unittest.TestCase):
+
+    def setUp(self):
+        self.service = FaceDistanceService()
+        random = np.random.RandomState(0)
+        self.vectors_1 = random.randn(3, 128) * 0.05
+        self.vectors_2 = random.randn(4, 128) * 0.05
+
+    def test_single_pair(self):
+        distance = self.service.face_distance(
+            list(self.vectors_1[0]), list(self.vectors_2[0]))
+        self.assertEqual(np.ndim(distance), 0)
+        self.assertAlmostEqual(float(distance), float(np.linalg.norm(
+            self.vectors_1[0] - self.vectors_2[0])))
+        percentage = self.service.convert_distance_to_percentage(distance)
+        self.assertIsInstance(percentage, float)
+        self.assertEqual(percentage, scalar_percentage(float(distance)))
+
+    def test_matrix(self):
+        distances = self.service.face_distance(
+            self.vectors_1, self.vectors_2)
+        self.assertEqual(distances.shape, (3, 4))
+        self.assertAlmostEqual(distances[2, 1], np.linalg.norm(
+            self.vectors_1[2] - self.vectors_2[1]))
+        self.assertEqual(self.service.face_distance(
+            self.vectors_1[0], self.vectors_2).shape, (4,))
+
+    def test_expansion_matches_broadcast(self):
+        expected = self.service.face_distance(
+            self.vectors_1, self.vectors_2)
+        limit = FaceDistanceService.broadcast_limit
+        FaceDistanceService.broadcast_limit = 0
+        try:
+            distances = self.service.face_distance(
+                self.vectors_1, self.vectors_2)
+        finally:
+            FaceDistanceService.broadcast_limit = limit
+        np.testing.assert_allclose(distances, expected, rtol=1e-6)
+
+    def test_float32(self):
+        distances = self.service.face_distance(
+            self.vectors_1.astype(np.float32), self.vectors_2)
+        self.assertEqual(distances.dtype, np.float32)
+        percentages = self.service.convert_distance_to_percentage(distances)
+        self.assertEqual(percentages.dtype, np.float32)
+
+    def test_percentage_curve(self):
+        distances = np.array([[0.0, 0.3, 0.6], [0.61, 0.8, 1.0]])
+        percentages = self.service.convert_distance_to_percentage(distances)
+        self.assertEqual(percentages.shape, (2, 3))
+        self.assertEqual(percentages.ravel().tolist(), [
+            scalar_percentage(d) for d in distances.ravel().tolist()])
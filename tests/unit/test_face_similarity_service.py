@@ -0,0 +1,178 @@
+import asyncio
+import json
+import os
+import threading
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+from prometheus_client import REGISTRY
+from werkzeug.exceptions import HTTPException, abort
+
+from face_similarity.service.face_similarity_service import \
+    FaceSimilarityService
+from face_similarity.utils.api_util import ApiUtil
+from face_similarity.utils.image_data import ImageData
+from tests.unit.test_image_service import jpeg_b64
+
+
+class FakeRequisitions:
+    """Answer api-preprocess and api-face-detect with a face at one angle."""
+
+    def __init__(self, face_angle):
+        self.face_angle = face_angle
+        self.calls = list()
+        self.images = list()
+
+    async def post(self, endpoint):
+        url, payload, tag = endpoint[:3]
+        payload = json.loads(payload)
+        self.calls.append(url)
+        self.images.append(payload.get("image"))
+        if url == 'rotate':
+            return [200, {"b64_image": str(payload["angle"])}, tag]
+        angle = 0 if payload["image"].startswith('/9j') \
+            else int(payload["image"])
+        found = angle == self.face_angle
+        return [200, {"number_of_faces": int(found),
+                      "data": [{"bounding_box": [angle]}]}, tag]
+
+
+class TestProgressiveSearch(unittest.TestCase):
+
+    def setUp(self):
+        environ = mock.patch.dict(os.environ, {
+            'PRE_PROCESS_URL': 'rotate', 'FACE_DETECT_URL': 'detect'})
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def search(self, image, face_angle, mode='progressive', likely=None):
+        service = FaceSimilarityService()
+        service.rotation_search = mode
+        service.rotation_engine = 'remote'
+        service.requisitions_service = FakeRequisitions(face_angle)
+        if likely is not None:
+            service.orientation_prefilter = True
+            service.image_service.likely_angles = \
+                lambda image, limit: likely[:limit]
+        face = self.loop.run_until_complete(
+            service.get_face(ImageData(image, 'img_1')))
+        return [face[0].b64, face[1]], service.requisitions_service.calls
+
+    def test_upright_face_uses_one_call(self):
+        face, calls = self.search(jpeg_b64(), 0)
+        self.assertEqual(face[1], [0])
+        self.assertEqual(calls, ['detect'])
+
+    def test_remote_rotation_of_exif_image(self):
+        service = FaceSimilarityService()
+        service.rotation_engine = 'remote'
+        service.requisitions_service = FakeRequisitions(0)
+        normalized = service.image_service.normalize(ImageData(
+            jpeg_b64(6, (100, 200)), 'img_1'))
+        face = self.loop.run_until_complete(service.get_face(normalized))
+        # Sent upright and without the tag, found in one call.
+        self.assertEqual(service.requisitions_service.calls, ['detect'])
+        self.assertEqual(ApiUtil.to_numpy(face[0].b64).shape[:2], (200, 100))
+        self.assertEqual(ApiUtil.bytes_exif_orientation(face[0].raw), 1)
+
+    def test_falls_back_to_other_rotations(self):
+        face, _ = self.search(jpeg_b64(), 180)
+        self.assertEqual(face, ['180', [180]])
+
+    def test_prefilter_angle_is_tried_first(self):
+        face, calls = self.search(jpeg_b64(), 180, likely=[180])
+        self.assertEqual(face, ['180', [180]])
+        self.assertEqual(calls, ['rotate', 'detect'])
+
+    def test_prefilter_falls_back_to_other_rotations(self):
+        face, calls = self.search(jpeg_b64(), 90, likely=[180])
+        self.assertEqual(face, ['90', [90]])
+        self.assertEqual(calls[:2], ['rotate', 'detect'])
+
+    def test_prefilter_without_local_face(self):
+        face, calls = self.search(jpeg_b64(), 270, likely=[])
+        self.assertEqual(face, ['270', [270]])
+        self.assertEqual(calls[0], 'detect')
+
+    def test_rotation_retries_after_first_step(self):
+        def retries():
+            return REGISTRY.get_sample_value('upstream_retries_total', {
+                'stage': 'detect', 'host': '', 'reason': 'rotation'}) or 0.0
+        before = retries()
+        self.search(jpeg_b64(), 180, likely=[180])
+        self.assertEqual(retries(), before)
+        self.search(jpeg_b64(), 90, likely=[180])
+        self.assertGreater(retries(), before)
+
+    def test_local_rotation_of_exif_image(self):
+        service = FaceSimilarityService()
+        service.requisitions_service = FakeRequisitions(None)
+        normalized = service.image_service.normalize(ImageData(
+            jpeg_b64(6, (100, 200)), 'img_1'))
+        self.assertEqual(ApiUtil.bytes_exif_orientation(normalized.raw), 1)
+        with self.assertRaises(HTTPException):
+            self.loop.run_until_complete(service.get_face(normalized))
+        # Upright pixels first, then their rotations (in any order, they
+        # run at once), no EXIF step.
+        self.assertEqual(service.requisitions_service.calls, ['detect'] * 4)
+        shapes = [ApiUtil.to_numpy(image).shape[:2]
+                  for image in service.requisitions_service.images]
+        self.assertEqual(shapes[0], (200, 100))
+        self.assertEqual(sorted(shapes[1:]),
+                         [(100, 200), (100, 200), (200, 100)])
+
+    def test_image_work_outside_the_event_loop(self):
+        service = FaceSimilarityService()
+        service.requisitions_service = FakeRequisitions(None)
+        threads = list()
+        for name in ('check_quality', 'normalize', 'rotate'):
+            def record(*args, function=getattr(service.image_service, name)):
+                threads.append(threading.current_thread())
+                return function(*args)
+            setattr(service.image_service, name, record)
+        array = np.random.RandomState(0).randint(
+            0, 255, (100, 200, 3)).astype(np.uint8)
+        normalized = self.loop.run_until_complete(service.prepare(ImageData(
+            None, 'img_1', raw=cv2.imencode('.jpg', array)[1].tobytes())))
+        with self.assertRaises(HTTPException):
+            self.loop.run_until_complete(service.get_face(normalized))
+        # Quality gate, normalization and the three rotations.
+        self.assertEqual(len(threads), 5)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_exhaustive_search(self):
+        face, calls = self.search(jpeg_b64(), 90, 'exhaustive')
+        self.assertEqual(face, ['90', [90]])
+        self.assertEqual(len(calls), 7)
+
+
+class TestBatchComparison(unittest.TestCase):
+
+    def test_repeated_images_are_processed_once(self):
+        service = FaceSimilarityService()
+        processed = list()
+
+        async def get_face_vector(image):
+            processed.append(image.b64)
+            if image.b64 == 'bm9mYWNl':
+                abort(403)
+            return np.full(128, len(processed) / 10.0), [0]
+
+        service.get_face_vector = get_face_vector
+        loop = asyncio.new_event_loop()
+        results = loop.run_until_complete(service.batch_comparison(
+            [ImageData(b64, 'img_%s' % i) for i, b64 in enumerate(
+                ['YQ==', 'Yg==', 'YQ==', 'bm9mYWNl'])],
+            [[0, 2], [0, 1], [1, 3]]))
+        loop.close()
+        self.assertEqual(len(processed), 3)
+        self.assertEqual(results[0], {"pair": [0, 2], "similarity": 100.0})
+        self.assertLess(results[1]["similarity"], 100.0)
+        self.assertIsNone(results[2]["similarity"])
+        self.assertEqual(results[2]["error"], 403)
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from face_similarity.service.ann_index_service import AnnIndexService
+from face_similarity.service.gallery_service import GalleryService
+
+
+class TestGalleryService(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'gallery.sqlite')
+        self.gallery = GalleryService(self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_top_k_most_similar_first(self):
+        for i in range(5):
+            self.gallery.enroll('subject_%s' % i, np.full(128, i * 0.01))
+        results = self.gallery.search(np.full(128, 0.029), 2)
+        self.assertEqual([result['subject_id'] for result in results],
+                         ['subject_3', 'subject_2'])
+        self.assertGreater(results[0]['similarity'],
+                           results[1]['similarity'])
+
+    def test_enrollments_of_other_workers_are_loaded(self):
+        GalleryService(self.path).enroll('subject_1', np.zeros(128))
+        results = self.gallery.search(np.zeros(128), 5)
+        self.assertEqual(results, [
+            {"subject_id": "subject_1", "similarity": 100.0}])
+
+    def test_enroll_again_replaces_vector(self):
+        self.gallery.enroll('subject_1', np.zeros(128))
+        self.gallery.enroll('subject_1', np.full(128, 0.1))
+        results = self.gallery.search(np.full(128, 0.1), 5)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['similarity'], 100.0)
+
+    def test_empty_gallery(self):
+        self.assertEqual(self.gallery.search(np.zeros(128), 5), [])
+
+    def test_index_is_trained_in_background(self):
+        release = threading.Event()
+        train = AnnIndexService.train
+
+        def blocked_train(index, vectors):
+            release.wait(5)
+            train(index, vectors)
+
+        gallery = GalleryService(
+            self.path, AnnIndexService(n_lists=4, n_probe=4),
+            index_min_size=20)
+        vectors = np.random.RandomState(0).rand(30, 128)
+        with mock.patch.object(AnnIndexService, 'train', blocked_train):
+            for i, vector in enumerate(vectors):
+                gallery.enroll('subject_%s' % i, vector)
+            # The exact scan serves the searches while the index trains.
+            results = gallery.search(vectors[25], 1)
+            self.assertEqual(results[0]['subject_id'], 'subject_25')
+            self.assertFalse(gallery.index.trained)
+            release.set()
+            gallery.training.join(5)
+        self.assertTrue(gallery.index.trained)
+        self.assertEqual(gallery.index.trained_size, 20)
+        # Subjects enrolled during the training are in the new index.
+        for i in (5, 29):
+            results = gallery.search(vectors[i], 1)
+            self.assertEqual(results[0], {
+                "subject_id": "subject_%s" % i, "similarity": 100.0})
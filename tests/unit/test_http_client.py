@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import unittest
+
+from face_similarity.utils.http_client import HttpClient
+
+
+class TestHttpClient(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        HttpClient.shutdown()
+        self.loop.close()
+
+    @staticmethod
+    async def get_session():
+        return HttpClient.session()
+
+    def session(self, loop=None):
+        return (loop or self.loop).run_until_complete(self.get_session())
+
+    def test_session_reused_per_loop(self):
+        session = self.session()
+        self.assertIs(self.session(), session)
+        other = asyncio.new_event_loop()
+        try:
+            self.assertIsNot(self.session(other), session)
+        finally:
+            other.run_until_complete(HttpClient.close())
+            other.close()
+
+    def test_closed_session_is_replaced(self):
+        session = self.session()
+        self.loop.run_until_complete(session.close())
+        replacement = self.session()
+        self.assertIsNot(replacement, session)
+        self.assertFalse(replacement.closed)
+
+    def test_close_session_of_running_loop(self):
+        session = self.session()
+        self.loop.run_until_complete(HttpClient.close())
+        self.assertTrue(session.closed)
+        self.assertIsNot(self.session(), session)
+
+    def test_shutdown_closes_every_session(self):
+        idle = self.session()
+        running = asyncio.new_event_loop()
+        thread = threading.Thread(target=running.run_forever, daemon=True)
+        thread.start()
+        try:
+            session = asyncio.run_coroutine_threadsafe(
+                self.get_session(), running).result(timeout=5)
+            HttpClient.shutdown()
+            self.assertTrue(idle.closed)
+            self.assertTrue(session.closed)
+        finally:
+            running.call_soon_threadsafe(running.stop)
+            thread.join(timeout=5)
+            running.close()
+        self.assertIsNot(self.session(), idle)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import base64
+import struct
+import unittest
+
+import cv2
+import numpy as np
+from werkzeug.exceptions import HTTPException
+
+from face_similarity.service.image_service import ImageService
+from face_similarity.utils.api_util import ApiUtil
+from face_similarity.utils.image_data import ImageData
+
+
+def jpeg_b64(orientation=None, shape=(8, 8)):
+    """Build a small base64 JPEG, with EXIF orientation when informed."""
+    image = np.zeros(shape + (3,), np.uint8)
+    jpeg = cv2.imencode('.jpg', image)[1].tobytes()
+    if orientation is not None:
+        ifd = struct.pack('<H', 1) + struct.pack(
+            '<HHIHH', 0x0112, 3, 1, orientation, 0) + struct.pack('<I', 0)
+        tiff = b'II' + struct.pack('<HI', 42, 8) + ifd
+        segment = b'Exif\x00\x00' + tiff
+        app1 = b'\xff\xe1' + struct.pack('>H', len(segment) + 2) + segment
+        jpeg = jpeg[:2] + app1 + jpeg[2:]
+    return base64.b64encode(jpeg).decode()
+
+
+class TestLocalRotation(unittest.TestCase):
+
+    def test_rotate_counter_clockwise(self):
+        array = np.zeros((20, 10, 3), np.uint8)
+        array[0, 9] = 255
+        image = ImageData(jpeg_b64(), 'img_1', array)
+        rotated = ImageService().rotate(image, 90)
+        self.assertEqual(rotated.array.shape, (10, 20, 3))
+        self.assertEqual(rotated.array[0, 0].tolist(), [255, 255, 255])
+        self.assertEqual(ApiUtil.to_numpy(rotated.b64).shape, (10, 20, 3))
+        self.assertEqual(rotated.tag, 'img_1')
+
+
+class TestInputNormalization(unittest.TestCase):
+
+    def setUp(self):
+        self.service = ImageService()
+        self.service.input_max_side = 64
+
+    def test_large_image_is_downscaled(self):
+        array = np.random.RandomState(0).randint(
+            0, 255, (200, 100, 3)).astype(np.uint8)
+        b64 = base64.b64encode(cv2.imencode('.png', array)[1]).decode()
+        normalized = self.service.normalize(ImageData(b64, 'img_1'))
+        self.assertEqual(ApiUtil.to_numpy(normalized.b64).shape, (64, 32, 3))
+        self.assertLess(len(normalized.b64), len(b64))
+        self.assertEqual(normalized.tag, 'img_1')
+
+    def test_small_jpeg_is_kept(self):
+        image = ImageData(jpeg_b64(), 'img_1')
+        self.assertIs(self.service.normalize(image), image)
+
+    def test_not_an_image_is_kept(self):
+        image = ImageData('aGVsbG8=', 'img_1')
+        self.assertIs(self.service.normalize(image), image)
+
+
+class TestQualityGate(unittest.TestCase):
+
+    def setUp(self):
+        self.service = ImageService()
+        random_state = np.random.RandomState(0)
+        self.array = cv2.resize(random_state.randint(
+            0, 255, (24, 18, 3)).astype(np.uint8), (300, 400))
+        for _ in range(12):
+            center = tuple(int(v) for v in random_state.randint(0, 300, 2))
+            cv2.circle(self.array, center, 20, (255, 255, 255), -1)
+
+    def check(self, array, extension='.jpg'):
+        raw = cv2.imencode(extension, array)[1].tobytes()
+        return self.service.check_quality(ImageData(None, 'img_1', raw=raw))
+
+    def assertRejected(self, code, *args):
+        with self.assertRaises(HTTPException) as context:
+            self.check(*args)
+        self.assertEqual(context.exception.code, code)
+
+    def test_usable_image(self):
+        self.assertIsNone(self.check(self.array))
+
+    def test_not_an_image(self):
+        with self.assertRaises(HTTPException) as context:
+            self.service.check_quality(ImageData('aGVsbG8=', 'img_1'))
+        self.assertEqual(context.exception.code, 401)
+
+    def test_truncated_jpeg(self):
+        raw = cv2.imencode('.jpg', self.array)[1].tobytes()
+        with self.assertRaises(HTTPException) as context:
+            self.service.check_quality(ImageData(
+                None, 'img_1', raw=raw[:len(raw) // 2]))
+        self.assertEqual(context.exception.code, 401)
+
+    def test_data_after_end_marker(self):
+        for extension in ('.jpg', '.png'):
+            raw = cv2.imencode(extension, self.array)[1].tobytes()
+            trailer = b'\x00\x00\x00\x18ftypmp42' + bytes(range(256)) * 8
+            self.assertIsNone(self.service.check_quality(
+                ImageData(None, 'img_1', raw=raw + trailer)))
+
+    def test_truncated_jpeg_with_thumbnail(self):
+        thumbnail = cv2.imencode('.jpg', self.array[:40, :40])[1].tobytes()
+        tiff = b'II' + struct.pack('<HIH', 42, 8, 0) + struct.pack('<I', 0)
+        segment = b'Exif\x00\x00' + tiff + thumbnail
+        raw = cv2.imencode('.jpg', self.array)[1].tobytes()
+        raw = raw[:2] + b'\xff\xe1' + struct.pack(
+            '>H', len(segment) + 2) + segment + raw[2:]
+        self.assertFalse(ImageService.is_truncated(raw))
+        # The thumbnail scan and end of image are before the cut.
+        self.assertTrue(ImageService.is_truncated(raw[:len(raw) * 2 // 3]))
+
+    def test_truncated_png(self):
+        raw = cv2.imencode('.png', self.array)[1].tobytes()
+        with self.assertRaises(HTTPException) as context:
+            self.service.check_quality(ImageData(
+                None, 'img_1', raw=raw[:-6]))
+        self.assertEqual(context.exception.code, 401)
+
+    def test_too_small(self):
+        self.assertRejected(406, self.array[:40, :40])
+
+    def test_blurry(self):
+        self.assertRejected(406, cv2.GaussianBlur(self.array, (0, 0), 8))
+
+    def test_exposure(self):
+        self.assertRejected(406, self.array // 16)
+        self.assertRejected(406, 255 - self.array // 16, '.png')
+
+    def test_disabled(self):
+        self.service.quality_gate = False
+        self.assertIsNone(self.check(self.array[:40, :40]))
+
+
+class TestOrientationPrefilter(unittest.TestCase):
+
+    def test_not_an_image(self):
+        self.assertEqual(ImageService().likely_angles(
+            ImageData('aGVsbG8=', 'img_1')), [])
+
+    def test_image_without_face(self):
+        self.assertEqual(ImageService().likely_angles(
+            ImageData(jpeg_b64(), 'img_1')), [])
+
+    def test_rotations_ranked_by_confidence(self):
+        class FakeCascade:
+            """Finds a face in every rotation, as confident as the
+            top-left corner of the rotated pixels is bright."""
+
+            @staticmethod
+            def detectMultiScale3(gray, **options):
+                return [[0, 0, 20, 20]], [0], [float(gray[0, 0])]
+
+        array = np.zeros((64, 64, 3), np.uint8)
+        array[:2, :2], array[:2, -2:] = 10, 40
+        array[-2:, -2:], array[-2:, :2] = 30, 20
+        service = ImageService()
+        service.face_cascade = FakeCascade
+        # Upright is the least likely: the counter-clockwise rotation puts
+        # the brightest corner (top-right) on top.
+        self.assertEqual(service.rank_angles(array, 2), (90, 180))
+        self.assertEqual(service.rank_angles(array), (90, 180, 270, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
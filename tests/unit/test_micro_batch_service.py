@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+
+from werkzeug.exceptions import HTTPException
+
+from face_similarity.service.micro_batch_service import MicroBatchService
+from face_similarity.utils.batch_adapter import JsonBatchAdapter
+from face_similarity.utils.deadline import Deadline
+from tests.unit.stub_upstreams_case import StubUpstreamsTestCase
+
+
+class TestMicroBatchService(StubUpstreamsTestCase):
+    """Batches sent to the stub batch endpoint on a local port."""
+    stub_options = {'latency_ms': 10.0, 'sigma': 0.0}
+
+    def setUp(self):
+        super().setUp()
+        self.batcher = MicroBatchService(
+            'detect', self.url('/image/face-detect/batch'),
+            JsonBatchAdapter(), window=0.01, max_size=4)
+
+    def detect(self, count):
+        async def scenario():
+            return await asyncio.gather(*(self.batcher.post(
+                ['detect', b'{"image":"YQ=="}', 'img_%s' % i, 'detect'],
+                Deadline(5.0)) for i in range(count)),
+                return_exceptions=True)
+        return self.loop.run_until_complete(scenario())
+
+    def test_concurrent_calls_batched(self):
+        results = self.detect(6)
+        self.assertEqual(self.stubs.calls, {'detect_batch': 2})
+        self.assertEqual([result[2] for result in results],
+                         ['img_%s' % i for i in range(6)])
+        for result in results:
+            self.assertEqual(result[0], 200)
+            self.assertEqual(result[1]['number_of_faces'], 1)
+
+    def test_batches_in_flight_are_referenced(self):
+        async def scenario():
+            call = asyncio.ensure_future(self.batcher.post(
+                ['detect', b'{"image":"YQ=="}', 'img_1', 'detect'],
+                Deadline(5.0)))
+            await asyncio.sleep(0)
+            self.batcher.flush()
+            self.assertEqual(len(self.batcher.tasks), 1)
+            await next(iter(self.batcher.tasks))
+            self.assertEqual(self.batcher.tasks, set())
+            return await call
+        self.assertEqual(self.loop.run_until_complete(scenario())[0], 200)
+
+    def test_error_of_each_image(self):
+        self.stubs.error_rate = 1.0
+        for result in self.detect(2):
+            self.assertIsInstance(result, HTTPException)
+            self.assertEqual(result.code, 424)
+
+
+class TestJsonBatchAdapter(unittest.TestCase):
+
+    def test_payload(self):
+        self.assertEqual(JsonBatchAdapter().payload([b'{"a":1}', b'{}']),
+                         b'{"items":[{"a":1},{}]}')
+
+    def test_split(self):
+        self.assertEqual(JsonBatchAdapter().split({"results": [
+            {"status": 200, "body": {"a": 1}}, {"status": 500}]}, 2),
+            [[200, {"a": 1}], [500, None]])
+
+    def test_wrong_number_of_results(self):
+        with self.assertRaises(HTTPException) as context:
+            JsonBatchAdapter().split({"results": []}, 1)
+        self.assertEqual(context.exception.code, 417)
+
+
+if __name__ == '__main__':
+    unittest.main()
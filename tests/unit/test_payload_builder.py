@@ -0,0 +1,26 @@
+import json
+import unittest
+
+from face_similarity.utils.image_data import ImageData
+from face_similarity.utils.payload_builder import PayloadBuilder
+
+
+class TestPayloadBuilder(unittest.TestCase):
+
+    def test_build_around_image(self):
+        image = ImageData('aGVs\nbG8=', 'img_1')
+        payload = PayloadBuilder.build(
+            'b64_image', image, {"face_locations": [[1, 2, 3, 4]]})
+        self.assertEqual(json.loads(payload), {
+            "b64_image": 'aGVs\nbG8=', "face_locations": [[1, 2, 3, 4]]})
+
+    def test_build_without_fields(self):
+        payload = PayloadBuilder.build('image', ImageData('aGk=', 'img_1'), {})
+        self.assertEqual(json.loads(payload), {"image": 'aGk='})
+
+    def test_image_serialized_once(self):
+        image = ImageData('aGk=', 'img_1')
+        PayloadBuilder.build('image', image, {"angle": 90})
+        shared = image.b64_json
+        PayloadBuilder.build('image', image, {"angle": 180})
+        self.assertIs(image.b64_json, shared)
@@ -0,0 +1,99 @@
+import asyncio
+import base64
+import os
+import unittest
+
+import cv2
+import numpy as np
+from werkzeug.exceptions import HTTPException
+
+from face_similarity.service.image_service import ImageService
+from face_similarity.utils.image_data import ImageData
+from face_similarity.utils.process_pool import (
+    ProcessPool, SharedBuffer, load_values, share_values, shared_memory)
+
+
+def segments():
+    """Shared memory segments of the machine (Linux)."""
+    return set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') \
+        else set()
+
+
+@unittest.skipIf(shared_memory is None, 'multiprocessing.shared_memory')
+class TestSharedBuffer(unittest.TestCase):
+
+    def test_round_trip(self):
+        before = segments()
+        array = np.arange(60, dtype=np.uint8).reshape(5, 4, 3)[:, ::2]
+        shared, created = share_values([array, b'abc', 'text', 7], 1)
+        self.assertIsInstance(shared[0], SharedBuffer)
+        self.assertIsInstance(shared[1], SharedBuffer)
+        self.assertEqual(shared[2:], ('text', 7))
+        for segment in created:
+            segment.close()
+        loaded = load_values(shared, unlink=True)
+        np.testing.assert_array_equal(loaded[0], array)
+        self.assertEqual(loaded[1:], (b'abc', 'text', 7))
+        self.assertEqual(segments(), before)
+
+    def test_small_buffers_are_not_shared(self):
+        shared, created = share_values([b'abc'], 1024)
+        self.assertEqual((shared, created), ((b'abc',), []))
+
+
+class TestProcessPool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = ProcessPool(1, shared_min_bytes=1024)
+        cls.service = ImageService()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.executor.shutdown(wait=True)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_task(self, *args):
+        return self.loop.run_until_complete(self.pool.run('test', *args))
+
+    def test_rotate(self):
+        before = segments()
+        array = np.random.RandomState(0).randint(
+            0, 255, (200, 100, 3)).astype(np.uint8)
+        rotated, jpeg = self.run_task(self.service.rotate_array, array, 90)
+        np.testing.assert_array_equal(
+            rotated, cv2.rotate(array, cv2.ROTATE_90_COUNTERCLOCKWISE))
+        self.assertEqual(ImageData.decode(jpeg).shape, (100, 200, 3))
+        self.assertEqual(segments(), before)
+
+    def test_prepare(self):
+        self.service.input_max_side = 64
+        array = np.random.RandomState(0).randint(
+            0, 255, (200, 100, 3)).astype(np.uint8)
+        b64 = base64.b64encode(cv2.imencode('.png', array)[1]).decode()
+        normalized, _, _ = self.loop.run_until_complete(
+            self.service.prepare_in_pool(self.pool, ImageData(b64, 'img_1')))
+        self.assertEqual(normalized.array.shape, (64, 32, 3))
+        self.assertEqual(ImageData.decode(normalized.raw).shape, (64, 32, 3))
+        self.assertEqual(normalized.tag, 'img_1')
+
+    def test_rejected_image(self):
+        image = ImageData(None, 'img_1', raw=b'\xff\xd8 truncated')
+        with self.assertRaises(HTTPException) as context:
+            self.loop.run_until_complete(
+                self.service.prepare_in_pool(self.pool, image))
+        self.assertEqual(context.exception.code, 401)
+
+    def test_error_is_raised(self):
+        with self.assertRaises(KeyError):
+            self.run_task(self.service.rotate_array,
+                          np.zeros((8, 8, 3), np.uint8), 45)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+from werkzeug.exceptions import HTTPException
+
+from face_similarity.service import requisitions_service
+from face_similarity.service.requisitions_service import RequisitionsService
+from face_similarity.utils.adaptive_limiter import AdaptiveLimiter
+from face_similarity.utils.circuit_breaker import CircuitBreaker
+from face_similarity.utils.deadline import Deadline
+from face_similarity.utils.latency_window import LatencyWindow
+from tests.unit.stub_upstreams_case import StubUpstreamsTestCase
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDeadline(unittest.TestCase):
+
+    def test_stage_limit(self):
+        deadline = Deadline(30.0, FakeClock())
+        self.assertEqual(deadline.timeout('detect'), 10.0)
+        self.assertEqual(deadline.timeout('other'), 30.0)
+
+    def test_remaining_budget(self):
+        clock = FakeClock()
+        deadline = Deadline(30.0, clock)
+        clock.now = 27.5
+        self.assertEqual(deadline.timeout('encode'), 2.5)
+
+    def test_budget_split_between_stages(self):
+        clock = FakeClock()
+        deadline = Deadline(30.0, clock)
+        clock.now = 20.0
+        # Detection and encoding have the same limit, half of the 10 s each.
+        self.assertEqual(deadline.timeout('detect'), 5.0)
+        self.assertEqual(deadline.timeout('preprocess'), 2.0)
+        self.assertEqual(deadline.timeout('encode'), 10.0)
+
+    def test_expired(self):
+        clock = FakeClock()
+        deadline = Deadline(1.0, clock)
+        clock.now = 2.0
+        with self.assertRaises(HTTPException) as context:
+            deadline.timeout('encode')
+        self.assertEqual(context.exception.code, 504)
+
+
+class TestLatencyWindow(unittest.TestCase):
+
+    def test_percentile(self):
+        window = LatencyWindow(size=100)
+        for latency in range(200):
+            window.add(float(latency))
+        self.assertAlmostEqual(window.percentile(50), 149.5)
+
+    def test_not_enough_samples(self):
+        window = LatencyWindow()
+        window.add(1.0)
+        self.assertIsNone(window.percentile(95, min_samples=20))
+
+
+class TestHedgedRequests(unittest.TestCase):
+
+    def setUp(self):
+        environ = mock.patch.dict(os.environ, {
+            'SCHEMES': 'http', 'UPSTREAM_HEDGE_PERCENTILE': '50'})
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.loop = asyncio.new_event_loop()
+        self.calls = list()
+        window = LatencyWindow()
+        for _ in range(20):
+            window.add(0.05)
+        requisitions_service.recent_latency[('detect', 'stub')] = window
+
+    def tearDown(self):
+        requisitions_service.recent_latency.clear()
+        self.loop.close()
+
+    def service(self, latencies):
+        """Service whose calls answer after the given latencies in turn."""
+        service = RequisitionsService(Deadline(5.0))
+
+        async def make_requests(session, ep, timeout=None):
+            latency = latencies[len(self.calls)]
+            self.calls.append(latency)
+            await asyncio.sleep(latency)
+            return [200, latency, ep[2]]
+        service._RequisitionsService__make_requests = make_requests
+        return service
+
+    def post(self, service):
+        endpoint = ['http://stub/image/face-detect', b'{}', 'img_1', 'detect']
+        return self.loop.run_until_complete(
+            service._RequisitionsService__hedged_request(None, endpoint))
+
+    def test_fast_call_not_hedged(self):
+        self.assertEqual(self.post(self.service([0.001, 0.001]))[1], 0.001)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_slow_call_hedged(self):
+        self.assertEqual(self.post(self.service([1.0, 0.001]))[1], 0.001)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_hedging_disabled(self):
+        with mock.patch.dict(os.environ, {'UPSTREAM_HEDGE_PERCENTILE': '0'}):
+            self.assertEqual(
+                self.post(self.service([0.05, 0.001]))[1], 0.05)
+        self.assertEqual(len(self.calls), 1)
+
+
+class TestUpstreamFailures(StubUpstreamsTestCase):
+    """Calls to a stub encoder answering 503 on a local port."""
+    stub_options = {'latency_ms': 0.0, 'error_rate': 1.0,
+                    'error_status': 503}
+    environ = {'UPSTREAM_BREAKER_FAILURES': '2'}
+
+    def post(self):
+        with self.assertRaises(HTTPException) as context:
+            self.loop.run_until_complete(RequisitionsService().post(
+                [self.url('/image/face-encoding'),
+                 b'{"b64_image":"YQ=="}', 'img_1', 'encode']))
+        return context.exception.code
+
+    def test_unavailable_upstream_is_a_failure(self):
+        self.assertEqual([self.post(), self.post()], [424, 424])
+        # The fast errors do not lower the hedge delay.
+        self.assertNotIn(('encode', self.host),
+                         requisitions_service.recent_latency)
+        limiter = AdaptiveLimiter.instance('encode', self.host)
+        self.assertLess(limiter.limit, 16)
+        self.assertEqual(CircuitBreaker.instance('encode', self.host).state,
+                         CircuitBreaker.open)
+        # The open circuit fails fast, without calling the upstream.
+        self.assertEqual(self.post(), 424)
+        self.assertEqual(self.stubs.calls['encode'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
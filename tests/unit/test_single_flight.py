@@ -0,0 +1,104 @@
+import asyncio
+import unittest
+
+from werkzeug.exceptions import HTTPException, abort
+
+from face_similarity.utils.single_flight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.single_flight = SingleFlight()
+        self.started = 0
+
+    def tearDown(self):
+        self.loop.close()
+
+    def gather(self, *coroutines, **kwargs):
+        async def scenario():
+            return await asyncio.gather(*coroutines, **kwargs)
+        return self.loop.run_until_complete(scenario())
+
+    async def work(self, result=1, error=None):
+        self.started += 1
+        await asyncio.sleep(0.01)
+        if error is not None:
+            abort(error)
+        return result
+
+    def test_concurrent_calls_share_the_work(self):
+        results = self.gather(*(
+            self.single_flight.run('a', self.work) for _ in range(5)))
+        self.assertEqual(results, [1] * 5)
+        self.assertEqual(self.started, 1)
+        self.assertFalse(self.single_flight.calls)
+
+    def test_different_keys(self):
+        self.gather(self.single_flight.run('a', self.work),
+                    self.single_flight.run('b', self.work))
+        self.assertEqual(self.started, 2)
+
+    def test_later_calls_start_again(self):
+        for _ in range(2):
+            self.loop.run_until_complete(self.single_flight.run(
+                'a', self.work))
+        self.assertEqual(self.started, 2)
+
+    def test_error_is_shared(self):
+        results = self.gather(*(
+            self.single_flight.run('a', lambda: self.work(error=403))
+            for _ in range(3)), return_exceptions=True)
+        self.assertEqual(self.started, 1)
+        for result in results:
+            self.assertIsInstance(result, HTTPException)
+            self.assertEqual(result.code, 403)
+
+    def test_caller_with_time_left_retries_the_timeout(self):
+        results = self.gather(
+            self.single_flight.run('a', lambda: self.work(error=504)),
+            self.single_flight.run(
+                'a', self.work, lambda error: error.code == 504),
+            return_exceptions=True)
+        self.assertEqual(self.started, 2)
+        self.assertEqual(results[0].code, 504)
+        self.assertEqual(results[1], 1)
+        self.assertFalse(self.single_flight.calls)
+
+    def test_caller_out_of_time_inherits_the_timeout(self):
+        results = self.gather(
+            self.single_flight.run('a', lambda: self.work(error=504)),
+            self.single_flight.run('a', self.work, lambda error: False),
+            return_exceptions=True)
+        self.assertEqual(self.started, 1)
+        self.assertEqual([result.code for result in results], [504, 504])
+
+    def test_cancelled_caller_does_not_cancel_the_others(self):
+        async def scenario():
+            first = asyncio.ensure_future(
+                self.single_flight.run('a', self.work))
+            second = asyncio.ensure_future(
+                self.single_flight.run('a', self.work))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+        self.assertEqual(self.loop.run_until_complete(scenario()), 1)
+        self.assertEqual(self.started, 1)
+
+    def test_work_cancelled_when_every_caller_left(self):
+        async def scenario():
+            caller = asyncio.ensure_future(
+                self.single_flight.run('a', self.work))
+            await asyncio.sleep(0)
+            task = self.single_flight.calls['a'][0]
+            caller.cancel()
+            await asyncio.sleep(0)
+            return task
+        task = self.loop.run_until_complete(scenario())
+        self.assertTrue(task.cancelled())
+        self.assertFalse(self.single_flight.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()